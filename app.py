@@ -1,4 +1,4 @@
-import os, re, sqlite3, datetime as dt
+import os, re, sqlite3, asyncio, datetime as dt
 import streamlit as st
 from dotenv import load_dotenv
 load_dotenv()
@@ -7,7 +7,14 @@ from rag.config import settings
 from rag.store import DualIndexStore
 from rag.ingest import ingest_csv
 from rag.retriever import HybridRetriever
-from rag.graph import build_graph, RAGState
+from rag.graph import build_graph, prewarm_llm_client, request_deadline, stale_ids, RAGState
+from rag.doctable import Offer
+from rag.query_log import query_log
+from rag.warm import Warmer
+from rag.conversation import Conversation
+from rag.rerank import get_reranker
+from rag.availability import get_checker
+from rag.pagination import cursors
 
 # Debug API key
 api_key = os.getenv('OPENAI_API_KEY')
@@ -21,7 +28,7 @@ st.title("🎉 SahraEvent — Fast, Reliable, Low-Cost RAG")
 #     st.markdown("""
 # - BM25 keyword search with metadata filters (FAISS disabled for stability)
 # - LangGraph orchestration: slot extraction → retrieval → validation → composition
-# - Dual index architecture (stable + hot) with 14-day staleness detection
+# - Dual index architecture (stable + hot) with 14-day staleness detection and freshness tiering
 # - Tiered models via `litellm` — set `OPENAI_API_KEY` in your environment
 # - TTL-based caching for queries and completions
 #     """)
@@ -32,6 +39,9 @@ def init_session_state():
         st.session_state.filters_applied = {"city": "", "occasion": "", "headcount": 0, "budget": 0, "date": ""}
     if "auto_search" not in st.session_state:
         st.session_state.auto_search = False
+    if "conversation" not in st.session_state:
+        # previous turn's slots + candidates, so refinements skip the LLM and re-ranking
+        st.session_state.conversation = Conversation()
     # Store will be initialized only when searching, not on filter changes
 
 # Sidebar filters
@@ -65,7 +75,7 @@ def render_filters():
     if applied["date"]: st.sidebar.write(f"📅 Date: {applied['date']}")
 
 # Main search function using LangGraph
-async def run_langgraph_search(query, store, retriever, graph, applied_filters, run_id):
+async def run_langgraph_search(query, store, retriever, graph, applied_filters, run_id, conversation=None):
     """Run LangGraph search with all dependencies passed in (no session state access)"""
     print()
     print("=" * 80)
@@ -88,11 +98,14 @@ async def run_langgraph_search(query, store, retriever, graph, applied_filters,
             "docs": None,
             "validation": None,
             "answer": None,
-            "applied_filters": applied_filters
+            "applied_filters": applied_filters,
+            "deadline": request_deadline(),
+            "conversation": conversation,
         }
         
         print(f"🔍 Running LangGraph pipeline (RUN ID: {run_id})...")
         result = await graph.ainvoke(initial_state)
+        query_log.record(query, applied_filters, result.get("slots"))
         
         print()
         print("=" * 80)
@@ -102,6 +115,10 @@ async def run_langgraph_search(query, store, retriever, graph, applied_filters,
         print(f"   Documents retrieved: {len(result.get('docs', []))}")
         print(f"   Validation issues: {result.get('validation', {}).get('missing', [])}")
         print(f"   Stale documents: {result.get('validation', {}).get('stale_ids', [])}")
+        if result.get("refinement"):
+            print(f"   ♻️ Refinement of: '{result.get('search_query')}'")
+        if result.get("degraded"):
+            print(f"   ⏱️ Degraded to stay within {settings.request_slo_s}s: {result['degraded']}")
         answer = result.get('answer', '')
         print(f"   Answer length: {len(answer)} chars")
         print(f"   📝 Final Answer:")
@@ -111,11 +128,14 @@ async def run_langgraph_search(query, store, retriever, graph, applied_filters,
         print("=" * 80)
         print()
         
+        # API boundary: hand the UI standalone Offer records instead of table views
         return {
             "answer": result.get("answer", "No answer generated"),
-            "docs": result.get("docs", []),
+            "docs": [_to_offer(d) for d in result.get("docs", []) or []],
             "validation": result.get("validation", {"missing": [], "stale_ids": []}),
-            "slots": result.get("slots", {})
+            "slots": result.get("slots", {}),
+            "availability": result.get("availability") or {},
+            "cursor": result.get("cursor"),
         }
         
     except Exception as e:
@@ -129,6 +149,58 @@ async def run_langgraph_search(query, store, retriever, graph, applied_filters,
             "slots": {}
         }
 
+def _to_offer(doc):
+    if hasattr(doc, "record"):
+        offer = doc.record()
+        offer.snippet = doc.get("snippet", offer.snippet)
+        return offer
+    meta = doc.get("meta", {})
+    return Offer(**{**meta, "snippet": doc.get("snippet", "")})
+
+# Process-wide resources: every session shares one store, retriever and
+# graph, and the tiering scheduler, ingest queue / webhook (one port) and
+# warmer run once per process rather than per session.
+@st.cache_resource
+def get_store() -> DualIndexStore:
+    print("🔍 Initializing store for search...")
+    store = DualIndexStore(settings.embed_model)
+    if store.count():
+        # Keep what is already there, including offers ingested by the webhook
+        store.build_indexes()
+    else:
+        ingest_csv("data/vendors.csv", store, mark_hot=False)
+    print("✅ Store initialized for search")
+    return store
+
+@st.cache_resource
+def get_ingest_queue(_store: DualIndexStore):
+    from rag.ingest_queue import IngestQueue, serve_webhook
+    queue = IngestQueue(_store).start()
+    queue.webhook = serve_webhook(queue)
+    return queue
+
+@st.cache_resource
+def get_tiering(_store: DualIndexStore):
+    from rag.tiering import TieringScheduler
+    return TieringScheduler(_store).start()
+
+@st.cache_resource
+def get_retriever(_store: DualIndexStore):
+    if settings.retrieval_workers > 0:
+        from rag.workers import RetrievalPool
+        return RetrievalPool(_store, settings.retrieval_workers)
+    return HybridRetriever(_store)
+
+@st.cache_resource
+def get_graph(_retriever):
+    prewarm_llm_client()
+    get_reranker()  # loads the cross-encoder on its worker thread meanwhile
+    return build_graph(_retriever)
+
+@st.cache_resource
+def get_warmer(_graph, _retriever) -> Warmer:
+    return Warmer(_graph, _retriever).start()
+
 # Synchronous wrapper for LangGraph
 def run_search(query):
     import asyncio
@@ -141,23 +213,26 @@ def run_search(query):
     # Initialize store, retriever, and graph (in main thread with session state access)
     try:
         if "store" not in st.session_state:
-            print("🔍 Initializing store for search...")
-            store = DualIndexStore(settings.embed_model)
-            store.clear()  # Clear existing data to avoid duplicates
-            ingest_csv("data/vendors.csv", store, mark_hot=False)
+            store = get_store()
             st.session_state.store = store
-            print("✅ Store initialized for search")
+            if settings.tiering_enabled:
+                st.session_state.tiering = get_tiering(store)
+            if settings.ingest_webhook_enabled:
+                st.session_state.ingest_queue = get_ingest_queue(store)
         
         if "retriever" not in st.session_state:
-            st.session_state.retriever = HybridRetriever(st.session_state.store)
+            st.session_state.retriever = get_retriever(st.session_state.store)
         if "graph" not in st.session_state:
-            st.session_state.graph = build_graph(st.session_state.retriever)
+            st.session_state.graph = get_graph(st.session_state.retriever)
+        if settings.warm_enabled and "warmer" not in st.session_state:
+            st.session_state.warmer = get_warmer(st.session_state.graph, st.session_state.retriever)
         
         # Capture all needed values before entering thread
         store = st.session_state.store
         retriever = st.session_state.retriever
         graph = st.session_state.graph
         applied_filters = st.session_state.filters_applied
+        conversation = st.session_state.conversation
         
     except Exception as e:
         print(f"❌ Initialization Error: {str(e)}")
@@ -176,16 +251,17 @@ def run_search(query):
         asyncio.set_event_loop(loop)
         try:
             return loop.run_until_complete(
-                run_langgraph_search(query, store, retriever, graph, applied_filters, run_id)
+                run_langgraph_search(query, store, retriever, graph, applied_filters, run_id, conversation)
             )
         finally:
             loop.close()
     
+    # Always use thread executor in Streamlit to avoid event loop conflicts
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
     try:
-        # Always use thread executor in Streamlit to avoid event loop conflicts
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            future = executor.submit(_run_async)
-            return future.result(timeout=30)  # 30 second timeout
+        future = executor.submit(_run_async)
+        # nodes degrade to meet request_slo_s; this only catches a wedged pipeline
+        return future.result(timeout=settings.request_slo_s + 5)
     except concurrent.futures.TimeoutError:
         print(f"❌ Timeout Error: Search took too long")
         return {
@@ -204,7 +280,13 @@ def run_search(query):
             "validation": {"missing": [], "stale_ids": []},
             "slots": {}
         }
+    finally:
+        # don't block on a wedged run (the `with` form would wait for it)
+        executor.shutdown(wait=False)
+
 
+AVAILABILITY_BADGES = {"available": " ✅ Available on your date", "unavailable": " ⛔ Booked on your date",
+                       "pending": " ⏳ Availability pending verification"}
 
 # Initialize and render UI
 init_session_state()
@@ -222,6 +304,19 @@ query = st.text_input(
     help="Press Enter to search automatically"
 )
 
+# Typeahead: completions from the in-memory prefix index (no SQLite / LLM).
+# Streamlit only reruns on Enter, so these double as related searches.
+def use_suggestion(text):
+    st.session_state.query_input = text
+    st.session_state.auto_search = True
+
+typeahead = getattr(st.session_state.get("store"), "typeahead", None)
+if typeahead is not None and query.strip():
+    suggestions = [s for s in typeahead.suggest(query) if s["text"].lower() != query.strip().lower()][:4]
+    if suggestions:
+        for col, s in zip(st.columns(len(suggestions)), suggestions):
+            col.button(s["text"], key=f"suggest_{s['kind']}_{s['text']}", on_click=use_suggestion, args=(s["text"],))
+
 # Search logic - simplified to avoid session state conflicts
 search_button = st.button("Search & Compose")
 should_search = (search_button and query.strip()) or (st.session_state.auto_search and query.strip())
@@ -240,49 +335,94 @@ if should_search:
         print(f"🔍 Answer length: {len(res.get('answer', ''))}")
         print(f"🔍 Docs count: {len(res.get('docs', []))}")
         
-        # Display results immediately (no session state storage - just show it)
-        st.success("✅ Search completed! Here are your results:")
-        
-        missing = res.get("validation", {}).get("missing", [])
-        stale_ids = set(res.get("validation", {}).get("stale_ids", []))
-        docs = res.get("docs", [])
-        
-        # Only show missing info warning if we have no results or many ambiguous results
-        if missing and (not docs or len(docs) > 5):
-            st.info(f"💡 To get better results, try adding: {', '.join(missing)}")
-        
-        if docs:
-            st.subheader("Top candidates")
-            for i, d in enumerate(docs[:3]):
-                try:
-                    meta = d.get("meta", {})
-                    sid = meta.get("id", f"doc_{i}")
-                    title = meta.get("title", "Unknown Title")
-                    city = meta.get("city", "Unknown City")
-                    hmin = meta.get("headcount_min", 0)
-                    hmax = meta.get("headcount_max", 0)
-                    pmin = meta.get("price_min", 0)
-                    pmax = meta.get("price_max", 0)
-                    updated = meta.get("updated_at", "Unknown")
-                    
-                    staleness = "🕑 Stale — please reconfirm" if sid in stale_ids else ""
-                    snippet = d.get('snippet', '')
-                    
-                    st.markdown(f"**{title}** · {city} · Capacity {hmin}-{hmax} · AED {int(pmin)}-{int(pmax)}  {staleness}  \n_{snippet}_  \nUpdated: {updated}  \n**Citation:** [#{sid}]")
-                    st.divider()
-                except Exception as e:
-                    st.error(f"Error displaying document {i}: {str(e)}")
-                    continue
-        
-        st.subheader("Assistant reply")
-        answer = res.get("answer", "(no answer)")
-        st.write(answer)
-        print(f"🔍 Display complete!")
+        # Kept in session state so "More results" (a rerun) can add pages to it
+        st.session_state.result = res
+        st.session_state.result_pages = []
         
     except Exception as e:
         print(f"❌ Search exception: {e}")
         import traceback
         traceback.print_exc()
+        st.session_state.result = None
         st.error(f"Search failed: {str(e)}")
 
+def render_doc(i, d, stale_ids, availability):
+    try:
+        sid = d.id if d.id is not None else f"doc_{i}"
+        title = d.title or "Unknown Title"
+        city = d.city or "Unknown City"
+        hmin = d.headcount_min or 0
+        hmax = d.headcount_max or 0
+        pmin = d.price_min or 0
+        pmax = d.price_max or 0
+        updated = d.updated_at or "Unknown"
+        
+        staleness = "🕑 Stale — please reconfirm" if sid in stale_ids else ""
+        staleness += AVAILABILITY_BADGES.get(availability.get(sid), "")
+        snippet = d.snippet or ''
+        
+        st.markdown(f"**{title}** · {city} · Capacity {hmin}-{hmax} · AED {int(pmin)}-{int(pmax)}  {staleness}  \n_{snippet}_  \nUpdated: {updated}  \n**Citation:** [#{sid}]")
+        st.divider()
+    except Exception as e:
+        st.error(f"Error displaying document {i}: {str(e)}")
+
+def load_more():
+    """Next page from the search's cursor: no re-ranking, no LLM call."""
+    res = st.session_state.result
+    page = cursors.page(st.session_state.store, res.get("cursor"), len(st.session_state.result_pages) + 1)
+    if page is None:
+        res["cursor"] = None
+        st.session_state.result_expired = True
+        return
+    docs, has_more = page
+    # staleness and availability of this page's own offers, like the first page's
+    date = (res.get("slots") or {}).get("date")
+    checker = get_checker()
+    availability = {}
+    if date and checker is not None and docs:
+        availability = asyncio.run(checker.check([(d["id"], d["meta"].get("vendor_id")) for d in docs],
+                                                 str(date), settings.availability_timeout_s))
+    st.session_state.result_pages.append({"docs": [_to_offer(d) for d in docs],
+                                          "stale_ids": set(stale_ids(st.session_state.store, docs)),
+                                          "availability": availability})
+    if not has_more:
+        res["cursor"] = None
+
+res = st.session_state.get("result")
+if res:
+    # Display results
+    st.success("✅ Search completed! Here are your results:")
+    
+    missing = res.get("validation", {}).get("missing", [])
+    top_stale_ids = set(res.get("validation", {}).get("stale_ids", []))
+    availability = res.get("availability") or {}
+    docs = res.get("docs", [])
+    
+    # Validation only reports missing info for no results or many ambiguous results
+    if missing:
+        st.info(f"💡 To get better results, try adding: {', '.join(missing)}")
+    
+    if docs:
+        st.subheader("Top candidates")
+        for i, d in enumerate(docs[:3]):
+            render_doc(i, d, top_stale_ids, availability)
+    
+    st.subheader("Assistant reply")
+    answer = res.get("answer", "(no answer)")
+    st.write(answer)
+    
+    pages = st.session_state.get("result_pages", [])
+    if pages:
+        st.subheader("More results")
+        i = len(docs)
+        for page in pages:
+            for d in page["docs"]:
+                render_doc(i, d, page["stale_ids"], page["availability"])
+                i += 1
+    if st.session_state.pop("result_expired", False):
+        st.info("These results have expired; search again to see more.")
+    if docs and res.get("cursor"):
+        st.button("More results", on_click=load_more)
+    print(f"🔍 Display complete!")
+
 st.caption("💡 Use the sidebar filters or natural language to narrow down results")
\ No newline at end of file
@@ -0,0 +1,154 @@
+import json, re, unicodedata
+from functools import lru_cache
+from typing import Dict, Any, Iterable, List, Optional
+
+import numpy as np
+
+from .config import settings
+
+# Short English list plus the boilerplate words every offer text carries
+STOPWORDS = frozenset("""
+a an and are as at be but by for from has have i in into is it its me my of on or our
+so that the their them then there these they this to up us was we were what when where
+which who will with you your
+city capacity price occasions tags pax
+""".split())
+
+_TOKEN = re.compile(r"[^\W_]+", re.UNICODE)
+_VOWELS = set("aeiouy")
+
+def normalize_text(text: str) -> str:
+    """NFKC + casefold so "Dubai;", "DUBAI" and "dubai" collapse to one term."""
+    return unicodedata.normalize("NFKC", str(text)).casefold()
+
+def light_stem(tok: str) -> str:
+    """Plural / -ed / -ing stripping (a subset of Porter step 1)."""
+    if len(tok) <= 3 or not tok.isalpha():
+        return tok
+    if tok.endswith("sses"):
+        tok = tok[:-2]
+    elif tok.endswith("ies"):
+        tok = tok[:-3] + "y"
+    elif tok.endswith("s") and not tok.endswith("ss") and not tok.endswith("us"):
+        tok = tok[:-1]
+    for suf in ("ing", "ed"):
+        stem = tok[:-len(suf)]
+        if tok.endswith(suf) and len(stem) >= 3 and _VOWELS & set(stem):
+            # "wedding" -> "wedd" -> "wed"
+            if len(stem) > 3 and stem[-1] == stem[-2] and stem[-1] not in "lsz":
+                stem = stem[:-1]
+            tok = stem
+            break
+    return tok
+
+class Vocabulary:
+    """Token <-> int32 id mapping; frozen once the index is built."""
+    def __init__(self, tokens: Optional[List[str]] = None):
+        self.tokens: List[str] = list(tokens or [])
+        self.ids: Dict[str, int] = {t: i for i, t in enumerate(self.tokens)}
+        self.frozen = bool(tokens)
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def add(self, tok: str) -> int:
+        i = self.ids.get(tok)
+        if i is None:
+            if self.frozen:
+                raise ValueError("vocabulary is frozen")
+            i = len(self.tokens)
+            self.ids[tok] = i
+            self.tokens.append(tok)
+        return i
+
+    def get(self, tok: str) -> int:
+        """Id of `tok`, or -1 if it is out of vocabulary."""
+        return self.ids.get(tok, -1)
+
+    def freeze(self) -> "Vocabulary":
+        self.frozen = True
+        return self
+
+    def to_json(self) -> str:
+        return json.dumps(self.tokens, ensure_ascii=False)
+
+    @classmethod
+    def from_json(cls, s: str) -> "Vocabulary":
+        return cls(json.loads(s)).freeze()
+
+class Analyzer:
+    """Text -> int32 term ids; the single tokenizer for both indexing and querying."""
+    def __init__(self, stem: Optional[bool] = None, stopwords: Optional[Iterable[str]] = None,
+                 vocab: Optional[Vocabulary] = None, query_cache_size: Optional[int] = None):
+        self.stem = settings.analyzer_stem if stem is None else stem
+        if stopwords is None:
+            stopwords = STOPWORDS if settings.analyzer_stopwords else ()
+        self.stopwords = frozenset(stopwords)
+        self.vocab = vocab or Vocabulary()
+        size = settings.query_analysis_cache_size if query_cache_size is None else query_cache_size
+        self._analyze_query = lru_cache(maxsize=size)(self._encode_query)
+
+    def tokens(self, text: str) -> List[str]:
+        out = []
+        for tok in _TOKEN.findall(normalize_text(text)):
+            if tok in self.stopwords:
+                continue
+            out.append(light_stem(tok) if self.stem else tok)
+        return out
+
+    def fit(self, texts: Iterable[str]) -> List[np.ndarray]:
+        """Tokenize a corpus, growing the vocabulary, then freeze it."""
+        if self.vocab.frozen:
+            raise ValueError("analyzer already fitted")
+        add = self.vocab.add
+        docs = [np.fromiter((add(t) for t in self.tokens(text)), dtype=np.int32) for text in texts]
+        self.vocab.freeze()
+        self._analyze_query.cache_clear()
+        return docs
+
+    def extend(self, texts: Iterable[str]) -> List[np.ndarray]:
+        """Tokenize new documents after `fit`, appending their unseen terms.
+
+        Existing term ids never change, so indexes built earlier stay valid
+        (they just have no postings for the new ids).
+        """
+        self.vocab.frozen = False
+        try:
+            add = self.vocab.add
+            docs = [np.fromiter((add(t) for t in self.tokens(text)), dtype=np.int32) for text in texts]
+        finally:
+            self.vocab.freeze()
+        # queries analyzed before may contain terms that now exist
+        self._analyze_query.cache_clear()
+        return docs
+
+    def encode(self, text: str) -> np.ndarray:
+        """Term ids of `text` against the frozen vocabulary (OOV terms dropped)."""
+        get = self.vocab.get
+        ids = [i for i in (get(t) for t in self.tokens(text)) if i >= 0]
+        return np.array(ids, dtype=np.int32)
+
+    def _encode_query(self, query: str) -> np.ndarray:
+        ids = self.encode(query)
+        ids.setflags(write=False)  # shared between callers via the memo
+        return ids
+
+    def analyze_query(self, query: str) -> np.ndarray:
+        """Memoized `encode` for queries."""
+        return self._analyze_query(" ".join(query.split()))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"stem": self.stem, "stopwords": sorted(self.stopwords), "vocab": self.vocab.tokens}
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> "Analyzer":
+        return cls(stem=d["stem"], stopwords=d["stopwords"], vocab=Vocabulary(d["vocab"]).freeze())
+
+    def save(self, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path: str) -> "Analyzer":
+        with open(path, encoding="utf-8") as f:
+            return cls.from_dict(json.load(f))
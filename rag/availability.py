@@ -0,0 +1,128 @@
+"""Vendor availability checks for the top candidates on the requested date.
+
+A provider answers one batched request per vendor: which of these offers
+are free on this date. `AvailabilityChecker` fans those requests out
+concurrently, serves repeats from a short-TTL cache, and bounds the whole
+check by a deadline. Offers whose answer did not arrive in time come back
+as "pending" (and are not cached), and the composer then says "pending
+verification".
+
+Providers:
+- `HttpAvailabilityProvider`: POSTs `{"vendor_id", "offer_ids", "date"}` to
+  `settings.availability_url` and expects `{"<offer id>": "<status>"}`;
+- `LocalAvailabilityProvider`: in-process stand-in for demos and load tests
+  (deterministic per offer/date, explicit blocks, optional simulated latency).
+  Its answers are made up, so it only runs with `availability_provider="demo"`.
+
+Checks are off by default: without a real provider the composer is told
+nothing about availability rather than something invented.
+"""
+import abc, asyncio, hashlib, json, urllib.request
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from .config import settings
+from .utils import TTLCache
+
+AVAILABLE, UNAVAILABLE, PENDING = "available", "unavailable", "pending"
+
+class AvailabilityProvider(abc.ABC):
+    @abc.abstractmethod
+    async def check(self, vendor_id: str, offer_ids: List[int], date: str) -> Dict[int, str]:
+        """Status of each of one vendor's offers on `date` (ISO YYYY-MM-DD)."""
+
+class LocalAvailabilityProvider(AvailabilityProvider):
+    def __init__(self, unavailable_rate: float = 0.2, latency_s: float = 0.0,
+                 blocked: Iterable[Tuple[int, str]] = ()):
+        self.unavailable_rate = unavailable_rate
+        self.latency_s = latency_s
+        self.blocked: Set[Tuple[int, str]] = set(blocked)
+        self.calls = 0
+
+    def block(self, offer_id: int, date: str):
+        self.blocked.add((int(offer_id), date))
+
+    def _status(self, offer_id: int, date: str) -> str:
+        if (offer_id, date) in self.blocked:
+            return UNAVAILABLE
+        h = int(hashlib.md5(f"{offer_id}|{date}".encode()).hexdigest()[:8], 16) / 0xFFFFFFFF
+        return UNAVAILABLE if h < self.unavailable_rate else AVAILABLE
+
+    async def check(self, vendor_id, offer_ids, date):
+        self.calls += 1
+        if self.latency_s:
+            await asyncio.sleep(self.latency_s)
+        return {i: self._status(i, date) for i in offer_ids}
+
+class HttpAvailabilityProvider(AvailabilityProvider):
+    def __init__(self, url: str, token: Optional[str] = None):
+        self.url = url
+        self.token = token
+
+    def _post(self, body: bytes, timeout: float) -> Dict[str, str]:
+        headers = {"Content-Type": "application/json"}
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        req = urllib.request.Request(self.url, data=body, headers=headers, method="POST")
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            return json.load(resp)
+
+    async def check(self, vendor_id, offer_ids, date):
+        body = json.dumps({"vendor_id": vendor_id, "offer_ids": offer_ids, "date": date}).encode()
+        # the checker's deadline cancels the await; the socket timeout frees the thread
+        out = await asyncio.to_thread(self._post, body, settings.availability_timeout_s)
+        return {int(k): str(v) for k, v in out.items()}
+
+def get_provider() -> Optional[AvailabilityProvider]:
+    if settings.availability_provider == "demo":
+        print("⚠️  Availability from the demo stand-in: statuses are invented, not for real users")
+        return LocalAvailabilityProvider()
+    if settings.availability_provider == "http":
+        return HttpAvailabilityProvider(settings.availability_url, settings.availability_token)
+    return None
+
+class AvailabilityChecker:
+    def __init__(self, provider: AvailabilityProvider, ttl_s: Optional[float] = None):
+        self.provider = provider
+        self.cache = TTLCache(ttl_seconds=settings.availability_ttl_s if ttl_s is None else ttl_s, max_items=4096)
+
+    async def _vendor(self, vendor_id: str, offer_ids: List[int], date: str) -> Dict[int, str]:
+        try:
+            out = await self.provider.check(vendor_id, offer_ids, date)
+        except Exception as e:
+            print(f"   ⚠️ Availability check for vendor {vendor_id} failed: {type(e).__name__}: {e}")
+            return {}
+        for oid, status in out.items():
+            if status in (AVAILABLE, UNAVAILABLE):
+                self.cache.set(f"{oid}|{date}", status)
+        return out
+
+    async def check(self, offers: List[Tuple[int, str]], date: str, timeout_s: float) -> Dict[int, str]:
+        """Status per offer id for (offer id, vendor id) pairs; misses past `timeout_s` are pending."""
+        status: Dict[int, str] = {}
+        by_vendor: Dict[str, List[int]] = defaultdict(list)
+        for oid, vendor in offers:
+            hit = self.cache.get(f"{oid}|{date}")
+            if hit is not None:
+                status[oid] = hit
+            else:
+                by_vendor[vendor].append(oid)
+        if by_vendor:
+            tasks = [asyncio.ensure_future(self._vendor(v, ids, date)) for v, ids in by_vendor.items()]
+            done, late = await asyncio.wait(tasks, timeout=timeout_s)
+            for t in late:
+                t.cancel()
+            for t in done:
+                status.update(t.result())
+        return {oid: status.get(oid, PENDING) for oid, _ in offers}
+
+_checker: Optional[AvailabilityChecker] = None
+
+def get_checker() -> Optional[AvailabilityChecker]:
+    """Process-wide checker for the configured provider (None when disabled)."""
+    global _checker
+    if _checker is None:
+        provider = get_provider()
+        if provider is not None:
+            _checker = AvailabilityChecker(provider)
+    return _checker
@@ -0,0 +1,88 @@
+from typing import Dict, List, NamedTuple, Optional
+import numpy as np
+
+class CorpusStats(NamedTuple):
+    """Collection statistics; sharing them makes scores comparable across shards."""
+    n_docs: int
+    avgdl: float
+    idf: np.ndarray
+
+def corpus_stats(docs: List[np.ndarray], vocab_size: int, epsilon: float = 0.25) -> CorpusStats:
+    n_docs = len(docs)
+    lens = np.array([len(d) for d in docs], dtype=np.float64)
+    uniq = [np.unique(d) for d in docs]
+    df = np.bincount(np.concatenate(uniq), minlength=vocab_size).astype(np.float64) if n_docs else np.zeros(vocab_size)
+    present = df > 0
+    idf = np.zeros(vocab_size, dtype=np.float64)
+    idf[present] = np.log(n_docs - df[present] + 0.5) - np.log(df[present] + 0.5)
+    if present.any():
+        # rank_bm25: negative idf (very common terms) floored at epsilon * mean idf
+        eps = epsilon * idf[present].mean()
+        idf[present & (idf < 0)] = eps
+    return CorpusStats(n_docs, float(lens.mean()) if n_docs else 0.0, idf)
+
+class BM25Index:
+    """Okapi BM25 over int32 term-id documents, stored as CSR posting lists.
+
+    Scoring matches `rank_bm25.BM25Okapi` (same idf floor and k1/b defaults),
+    but each posting already carries its length-normalized tf weight, so a
+    query term costs one slice and one scatter-add. Pass `stats` to score a
+    subset (shard) of a larger collection with that collection's idf/avgdl.
+    """
+    def __init__(self, docs: List[np.ndarray], vocab_size: int,
+                 k1: float = 1.5, b: float = 0.75, epsilon: float = 0.25,
+                 stats: Optional[CorpusStats] = None):
+        self.k1, self.b, self.epsilon = k1, b, epsilon
+        self.n_docs = len(docs)
+        self.vocab_size = vocab_size
+        self.doc_len = np.array([len(d) for d in docs], dtype=np.int32)
+        if stats is None:
+            stats = corpus_stats(docs, vocab_size, epsilon)
+        self.avgdl = stats.avgdl
+        self.idf = stats.idf
+
+        # (term, doc) pairs -> counts, sorted by term then doc
+        terms = np.concatenate(docs).astype(np.int64) if self.n_docs else np.zeros(0, dtype=np.int64)
+        owner = np.repeat(np.arange(self.n_docs, dtype=np.int64), self.doc_len)
+        keys, tf = np.unique(terms * max(self.n_docs, 1) + owner, return_counts=True)
+        post_terms = keys // max(self.n_docs, 1)
+        self.post_docs = (keys % max(self.n_docs, 1)).astype(np.int32)
+        self.term_offsets = np.zeros(vocab_size + 1, dtype=np.int64)
+        np.add.at(self.term_offsets, post_terms + 1, 1)
+        self.term_offsets = np.cumsum(self.term_offsets)
+
+        norm = self.k1 * (1 - self.b + self.b * self.doc_len / self.avgdl) if self.avgdl else np.ones(self.n_docs)
+        tf = tf.astype(np.float64)
+        self.post_weight = (tf * (self.k1 + 1) / (tf + norm[self.post_docs])).astype(np.float32)
+
+    # Arrays needed for scoring; enough to rebuild the index over shared memory
+    ARRAYS = ("term_offsets", "post_docs", "post_weight", "idf")
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        return {name: getattr(self, name) for name in self.ARRAYS}
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray], n_docs: int, avgdl: float,
+                    k1: float = 1.5, b: float = 0.75, epsilon: float = 0.25) -> "BM25Index":
+        """Score-only index over existing arrays (no copy, no doc lengths)."""
+        self = cls.__new__(cls)
+        self.k1, self.b, self.epsilon = k1, b, epsilon
+        self.n_docs = n_docs
+        self.avgdl = avgdl
+        self.doc_len = None
+        for name in cls.ARRAYS:
+            setattr(self, name, arrays[name])
+        self.vocab_size = len(self.term_offsets) - 1
+        return self
+
+    def get_scores(self, query_ids: np.ndarray) -> np.ndarray:
+        scores = np.zeros(self.n_docs, dtype=np.float64)
+        for t in query_ids:
+            if t < 0 or t >= self.vocab_size:
+                continue
+            lo, hi = self.term_offsets[t], self.term_offsets[t + 1]
+            if lo == hi:
+                continue
+            # doc ids are unique within one posting list, so fancy-index += is safe
+            scores[self.post_docs[lo:hi]] += self.idf[t] * self.post_weight[lo:hi]
+        return scores
@@ -1,10 +1,58 @@
 import json, os
+from typing import Any, Dict
+import numpy as np
 from .utils import TTLCache, hash_key, normalize_query, lf_bucket
 
-qr_cache = TTLCache(ttl_seconds=21600, max_items=512)   # 6h
+qr_cache = TTLCache(ttl_seconds=21600, max_items=512)   # 6h, query -> extracted slots
+retrieval_cache = TTLCache(ttl_seconds=21600, max_items=1024)  # 6h, filters + query terms -> candidate ids
 completion_cache = TTLCache(ttl_seconds=86400, max_items=256)  # 24h
 
 def query_cache_key(query: str, city: str|None, occasion: str|None, headcount: int|None, budget: float|None, season: str|None):
     norm = normalize_query(query)
     parts = [norm, city or "", occasion or "", str((headcount or 0)//10*10), lf_bucket(budget or 0, step=1000), season or ""]
     return hash_key("|".join(parts))
+
+def slot_cache_key(query: str, applied_filters: Dict[str, Any] | None):
+    """Slots depend on the query text and the sidebar filters sent along with it."""
+    filters = json.dumps({k: v for k, v in (applied_filters or {}).items() if v}, sort_keys=True, default=str)
+    return hash_key(f"slots|{normalize_query(query)}|{filters}")
+
+def answer_cache_key(query: str, slots: Dict[str, Any] | None, availability: Dict[int, str] | None = None):
+    slots = slots or {}
+    key = query_cache_key(query, slots.get("city"), slots.get("occasion"), slots.get("headcount"), slots.get("budget"), None)
+    if availability:
+        # the answer states availability, so it is only reusable for the same statuses
+        key = hash_key(f"{key}|{json.dumps(sorted(availability.items()))}")
+    return key
+
+def compose_cache_key(query: str, slots: Dict[str, Any] | None, availability: Dict[int, str] | None = None,
+                      select: bool = False):
+    """Completion-cache key of a composed answer; `select` for the single-call node, whose entries also hold the picked ids."""
+    key = answer_cache_key(query, slots, availability)
+    return f"select|{key}" if select else key
+
+def canonical_filters(filters: Dict[str, Any] | None) -> str:
+    """Filters in one spelling: case-folded strings, integral numbers as ints, unset dropped."""
+    out = {}
+    for k, v in sorted((filters or {}).items()):
+        if not v:
+            continue
+        if isinstance(v, str):
+            v = " ".join(v.split()).casefold()
+        elif isinstance(v, float) and v.is_integer():
+            v = int(v)
+        out[k] = v
+    return json.dumps(out, sort_keys=True, default=str)
+
+def retrieval_cache_key(store, query: str, filters: Dict[str, Any] | None):
+    """Key shared by paraphrases: canonical filters + the analyzed query's term set.
+
+    "yacht for 25 in Dubai" and "Dubai yacht, 25 guests" analyze to the same
+    terms and (once slots are extracted) the same filters. The store's index
+    generation is part of the key, so every build / tier move invalidates it.
+    Dense legs embed the raw text, so with FAISS enabled the text is keyed too.
+    """
+    terms = np.unique(store.analyzer.analyze_query(query))
+    dense = store.faiss_stable is not None or store.faiss_hot is not None
+    text = normalize_query(query) if dense else ""
+    return hash_key(f"retrieval|{canonical_filters(filters)}|{terms.tobytes().hex()}|{text}|{store.generation}")
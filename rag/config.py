@@ -1,23 +1,109 @@
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Dict, List, Optional
 
 class Settings(BaseModel):
     # Embeddings and reranker
-    # NOTE: Currently disabled to prevent segfaults. BM25-only mode.
+    # NOTE: Dense embeddings are off by default (use_dense); retrieval is BM25, reordered by the cross-encoder.
     embed_model: str = "sentence-transformers/all-MiniLM-L6-v2"
     rerank_model: str = "cross-encoder/ms-marco-MiniLM-L-6-v2"
-    use_reranker: bool = False  # Disabled - enable once segfault issues resolved
+    use_reranker: bool = True   # batched + cached off the event loop (rag.rerank); torch loads on its worker thread
+    use_dense: bool = False     # FAISS + sentence-transformers legs; torch is only imported when on
 
     # Retrieval knobs
     ann_top_k: int = 24
     bm25_top_k: int = 24
     rrf_k: int = 60
-    keep_top_n: int = 15  # Fetch more initially to ensure diversity after deduplication
-    context_top_n: int = 3
-    ambiguity_delta: float = 0.06
+    # Per-leg RRF weights (dense_stable, dense_hot, bm25_stable, bm25_hot); missing legs default to 1.0
+    fusion_weights: Dict[str, float] = {}
+    context_top_n: int = 3  # Vendor-diverse docs materialized per search
+    mmr_lambda: float = 1.0  # < 1.0 also penalizes tag-similar offers (MMR); 1.0 = vendor collapse only
+
+    # Cross-encoder rerank stage (between ranking and materialization)
+    rerank_depth: int = 20            # fused candidates rescored per query
+    rerank_timeout_s: float = 0.25    # past this the fused order is kept
+    rerank_batch_size: int = 64       # pairs per predict() across concurrent requests
+    rerank_max_wait_ms: float = 5.0   # how long the worker waits to fill a batch
+    rerank_max_tokens: int = 256      # per (query, doc) pair; the MiniLM cross-encoder takes up to 512
+    rerank_cache_size: int = 20000
+    rerank_cache_ttl_s: float = 86400.0
+
+    # Index sharding (always by city; occasion splits each city further)
+    shard_by_occasion: bool = False
+
+    # Retrieval worker processes over shared-memory indexes (0 = rank in-process)
+    retrieval_workers: int = 0
+    retrieval_refresh_min_s: float = 5.0  # at most one re-export per this many seconds of index changes
+
+    # Text analysis (shared by indexing and querying)
+    analyzer_stem: bool = True
+    analyzer_stopwords: bool = True
+    query_analysis_cache_size: int = 4096
+
+    # Freshness: staleness flag and automatic hot/stable tiering by updated_at
+    stale_after_days: int = 14
+    hot_window_days: int = 7             # offers updated within this window live in the hot index
+    tiering_enabled: bool = True
+    tiering_interval_s: float = 300.0
+    tiering_demote_batch: int = 256      # demotions may rebuild the stable tier, so they are batched
+    tiering_demote_max_wait_s: float = 3600.0
+
+    # Warm paths: query log + background warmer keeping popular answers cached
+    warm_enabled: bool = True
+    warm_interval_s: float = 600.0
+    warm_top_n: int = 20                 # most popular logged queries kept warm
+    warm_min_count: int = 2              # ignore one-off queries
+    warm_half_life_s: float = 86400.0    # popularity decay
+    warm_refresh_margin_s: float = 1800.0  # re-run entries that expire within this window
+    warm_seasonal_queries: List[str] = []  # always kept warm, e.g. "new year's eve yacht party in Dubai"
+    retrieval_cache_depth: int = 256     # best candidates kept per cached retrieval
+
+    # Streaming ingestion: webhook -> coalescing queue -> micro-batches
+    ingest_webhook_enabled: bool = False
+    ingest_webhook_host: str = "127.0.0.1"
+    ingest_webhook_port: int = 8765
+    ingest_webhook_token: Optional[str] = None  # checked against the X-Webhook-Token header
+    ingest_batch_size: int = 500
+    ingest_max_delay_s: float = 1.0      # oldest pending event waits at most this long
+    ingest_max_pending: int = 10000      # distinct pending offers before the webhook answers 429
+    ingest_compact_ratio: float = 0.2    # full rebuild once this share of table rows are tombstones
+    ingest_filter_delta_max: int = 2048  # appended rows filtered per query before the filter index is rebuilt
+
+    # Vendor availability checks for the requested date ("http", "off", or "demo": an
+    # in-process stand-in that invents statuses, for demos and load tests only)
+    availability_provider: str = "off"
+    availability_url: str = "http://127.0.0.1:8766/availability"
+    availability_token: Optional[str] = None
+    availability_timeout_s: float = 0.8  # unanswered offers are reported as pending
+    availability_ttl_s: float = 120.0
+    availability_top_n: int = 3
+
+    # Typeahead suggestions (catalog rebuilt with the indexes, popular queries every refresh_s)
+    typeahead_k: int = 8
+    typeahead_popular_n: int = 500
+    typeahead_refresh_s: float = 60.0
+
+    # Result pagination (rag.pagination)
+    page_cursor_ttl_s: float = 900.0
+    page_cursor_max: int = 1000
+    page_cursor_depth: int = 200         # best ranked candidates a cursor keeps for later pages
+
+    # Composer prompt packing (token budgets cover system + user prompt)
+    compact_prompts: bool = True             # tabular candidates + short system prompt
+    compose_token_budget: int = 800
+    compose_token_budgets: Dict[str, int] = {}  # per-model overrides, e.g. {"gpt-4o": 600}
 
     # LangGraph / timeouts (seconds)
     tool_timeout_s: float = 30.0  # Increased for LLM API calls (typically 1-5s)
+    request_slo_s: float = 12.0   # end-to-end deadline per search; nodes degrade to stay within it
+    # Share of the remaining budget an LLM node may spend; the rest is kept for later nodes
+    node_budget_shares: Dict[str, float] = {"slots": 0.35, "rerank": 0.1, "availability": 0.1,
+                                           "compose": 0.9}
+    min_llm_budget_s: float = 0.75  # below this a node skips its LLM call and degrades directly
+
+    # Pipeline shape, per deployment: "two_call" (LLM slot extraction + LLM composition)
+    # or "single_call" (deterministic slots, one LLM call that picks candidates and answers)
+    pipeline_mode: str = "two_call"
+    single_call_candidates: int = 8   # vendor-diverse docs the single compose call chooses from
 
     # Thresholds
     low_confidence_tau: float = 0.7
@@ -27,7 +113,19 @@ class Settings(BaseModel):
     mid_model: str = "gpt-4o-mini"
     large_model: str = "gpt-4o"       # gated for proposals
 
+    # LLM record / replay (rag.llm_replay); SAHRA_LLM_MODE overrides llm_mode
+    llm_mode: str = "live"                    # "live" | "record" | "replay"
+    llm_cassette_dir: str = "data/llm_cassettes"
+    llm_replay_latency_scale: float = 0.0     # replay sleeps recorded latency x this (0 = instant)
+
     # Currency
     currency: str = "AED"
 
+    # SQLite storage
+    sqlite_synchronous: str = "NORMAL"   # safe with WAL; FULL only needed for rollback journals
+    sqlite_mmap_size: int = 256 * 1024 * 1024
+    sqlite_cache_size_kb: int = 64 * 1024
+    sqlite_busy_timeout_ms: int = 5000
+    sqlite_cached_statements: int = 256
+
 settings = Settings()
@@ -0,0 +1,90 @@
+"""Multi-turn refinement: reuse the previous turn's slots and candidates.
+
+A `Conversation` (one per UI session) remembers the last search: its
+text, the slots read from the text, and the fused candidate set ranked
+with only the filters that decide shard routing (city, plus occasion
+when sharded by occasion), with the scores. A turn that only adjusts
+slots ("make it 40 people", "under 20k", or just a sidebar change) keeps
+the previous search text. Its slots come from the deterministic parser
+with no LLM call. The sidebar filters are applied on top each turn and
+never stored, so clearing one drops its constraint. A turn naming a
+different city or occasion ("wedding in abu dhabi") is a new search,
+not a refinement. If the routing filters are unchanged, the remembered
+candidates are re-filtered instead of ranked again; that is the same
+result a fresh `rank` with the full filters gives.
+"""
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+from .cache import canonical_filters
+from .config import settings
+from .fusion import Leg
+from .retriever import filter_candidates
+from .slot_parse import apply_filter_overrides, parse_slots
+from .utils import normalize_query
+
+def routing_filters(filters: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """The part of `filters` that changes which shards are searched (and so the scores)."""
+    filters = filters or {}
+    out = {"city": filters.get("city")}
+    if settings.shard_by_occasion:
+        out["occasion"] = filters.get("occasion")
+    return out
+
+class Conversation:
+    def __init__(self):
+        self.query: Optional[str] = None  # text the candidates were ranked for
+        self.slots: Optional[Dict[str, Any]] = None  # read from the text so far, without sidebar filters
+        self.turns = 0
+        self._route: Optional[str] = None
+        self._rows: Optional[np.ndarray] = None
+        self._scores: Optional[np.ndarray] = None
+        self._generation: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def reset(self):
+        with self._lock:
+            self.query = self.slots = None
+            self._route = self._rows = self._scores = self._generation = None
+
+    def refine(self, text: str, applied_filters: Dict[str, Any]) -> Optional[Tuple[str, Dict[str, Any], Dict[str, Any]]]:
+        """(search text, text slots, slots with `applied_filters`) if `text` only adjusts the previous search, else None."""
+        if self.slots is None:
+            return None
+        parsed: Dict[str, Any] = {}
+        if normalize_query(text) != normalize_query(self.query or ""):
+            parsed, rest = parse_slots(text)
+            if rest or not parsed:
+                # new content words (or nothing recognisable): the intent changed
+                return None
+            if any(parsed.get(k) and self.slots.get(k) and parsed[k] != self.slots[k] for k in ("city", "occasion")):
+                # another city or occasion is a different search, not a narrower one
+                return None
+        text_slots = {**self.slots, **parsed}
+        return self.query, text_slots, apply_filter_overrides(dict(text_slots), applied_filters)
+
+    def candidates(self, store, query: str, filters: Dict[str, Any]) -> Optional[Leg]:
+        """The remembered candidate set narrowed to `filters`, if it was ranked for `query` and still applies."""
+        with self._lock:
+            if self._rows is None or query != self.query or self._generation != store.generation:
+                return None
+            if canonical_filters(routing_filters(filters)) != self._route:
+                return None
+            rows, scores = self._rows, self._scores
+        return filter_candidates(store, rows, scores, filters)
+
+    def note_turn(self, query: str, slots: Dict[str, Any]):
+        """Record this turn's search text and the slots read from it; a new text drops the old candidates."""
+        with self._lock:
+            if query != self.query:
+                self._route = self._rows = self._scores = self._generation = None
+            self.query, self.slots = query, dict(slots)
+            self.turns += 1
+
+    def remember_candidates(self, store, filters: Dict[str, Any], rows: np.ndarray, scores: np.ndarray):
+        """Keep the fused candidates of this turn, ranked with `routing_filters(filters)`."""
+        with self._lock:
+            self._route = canonical_filters(routing_filters(filters))
+            self._rows, self._scores, self._generation = rows, scores, store.generation
@@ -0,0 +1,145 @@
+import sqlite3, threading
+from contextlib import contextmanager
+from typing import List
+
+from .config import settings
+
+# Statements are module-level constants so sqlite3's per-connection statement
+# cache (keyed on the SQL text) reuses the prepared statement on every call.
+OFFER_COLUMNS = "id,vendor_id,title,city,headcount_min,headcount_max,price_min,price_max,duration_hours,occasion,tags,updated_at,description"
+
+SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS offers (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        vendor_id TEXT,
+        title TEXT,
+        city TEXT,
+        headcount_min INTEGER,
+        headcount_max INTEGER,
+        price_min REAL,
+        price_max REAL,
+        duration_hours REAL,
+        occasion TEXT,
+        tags TEXT,
+        updated_at TEXT,
+        description TEXT,
+        is_hot INTEGER DEFAULT 0,
+        updated_ts INTEGER
+    )''',
+    "CREATE INDEX IF NOT EXISTS idx_offers_hot ON offers(is_hot)",
+    # Tiering scans: recent stable offers to promote, aged hot ones to demote
+    "CREATE INDEX IF NOT EXISTS idx_offers_tier_ts ON offers(is_hot, updated_ts)",
+    "CREATE INDEX IF NOT EXISTS idx_offers_vendor ON offers(vendor_id)",
+]
+
+# Databases created before `updated_ts` existed get the column plus a backfill
+# from the `updated_at` strings (SQLite parses 'YYYY-MM-DD' as UTC midnight)
+MIGRATIONS = {
+    "updated_ts": [
+        "ALTER TABLE offers ADD COLUMN updated_ts INTEGER",
+        "UPDATE offers SET updated_ts = CAST(strftime('%s', updated_at) AS INTEGER) WHERE updated_ts IS NULL",
+    ],
+}
+
+# Columns an ingested offer supplies (everything but id / is_hot / updated_ts)
+OFFER_FIELDS = ("vendor_id", "title", "city", "headcount_min", "headcount_max", "price_min", "price_max",
+                "duration_hours", "occasion", "tags", "updated_at", "description")
+
+SQL_INSERT_OFFER = "INSERT INTO offers (vendor_id,title,city,headcount_min,headcount_max,price_min,price_max,duration_hours,occasion,tags,updated_at,description,is_hot,updated_ts) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?)"
+# Streaming ingestion: insert or replace one offer by id (NULL id = new offer)
+SQL_UPSERT_OFFER = (
+    f"INSERT INTO offers (id,{','.join(OFFER_FIELDS)},is_hot,updated_ts) VALUES ({','.join('?' * (len(OFFER_FIELDS) + 3))}) "
+    "ON CONFLICT(id) DO UPDATE SET " + ",".join(f"{c}=excluded.{c}" for c in (*OFFER_FIELDS, "is_hot", "updated_ts"))
+)
+SQL_DELETE_OFFER = "DELETE FROM offers WHERE id = ?"
+SQL_COUNT_OFFERS = "SELECT COUNT(*) FROM offers"
+SQL_FIND_OFFER = "SELECT id FROM offers WHERE vendor_id = ? AND title = ? ORDER BY id DESC LIMIT 1"
+SQL_LOAD_CORPUS = f"SELECT {OFFER_COLUMNS},updated_ts,is_hot FROM offers ORDER BY is_hot, id"
+SQL_LOAD_BY_IDS = f"SELECT {OFFER_COLUMNS},updated_ts,is_hot FROM offers WHERE id IN (SELECT value FROM json_each(?)) ORDER BY id"
+SQL_SET_TIER = "UPDATE offers SET is_hot = ? WHERE id IN (SELECT value FROM json_each(?))"
+def _apply_pragmas(conn: sqlite3.Connection, read_only: bool = False):
+    conn.execute("PRAGMA foreign_keys = ON")
+    conn.execute(f"PRAGMA busy_timeout = {int(settings.sqlite_busy_timeout_ms)}")
+    conn.execute(f"PRAGMA synchronous = {settings.sqlite_synchronous}")
+    conn.execute(f"PRAGMA mmap_size = {int(settings.sqlite_mmap_size)}")
+    # Negative cache_size is in KiB rather than pages
+    conn.execute(f"PRAGMA cache_size = -{int(settings.sqlite_cache_size_kb)}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    if read_only:
+        conn.execute("PRAGMA query_only = ON")
+
+class SQLitePool:
+    """One serialized writer connection plus one read connection per thread.
+
+    WAL mode lets the per-thread readers see a consistent snapshot while the
+    writer appends, so concurrent searches never queue behind an ingest.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._write_lock = threading.RLock()
+        self._readers: List[sqlite3.Connection] = []
+        self._readers_lock = threading.Lock()
+
+        self._writer = self._connect()
+        mode = self._writer.execute("PRAGMA journal_mode = WAL").fetchone()[0]
+        if str(mode).lower() != "wal":
+            # e.g. ":memory:" databases; everything still works, just without WAL
+            print(f"⚠️  SQLite journal_mode is '{mode}', WAL unavailable for {path}")
+        _apply_pragmas(self._writer)
+        self._memory = path == ":memory:" or str(mode).lower() == "memory"
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(
+            self.path,
+            check_same_thread=False,
+            cached_statements=settings.sqlite_cached_statements,
+        )
+
+    def init_schema(self):
+        with self.write() as conn:
+            conn.execute(SCHEMA[0])
+            columns = {r[1] for r in conn.execute("PRAGMA table_info(offers)")}
+            for column, stmts in MIGRATIONS.items():
+                if column not in columns:
+                    for stmt in stmts:
+                        conn.execute(stmt)
+            for stmt in SCHEMA[1:]:
+                conn.execute(stmt)
+            conn.execute("PRAGMA optimize")
+
+    @contextmanager
+    def write(self):
+        """Serialized write transaction; commits on success, rolls back on error."""
+        with self._write_lock:
+            try:
+                yield self._writer
+                self._writer.commit()
+            except Exception:
+                self._writer.rollback()
+                raise
+
+    def reader(self) -> sqlite3.Connection:
+        """Read connection owned by the calling thread (opened on first use)."""
+        if self._memory:
+            # A private in-memory db is only visible through the writer connection
+            return self._writer
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._connect()
+            _apply_pragmas(conn, read_only=True)
+            self._local.conn = conn
+            with self._readers_lock:
+                self._readers.append(conn)
+        return conn
+
+    def close(self):
+        with self._readers_lock:
+            for conn in self._readers:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+            self._readers.clear()
+        with self._write_lock:
+            self._writer.close()
@@ -0,0 +1,369 @@
+import copy
+from typing import Dict, Any, List, Iterable, Optional, Sequence, Tuple
+import numpy as np
+
+class Interner:
+    """Bidirectional string <-> small int id mapping."""
+    def __init__(self):
+        self.strings: List[str] = []
+        self.ids: Dict[str, int] = {}
+
+    def intern(self, s: str) -> int:
+        i = self.ids.get(s)
+        if i is None:
+            i = len(self.strings)
+            self.ids[s] = i
+            self.strings.append(s)
+        return i
+
+    def lookup_ci(self, s: str) -> np.ndarray:
+        """All ids whose string equals `s` case-insensitively."""
+        s = s.lower()
+        return np.array([i for i, v in enumerate(self.strings) if v is not None and v.lower() == s], dtype=np.int32)
+
+    def __len__(self):
+        return len(self.strings)
+
+def _split_list(v) -> List[str]:
+    return [x.strip() for x in str(v).split(',') if x]
+
+def _csr(lists: List[List[int]]) -> Tuple[np.ndarray, np.ndarray]:
+    """Ragged int lists -> (offsets, values); row i is values[offsets[i]:offsets[i+1]]."""
+    offsets = np.zeros(len(lists) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(l) for l in lists])
+    values = np.fromiter((x for l in lists for x in l), dtype=np.int32, count=int(offsets[-1]))
+    return offsets, values
+
+class DocTable:
+    """Struct-of-arrays table of every offer, built once per index build.
+
+    Rows are addressed by position (0..n-1). Numeric fields are NumPy
+    columns, vendor / city / updated_at are dictionary-encoded (int32 codes
+    into an `Interner`), occasions and tags are interned ids in CSR layout,
+    and the salient snippet boundary is precomputed. The full BM25 text is
+    never kept; it is rebuilt from the columns on demand. Materializing a search result is
+    a handful of array reads wrapped in a `DocView`; a standalone `Offer`
+    record is only created at the API boundary.
+    """
+    def __init__(self, rows: Sequence[tuple], interners: Optional["DocTable"] = None):
+        """`rows` are `OFFER_COLUMNS` tuples followed by updated_ts and the is_hot flag.
+
+        With `interners`, that table's (append-only) interners are reused so
+        the codes of both tables agree, as `extend` needs.
+        """
+        n = len(rows)
+        self.n = n
+        for name in self.INTERNERS:
+            setattr(self, name, getattr(interners, name) if interners is not None else Interner())
+
+        cols = list(zip(*rows)) if rows else [()] * 15
+        (ids, vendor, title, city, hmin, hmax, pmin, pmax, dur, occ, tags, upd, desc, upd_ts, hot) = cols
+        self.ids = np.array(ids, dtype=np.int64)
+        self.vendor_code = np.array([self.vendors.intern(v) for v in vendor], dtype=np.int32)
+        self.city_code = np.array([self.cities.intern(c) for c in city], dtype=np.int32)
+        self.updated_code = np.array([self.dates.intern(u) for u in upd], dtype=np.int32)
+        self.headcount_min = np.array([0 if v is None else v for v in hmin], dtype=np.int32)
+        self.headcount_max = np.array([10**9 if v is None else v for v in hmax], dtype=np.int32)
+        self.price_min = np.array([0 if v is None else v for v in pmin], dtype=np.float64)
+        self.price_max = np.array([10**12 if v is None else v for v in pmax], dtype=np.float64)
+        self.duration_hours = np.array([np.nan if v is None else v for v in dur], dtype=np.float32)
+        # epoch seconds of updated_at (-1 = unknown); staleness and tiering
+        # are plain comparisons on this column
+        self.updated_ts = np.array([-1 if v is None else v for v in upd_ts], dtype=np.int64)
+        self.is_hot = np.array(hot, dtype=bool)
+        self.title = list(title)
+        self.description = list(desc)
+
+        self.occ_offsets, self.occ_values = _csr([[self.occasions.intern(o) for o in _split_list(v)] for v in occ])
+        self.tag_offsets, self.tag_values = _csr([[self.tags.intern(t) for t in _split_list(v)] for v in tags])
+
+        # The salient first sentence always ends inside the title (the text
+        # starts with "<title>. "), so a cut position is all that needs storing
+        self.snippet_cut = np.array([len(t.split(".")[0]) for t in self.title], dtype=np.int32)
+        # False for rows superseded or deleted by streaming ingestion
+        self.live = np.ones(n, dtype=bool)
+        self._index_ids()
+
+    INTERNERS = ("vendors", "cities", "dates", "occasions", "tags")
+    # Fixed-width per-row columns (concatenated as-is by `extend`)
+    ROW_COLUMNS = ("ids", "vendor_code", "city_code", "updated_code", "headcount_min", "headcount_max",
+                   "price_min", "price_max", "duration_hours", "updated_ts", "is_hot", "snippet_cut", "live")
+    # Columns `filter_mask` reads; together with the interners they are all a
+    # retrieval worker needs from the table
+    FILTER_COLUMNS = ("ids", "vendor_code", "city_code", "headcount_min", "headcount_max",
+                      "price_min", "price_max", "is_hot", "live", "occ_offsets", "occ_values")
+
+    def _index_ids(self):
+        # id -> live row via binary search instead of a per-row dict
+        live_rows = np.flatnonzero(self.live)
+        self._id_order = live_rows[np.argsort(self.ids[live_rows], kind="stable")]
+        self._sorted_ids = self.ids[self._id_order]
+
+    def extend(self, rows: Sequence[tuple], dead: Iterable[int] = ()) -> "DocTable":
+        """New table with `rows` appended and the `dead` rows tombstoned.
+
+        Existing row numbers stay valid, so indexes over this table only need
+        the new rows added and the dead ones masked. `self` is left untouched
+        and keeps serving searches that already hold it.
+        """
+        add = DocTable(rows, interners=self)
+        out = DocTable.__new__(DocTable)
+        for name in self.INTERNERS:
+            setattr(out, name, getattr(self, name))
+        for name in self.ROW_COLUMNS:
+            setattr(out, name, np.concatenate([getattr(self, name), getattr(add, name)]))
+        out.title = self.title + add.title
+        out.description = self.description + add.description
+        for prefix in ("occ", "tag"):
+            offsets, values = getattr(self, f"{prefix}_offsets"), getattr(self, f"{prefix}_values")
+            add_offsets, add_values = getattr(add, f"{prefix}_offsets"), getattr(add, f"{prefix}_values")
+            setattr(out, f"{prefix}_offsets", np.concatenate([offsets, add_offsets[1:] + offsets[-1]]))
+            setattr(out, f"{prefix}_values", np.concatenate([values, add_values]))
+        out.n = self.n + add.n
+        out.live[np.asarray(list(dead), dtype=np.int64)] = False
+        out._index_ids()
+        return out
+
+    def with_tier(self, rows: np.ndarray, hot: bool) -> "DocTable":
+        """New table with `rows` moved to the hot or stable tier; `self` is left untouched."""
+        out = copy.copy(self)
+        out.is_hot = self.is_hot.copy()
+        out.is_hot[rows] = hot
+        return out
+
+    @classmethod
+    def from_filter_columns(cls, columns: Dict[str, np.ndarray], cities: List[str], occasions: List[str]) -> "DocTable":
+        """Filter-only table over existing arrays (e.g. views into shared memory)."""
+        self = cls.__new__(cls)
+        for name in cls.FILTER_COLUMNS:
+            setattr(self, name, columns[name])
+        self.n = len(self.ids)
+        self.cities, self.occasions = Interner(), Interner()
+        for c in cities:
+            self.cities.intern(c)
+        for o in occasions:
+            self.occasions.intern(o)
+        return self
+
+    # ---- column accessors ------------------------------------------------
+    def vendor_id(self, row: int) -> str:
+        return self.vendors.strings[self.vendor_code[row]]
+
+    def city(self, row: int) -> str:
+        return self.cities.strings[self.city_code[row]]
+
+    def updated_at(self, row: int) -> str:
+        return self.dates.strings[self.updated_code[row]]
+
+    def text_of(self, row: int) -> str:
+        """Indexing text, identical in shape to `store.row_to_doc`'s."""
+        occ = ",".join(self.occasion_names(row))
+        tags = ",".join(self.tag_names(row))
+        return (f"{self.title[row]}. {self.description[row]} (City: {self.city(row)}; "
+                f"Capacity: {self.headcount_min[row]}-{self.headcount_max[row]}; "
+                f"Price: {self.price_min[row]}-{self.price_max[row]}; Occasions: {occ}; Tags: {tags})")
+
+    def iter_text(self, rows: Iterable[int]):
+        return (self.text_of(int(r)) for r in rows)
+
+    def snippet(self, row: int) -> str:
+        title = self.title[row]
+        return f"{title}: {title[:self.snippet_cut[row]].strip()}"
+
+    def record(self, row: int) -> "Offer":
+        return Offer.from_table(self, int(row))
+
+    def stale_mask(self, rows: np.ndarray, cutoff: int) -> np.ndarray:
+        """Rows last updated before `cutoff` (epoch seconds, see `utils.stale_cutoff`)."""
+        ts = self.updated_ts[np.asarray(rows, dtype=np.int64)]
+        return (ts >= 0) & (ts < cutoff)
+
+    # ---- lookups -------------------------------------------------------
+    def rows_for_ids(self, ids: Iterable[int]) -> np.ndarray:
+        """Live rows of the given offer ids, in the given order (unknown ids are dropped)."""
+        ids = np.asarray(list(ids), dtype=np.int64)
+        pos = np.searchsorted(self._sorted_ids, ids)
+        pos = np.minimum(pos, max(len(self._sorted_ids) - 1, 0))
+        found = self._sorted_ids[pos] == ids if len(self._sorted_ids) else np.zeros(len(ids), dtype=bool)
+        return self._id_order[pos[found]].astype(np.int64)
+
+    def row_of(self, doc_id: int) -> int:
+        rows = self.rows_for_ids([doc_id])
+        if not len(rows):
+            raise KeyError(doc_id)
+        return int(rows[0])
+
+    def occasion_names(self, row: int) -> List[str]:
+        s = self.occasions.strings
+        return [s[i] for i in self.occ_values[self.occ_offsets[row]:self.occ_offsets[row + 1]]]
+
+    def tag_names(self, row: int) -> List[str]:
+        s = self.tags.strings
+        return [s[i] for i in self.tag_values[self.tag_offsets[row]:self.tag_offsets[row + 1]]]
+
+    def view(self, row: int) -> "DocView":
+        return DocView(self, int(row))
+
+    def views(self, rows: Iterable[int]) -> List["DocView"]:
+        return [DocView(self, int(r)) for r in rows]
+
+    # ---- filtering -----------------------------------------------------
+    def _has_any(self, offsets: np.ndarray, values: np.ndarray, rows: np.ndarray, wanted: np.ndarray) -> np.ndarray:
+        if len(wanted) == 0:
+            return np.zeros(len(rows), dtype=bool)
+        hit = np.isin(values, wanted)
+        # prefix sums over the hit flags give per-row hit counts in O(1)
+        cum = np.concatenate(([0], np.cumsum(hit)))
+        return (cum[offsets[rows + 1]] - cum[offsets[rows]]) > 0
+
+    def filter_mask(self, rows: np.ndarray, filters: Dict[str, Any]) -> np.ndarray:
+        """Which of `rows` match the city / headcount / budget / occasion filters (unset ones match all)."""
+        rows = np.asarray(rows, dtype=np.int64)
+        mask = np.ones(len(rows), dtype=bool)
+        city = filters.get("city")
+        if city:
+            mask &= np.isin(self.city_code[rows], self.cities.lookup_ci(city))
+        headcount = filters.get("headcount")
+        if headcount:
+            mask &= (self.headcount_min[rows] <= headcount) & (headcount <= self.headcount_max[rows])
+        budget = filters.get("budget")
+        if budget:
+            mask &= (self.price_min[rows] <= budget) & (budget <= self.price_max[rows])
+        occasion = filters.get("occasion")
+        if occasion:
+            mask &= self._has_any(self.occ_offsets, self.occ_values, rows, self.occasions.lookup_ci(occasion))
+        return mask
+
+_META_KEYS = ("id", "vendor_id", "title", "city", "headcount_min", "headcount_max",
+              "price_min", "price_max", "duration_hours", "occasion", "tags", "updated_at")
+
+class MetaView:
+    """Read-only mapping over one DocTable row with the keys of `row_to_doc`'s meta dict."""
+    __slots__ = ("_t", "_row")
+
+    def __init__(self, table: DocTable, row: int):
+        self._t = table
+        self._row = row
+
+    def __getitem__(self, key: str):
+        t, r = self._t, self._row
+        if key == "id": return int(t.ids[r])
+        if key == "vendor_id": return t.vendor_id(r)
+        if key == "title": return t.title[r]
+        if key == "city": return t.city(r)
+        if key == "headcount_min": return int(t.headcount_min[r])
+        if key == "headcount_max": return int(t.headcount_max[r])
+        if key == "price_min": return float(t.price_min[r])
+        if key == "price_max": return float(t.price_max[r])
+        if key == "duration_hours": return float(t.duration_hours[r])
+        if key == "occasion": return t.occasion_names(r)
+        if key == "tags": return t.tag_names(r)
+        if key == "updated_at": return t.updated_at(r)
+        raise KeyError(key)
+
+    def get(self, key: str, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        return key in _META_KEYS
+
+    def __iter__(self):
+        return iter(_META_KEYS)
+
+    def __len__(self):
+        return len(_META_KEYS)
+
+    def keys(self):
+        return list(_META_KEYS)
+
+    def items(self):
+        return [(k, self[k]) for k in _META_KEYS]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(self.items())
+
+class DocView:
+    """Drop-in for the `{"id", "text", "meta", "snippet"}` doc dicts the pipeline passes around.
+
+    Values are read from the table on access; assignments (e.g. an override
+    snippet) are kept in a small per-view dict.
+    """
+    __slots__ = ("_t", "_row", "_extra")
+
+    def __init__(self, table: DocTable, row: int):
+        self._t = table
+        self._row = row
+        self._extra = None
+
+    @property
+    def row(self) -> int:
+        return self._row
+
+    def __getitem__(self, key: str):
+        if self._extra and key in self._extra:
+            return self._extra[key]
+        if key == "meta": return MetaView(self._t, self._row)
+        if key == "id": return int(self._t.ids[self._row])
+        if key == "text": return self._t.text_of(self._row)
+        if key == "snippet": return self._t.snippet(self._row)
+        raise KeyError(key)
+
+    def __setitem__(self, key: str, value):
+        if self._extra is None:
+            self._extra = {}
+        self._extra[key] = value
+
+    def get(self, key: str, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        return key in ("id", "text", "meta", "snippet") or bool(self._extra and key in self._extra)
+
+    def keys(self):
+        extra = [k for k in (self._extra or {}) if k not in ("id", "text", "meta", "snippet")]
+        return ["id", "text", "meta", "snippet", *extra]
+
+    def to_dict(self) -> Dict[str, Any]:
+        d = {k: self[k] for k in self.keys()}
+        d["meta"] = d["meta"].to_dict()
+        return d
+
+    def record(self) -> "Offer":
+        return Offer.from_table(self._t, self._row)
+
+class Offer:
+    """Standalone offer record handed out at the API boundary (UI, exports).
+
+    Unlike `DocView` it holds its own values, so it stays valid after the
+    table is rebuilt; `__slots__` keeps it to a fixed ~200 bytes.
+    """
+    __slots__ = ("id", "vendor_id", "title", "city", "headcount_min", "headcount_max",
+                 "price_min", "price_max", "duration_hours", "occasion", "tags",
+                 "updated_at", "description", "snippet")
+
+    def __init__(self, **kw):
+        for k in self.__slots__:
+            setattr(self, k, kw.get(k))
+
+    @classmethod
+    def from_table(cls, t: DocTable, r: int) -> "Offer":
+        return cls(
+            id=int(t.ids[r]), vendor_id=t.vendor_id(r), title=t.title[r], city=t.city(r),
+            headcount_min=int(t.headcount_min[r]), headcount_max=int(t.headcount_max[r]),
+            price_min=float(t.price_min[r]), price_max=float(t.price_max[r]),
+            duration_hours=float(t.duration_hours[r]),
+            occasion=tuple(t.occasion_names(r)), tags=tuple(t.tag_names(r)),
+            updated_at=t.updated_at(r), description=t.description[r], snippet=t.snippet(r),
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {k: getattr(self, k) for k in self.__slots__}
+
+    def __repr__(self):
+        return f"Offer(id={self.id!r}, title={self.title!r}, city={self.city!r})"
@@ -0,0 +1,98 @@
+from typing import List, Optional, Sequence, Tuple
+import numpy as np
+
+# A retrieval leg: (rows, scores), both already in ranked (descending) order
+Leg = Tuple[np.ndarray, np.ndarray]
+
+EMPTY_LEG: Leg = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64))
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k largest scores, best first.
+
+    argpartition is O(n); only the k survivors are sorted.
+    """
+    n = len(scores)
+    if k <= 0 or n == 0:
+        return np.zeros(0, dtype=np.int64)
+    if k < n:
+        idx = np.argpartition(-scores, k - 1)[:k]
+    else:
+        idx = np.arange(n)
+    # stable sort on the negated scores keeps ties in index order
+    return idx[np.argsort(-scores[idx], kind="stable")]
+
+def rank_leg(scores: np.ndarray, rows: np.ndarray, k: int) -> Leg:
+    """Top-k of a full score vector over an index whose local doc i is `rows[i]`."""
+    idx = top_k(scores, k)
+    return rows[idx], scores[idx]
+
+def rrf_fuse(legs: Sequence[Leg], k: int = 60, weights: Optional[Sequence[float]] = None) -> Leg:
+    """Weighted reciprocal rank fusion over table rows.
+
+    Each leg contributes `w / (k + rank)` (rank starting at 1) to its rows;
+    contributions are summed per distinct row with `bincount`, so the work
+    is proportional to the legs' length, not to the corpus. Returns the
+    candidate rows (ascending) and fused scores - use `top_k` to select.
+    """
+    if weights is None:
+        weights = [1.0] * len(legs)
+    parts_rows, parts_contrib = [], []
+    for (rows, _), w in zip(legs, weights):
+        if len(rows) == 0 or w == 0:
+            continue
+        parts_rows.append(np.asarray(rows, dtype=np.int64))
+        parts_contrib.append(w / (k + np.arange(1, len(rows) + 1, dtype=np.float64)))
+    if not parts_rows:
+        return EMPTY_LEG
+    cand, inverse = np.unique(np.concatenate(parts_rows), return_inverse=True)
+    fused = np.bincount(inverse, weights=np.concatenate(parts_contrib), minlength=len(cand))
+    return cand, fused
+
+def _tag_jaccard(table, rows: np.ndarray) -> np.ndarray:
+    """Pairwise Jaccard similarity of the rows' tag sets."""
+    m = np.zeros((len(rows), max(len(table.tags), 1)), dtype=np.float32)
+    for i, r in enumerate(rows):
+        m[i, table.tag_values[table.tag_offsets[r]:table.tag_offsets[r + 1]]] = 1.0
+    inter = m @ m.T
+    sizes = m.sum(axis=1)
+    union = sizes[:, None] + sizes[None, :] - inter
+    return np.divide(inter, union, out=np.zeros_like(inter), where=union > 0)
+
+def diversified_top_k(rows: np.ndarray, scores: np.ndarray, groups: np.ndarray, k: int,
+                      mmr_lambda: float = 1.0, table=None) -> np.ndarray:
+    """Indices into `rows` of the best k candidates with at most one per group.
+
+    `groups` maps table row -> group id (the vendor code column). Collapsing is
+    done on the score arrays: the best-scoring row of every group survives.
+    With `mmr_lambda < 1` the survivors are re-picked greedily by
+    `λ·relevance − (1−λ)·max tag-similarity to already picked`, so near-duplicate
+    offers from different vendors are pushed down too.
+    """
+    if k <= 0 or len(rows) == 0:
+        return np.zeros(0, dtype=np.int64)
+    need = k if mmr_lambda >= 1.0 else 4 * k
+    # Grow the argpartition window until it holds enough distinct groups
+    m = min(len(scores), max(8 * k, 64))
+    while True:
+        order = top_k(scores, m)
+        _, first = np.unique(groups[rows[order]], return_index=True)
+        survivors = order[np.sort(first)]  # best per group, still in score order
+        if len(survivors) >= need or m == len(scores):
+            break
+        m = min(len(scores), 4 * m)
+    if mmr_lambda >= 1.0 or table is None or len(survivors) <= 1:
+        return survivors[:k]
+
+    # MMR over a bounded pool of the best survivors
+    pool = survivors[:need]
+    rel = scores[pool] / max(float(scores[pool[0]]), 1e-12)
+    sim = _tag_jaccard(table, rows[pool])
+    picked = [0]
+    max_sim = sim[0].copy()
+    while len(picked) < min(k, len(pool)):
+        gain = mmr_lambda * rel - (1 - mmr_lambda) * max_sim
+        gain[picked] = -np.inf
+        nxt = int(np.argmax(gain))
+        picked.append(nxt)
+        np.maximum(max_sim, sim[nxt], out=max_sim)
+    return pool[picked]
@@ -1,27 +1,132 @@
-import asyncio, os, json, time, datetime as dt
+import asyncio, os, json, re, time
 from typing import Dict, Any, List, TypedDict, Optional
-from langgraph.graph import StateGraph, END
-from litellm import acompletion  # Use async version
+import numpy as np
 from .config import settings
-from .prompts import SYSTEM_BASE, INTENT_SLOT_PROMPT, COMPOSER_PROMPT
-from .retriever import HybridRetriever
-from .utils import with_timeout
-from .cache import qr_cache, completion_cache, query_cache_key
+from .prompts import (SYSTEM_BASE, SYSTEM_COMPACT, INTENT_SLOT_PROMPT, COMPOSER_PROMPT, COMPOSER_PROMPT_COMPACT,
+                      SELECT_COMPOSE_PROMPT, SELECT_COMPOSE_PROMPT_COMPACT)
+from .packing import count_tokens, pack_facts, token_ledger
+from .retriever import HybridRetriever, filter_candidates
+from .utils import with_timeout, stale_cutoff, deadline_after, time_left
+from .cache import qr_cache, retrieval_cache, completion_cache, slot_cache_key, compose_cache_key, retrieval_cache_key
+from .fusion import top_k
+from .availability import get_checker, AVAILABLE, UNAVAILABLE, PENDING
+from .conversation import Conversation, routing_filters
+from .slot_parse import apply_filter_overrides, parse_slots
+from .rerank import get_reranker, rerank_candidates
+from .llm_replay import ReplayMiss, wrap_client
+from .pagination import cursors
 
 class RAGState(TypedDict):
     query: str
     retriever: Optional[HybridRetriever]
     slots: Optional[Dict[str, Any]]
+    text_slots: Optional[Dict[str, Any]]  # Slots read from the query text, before the sidebar filters
+    slot_hints: Optional[Dict[str, Any]]  # Single-call mode: looser slot reads the composer confirms or drops
     docs: Optional[List[Dict[str, Any]]]
     validation: Optional[Dict[str, Any]]
     answer: Optional[str]
     applied_filters: Optional[Dict[str, Any]]  # Pass filters explicitly
+    candidate_count: Optional[int]  # Matches before the diversified top-k cut
+    refresh: Optional[bool]  # Warm-up run: skip cache reads, recompute and rewrite the entries
+    token_usage: Optional[Dict[str, Any]]  # Composer prompt / completion token counts
+    deadline: Optional[float]  # time.monotonic() by which the answer is due (None = no SLO)
+    degraded: Optional[List[str]]  # Nodes that fell back to their deterministic mode
+    availability: Optional[Dict[int, str]]  # Offer id -> available / unavailable / pending on the requested date
+    conversation: Optional[Conversation]  # Previous turn's slots and candidates (multi-turn refinement)
+    search_query: Optional[str]  # Text retrieval runs on; the previous turn's for a refinement
+    refinement: Optional[bool]  # This turn only adjusted the previous search's slots
+    cursor: Optional[str]  # Pagination cursor over this search's ranked candidates (rag.pagination)
+
+TWO_CALL, SINGLE_CALL = "two_call", "single_call"
+
+def request_deadline(slo_s: Optional[float] = None) -> float:
+    return deadline_after(settings.request_slo_s if slo_s is None else slo_s)
+
+def _llm_budget(state: RAGState, node: str) -> float:
+    """Timeout for this node's LLM call: its share of the time left, capped by tool_timeout_s.
+
+    0 means the budget is too low to be worth a call; the node degrades instead.
+    """
+    left = time_left(state.get("deadline"))
+    if left == float("inf"):
+        return settings.tool_timeout_s
+    budget = min(settings.tool_timeout_s, left * settings.node_budget_shares.get(node, 1.0))
+    return budget if budget >= settings.min_llm_budget_s else 0.0
+
+def _degraded(state: RAGState, node: str) -> List[str]:
+    return list(state.get("degraded") or []) + [node]
+
+def _filter_only_slots(applied_filters: Dict[str, Any]) -> Dict[str, Any]:
+    """Slots taken from the sidebar filters alone (no LLM)."""
+    return {
+        "intent": "venue_search",
+        "city": applied_filters.get("city") if applied_filters.get("city") else None,
+        "headcount": applied_filters.get("headcount") if applied_filters.get("headcount", 0) > 0 else None,
+        "budget": applied_filters.get("budget") if applied_filters.get("budget", 0) > 0 else None,
+        "occasion": applied_filters.get("occasion") if applied_filters.get("occasion") else None,
+        "date": applied_filters.get("date") if applied_filters.get("date") else None,
+        "constraints": None
+    }
 
 def _route_model(task: str):
     if task in ("intent", "slots"): return settings.small_model
     if task in ("compose",): return settings.mid_model
     return settings.large_model
 
+def _candidate_k() -> int:
+    """Docs materialized per search: the composer's pick list in single-call mode."""
+    return settings.single_call_candidates if settings.pipeline_mode == SINGLE_CALL else settings.context_top_n
+
+def _refinement(state: RAGState) -> Optional[Dict[str, Any]]:
+    """Refinement of the previous turn ("make it 40 people", a sidebar change):
+    parse the slots deterministically and keep searching the previous text."""
+    conversation = state.get("conversation")
+    refined = conversation.refine(state["query"], state.get("applied_filters") or {}) if conversation is not None else None
+    if refined is None:
+        return None
+    search_query, text_slots, slots = refined
+    print(f"   ♻️ Refinement of '{search_query}', no LLM call: {slots}")
+    print("✅ CHECKPOINT 1: Intent & Slot Extraction - COMPLETE (refinement)")
+    print()
+    return {"slots": slots, "text_slots": text_slots, "search_query": search_query, "refinement": True}
+
+async def node_parse_slots(state: RAGState):
+    """Single-call mode: slots from the deterministic parser and the sidebar filters, no LLM."""
+    print("=" * 60)
+    print("📍 CHECKPOINT 1: Slot Parsing (deterministic) - START")
+    print("=" * 60)
+    
+    query = state["query"]
+    applied_filters = state.get("applied_filters") or {}
+    print(f"   Query: '{query}'")
+    print(f"   Applied filters: {applied_filters}")
+    
+    refined = _refinement(state)
+    if refined is not None:
+        return refined
+    
+    # Only unambiguous phrases become filters ("in Dubai", "25 people", "under
+    # 15k"). Looser reads ("for 4", which may be hours, and occasion words) go
+    # to the composer as hints: it sees the full query and confirms or drops them.
+    firm, _ = parse_slots(query, strict=True)
+    loose, _ = parse_slots(query)
+    # A budget whose number is also read as the headcount may be a misread group
+    # size; as a filter it would drop most of the catalog, so it stays a hint
+    if firm.get("budget") is not None and firm["budget"] == loose.get("headcount"):
+        del firm["budget"]
+    text_slots = {**_filter_only_slots({}), **firm}
+    slots = apply_filter_overrides(dict(text_slots), applied_filters)
+    hints = {k: v for k, v in loose.items() if k not in firm and not slots.get(k)}
+    # recorded like the LLM's slots, so the warmer's checks work in this mode too
+    qr_cache.set(slot_cache_key(query, applied_filters), text_slots)
+    
+    print(f"   Slots: {slots}")
+    if hints:
+        print(f"   Hints for the composer: {hints}")
+    print("✅ CHECKPOINT 1: Slot Parsing - COMPLETE")
+    print()
+    return {"slots": slots, "text_slots": text_slots, "slot_hints": hints}
+
 async def node_intent_slots(state: RAGState):
     print("=" * 60)
     print("📍 CHECKPOINT 1: Intent & Slot Extraction - START")
@@ -37,6 +142,20 @@ async def node_intent_slots(state: RAGState):
     applied_filters = state.get("applied_filters") or {}
     print(f"   Applied filters: {applied_filters}")
     
+    refined = _refinement(state)
+    if refined is not None:
+        return refined
+    
+    # Slot cache: repeated (and pre-warmed) queries skip the LLM call. It holds
+    # the slots read from the text; the sidebar filters are applied on top.
+    sk = slot_cache_key(query, applied_filters)
+    cached = None if state.get("refresh") else qr_cache.get(sk)
+    if cached is not None:
+        print(f"   ✨ Using cached slots: {cached}")
+        print("✅ CHECKPOINT 1: Intent & Slot Extraction - COMPLETE (cached)")
+        print()
+        return {"slots": apply_filter_overrides(dict(cached), applied_filters), "text_slots": dict(cached)}
+    
     # Create enhanced prompt with applied filters context
     filter_context = ""
     if applied_filters:
@@ -52,9 +171,20 @@ async def node_intent_slots(state: RAGState):
     
     enhanced_prompt = INTENT_SLOT_PROMPT.format(query=query) + filter_context
     
+    degraded = None
+    text_slots = _filter_only_slots({})
+    budget = _llm_budget(state, "slots")
+    if not budget:
+        print(f"   ⏱️ {time_left(state.get('deadline')):.2f}s left of the request budget, skipping LLM")
+        slots = _filter_only_slots(applied_filters)
+        print(f"   Fallback slots (from filters): {slots}")
+        print("✅ CHECKPOINT 1: Intent & Slot Extraction - COMPLETE (degraded)")
+        print()
+        return {"slots": slots, "text_slots": text_slots, "degraded": _degraded(state, "slots")}
+    
     try:
-        print(f"   Calling LLM for slot extraction (timeout: {settings.tool_timeout_s}s)...")
-        out = await with_timeout(async_completion(model, enhanced_prompt), settings.tool_timeout_s)
+        print(f"   Calling LLM for slot extraction (timeout: {budget:.2f}s)...")
+        out = await with_timeout(async_completion(model, enhanced_prompt, task="slots"), budget)
         slots = safe_json(out)
         print(f"   LLM extracted slots: {slots}")
         
@@ -77,48 +207,46 @@ async def node_intent_slots(state: RAGState):
         print(f"   Validated slots: {slots}")
         
         # Applied filters OVERRIDE query-extracted slots (user's explicit filters take precedence)
-        if applied_filters:
-            if applied_filters.get("city"):
-                slots["city"] = applied_filters["city"]
-            if applied_filters.get("occasion"):
-                slots["occasion"] = applied_filters["occasion"]
-            if applied_filters.get("headcount", 0) > 0:
-                slots["headcount"] = applied_filters["headcount"]
-            if applied_filters.get("budget", 0) > 0:
-                slots["budget"] = applied_filters["budget"]
-            if applied_filters.get("date"):
-                slots["date"] = applied_filters["date"]
+        text_slots = dict(slots)
+        apply_filter_overrides(slots, applied_filters)
         
         print(f"   Final slots (after filter override): {slots}")
+        qr_cache.set(sk, text_slots)
                 
     except asyncio.TimeoutError:
-        print(f"   ⚠️ LLM call timed out after {settings.tool_timeout_s}s, using fallback")
-        slots = {
-            "intent": "venue_search", 
-            "city": applied_filters.get("city") if applied_filters.get("city") else None,
-            "headcount": applied_filters.get("headcount") if applied_filters.get("headcount", 0) > 0 else None,
-            "budget": applied_filters.get("budget") if applied_filters.get("budget", 0) > 0 else None,
-            "occasion": applied_filters.get("occasion") if applied_filters.get("occasion") else None,
-            "date": applied_filters.get("date") if applied_filters.get("date") else None,
-            "constraints": None
-        }
+        print(f"   ⚠️ LLM call timed out after {budget:.2f}s, using fallback")
+        slots = _filter_only_slots(applied_filters)
+        degraded = _degraded(state, "slots")
         print(f"   Fallback slots (from filters): {slots}")
+    except ReplayMiss:
+        raise
     except Exception as e:
         print(f"   ⚠️ LLM failed with error: {type(e).__name__}: {e}, using fallback")
-        slots = {
-            "intent": "venue_search", 
-            "city": applied_filters.get("city") if applied_filters.get("city") else None,
-            "headcount": applied_filters.get("headcount") if applied_filters.get("headcount", 0) > 0 else None,
-            "budget": applied_filters.get("budget") if applied_filters.get("budget", 0) > 0 else None,
-            "occasion": applied_filters.get("occasion") if applied_filters.get("occasion") else None,
-            "date": applied_filters.get("date") if applied_filters.get("date") else None,
-            "constraints": None
-        }
+        slots = _filter_only_slots(applied_filters)
         print(f"   Fallback slots (from filters): {slots}")
     
     print("✅ CHECKPOINT 1: Intent & Slot Extraction - COMPLETE")
     print()
-    return {"slots": slots}
+    update = {"slots": slots, "text_slots": text_slots}
+    if degraded:
+        update["degraded"] = degraded
+    return update
+
+async def _rerank(state: RAGState, query: str, store, rows, scores):
+    """Cross-encoder pass over the top fused candidates, bounded by the request deadline."""
+    timeout = min(settings.rerank_timeout_s,
+                  time_left(state.get("deadline")) * settings.node_budget_shares.get("rerank", 1.0))
+    t = time.perf_counter()
+    scores, skipped = await rerank_candidates(get_reranker(), query, store.table, rows, scores, timeout)
+    if skipped is None:
+        print(f"   Reranked top-{min(settings.rerank_depth, len(rows))} in {(time.perf_counter() - t) * 1000:.0f} ms")
+    elif skipped != "off":
+        print(f"   ⚠️ Rerank skipped ({skipped}), keeping fused order")
+    return scores, skipped
+
+def _open_cursor(store, rows, scores, docs) -> str:
+    """Cursor for "more results": keeps the ranked arrays, `docs` are its first page."""
+    return cursors.open(store, rows, scores, first_page=np.array([d["id"] for d in docs], dtype=np.int64))
 
 async def node_retrieve(state: RAGState):
     print("=" * 60)
@@ -137,9 +265,58 @@ async def node_retrieve(state: RAGState):
     }
     print(f"   Active filters: {filters}")
     
-    print("   Executing hybrid search (BM25 stable + hot)...")
-    docs = retriever.search(state["query"], filters)
-    print(f"   Retrieved {len(docs)} unique vendor documents")
+    # Refinement: re-filter the previous turn's candidates (same text, same shards)
+    store = retriever.store
+    query = state.get("search_query") or state["query"]
+    conversation = state.get("conversation")
+    reused = conversation.candidates(store, query, filters) if conversation is not None else None
+    if reused is not None:
+        rows, scores = reused
+        n_candidates = len(rows)
+        scores, _ = await _rerank(state, query, store, rows, scores)
+        docs = retriever.materialize(query, rows, scores, _candidate_k())
+        print(f"   ♻️ Re-filtered the previous candidates: {len(docs)} docs from {n_candidates} candidates")
+        conversation.note_turn(query, state.get("text_slots") or {})
+        print("✅ CHECKPOINT 2: Hybrid Retrieval - COMPLETE (refinement)")
+        print()
+        return {"docs": docs, "candidate_count": n_candidates, "cursor": _open_cursor(store, rows, scores, docs)}
+    
+    # Retrieval cache: keyed on canonical filters + analyzed term set, so
+    # paraphrases share an entry and skip ranking and materialization
+    rk = retrieval_cache_key(store, query, filters)
+    cached = None if state.get("refresh") else retrieval_cache.get(rk)
+    if cached is not None:
+        n_candidates = cached["count"]
+        docs = store.table.views(store.table.rows_for_ids(cached["doc_ids"]))
+        rows = store.table.rows_for_ids(cached["ids"])
+        scores = cached["scores"][np.isin(cached["ids"], store.table.ids[rows])]
+        print(f"   ✨ Using cached retrieval: {len(docs)} docs from {n_candidates} candidates")
+        if conversation is not None:
+            conversation.note_turn(query, state.get("text_slots") or {})
+    else:
+        print("   Executing hybrid search (BM25 stable + hot)...")
+        # In a conversation, rank with the routing filters only and keep that
+        # wider set, so later refinements can re-filter it
+        rank_filters = routing_filters(filters) if conversation is not None else filters
+        if hasattr(retriever, "arank"):
+            # RetrievalPool: ranking runs in worker processes, keep the loop free;
+            # past the request deadline it ranks in-process instead of waiting
+            rows, scores = await retriever.arank(query, rank_filters, deadline=state.get("deadline"))
+        else:
+            rows, scores = retriever.rank(query, rank_filters)
+        if conversation is not None:
+            conversation.note_turn(query, state.get("text_slots") or {})
+            conversation.remember_candidates(store, filters, rows, scores)
+            rows, scores = filter_candidates(store, rows, scores, filters)
+        n_candidates = len(rows)
+        scores, skipped = await _rerank(state, query, store, rows, scores)
+        docs = retriever.materialize(query, rows, scores, _candidate_k())
+        if skipped not in ("loading", "deadline", "error"):
+            # don't pin the un-reranked order for the cache TTL over a transient miss
+            keep = top_k(scores, settings.retrieval_cache_depth)
+            retrieval_cache.set(rk, {"ids": store.table.ids[rows[keep]], "scores": scores[keep],
+                                     "count": n_candidates, "doc_ids": [d["id"] for d in docs]})
+        print(f"   Retrieved {len(docs)} unique vendor documents ({n_candidates} candidates)")
     
     if docs:
         print(f"   Top result: {docs[0]['meta']['title']} (ID: {docs[0]['meta']['id']}, Vendor: {docs[0]['meta'].get('vendor_id')})")
@@ -151,7 +328,7 @@ async def node_retrieve(state: RAGState):
     
     print("✅ CHECKPOINT 2: Hybrid Retrieval - COMPLETE")
     print()
-    return {"docs": docs}
+    return {"docs": docs, "candidate_count": n_candidates, "cursor": _open_cursor(store, rows, scores, docs)}
 
 async def node_validate(state: RAGState):
     print("=" * 60)
@@ -170,8 +347,18 @@ async def node_validate(state: RAGState):
     # CRITICAL: Filter out documents that don't match applied_filters
     # This is a safety net to ensure webpage filters are strictly enforced
     if applied_filters and docs:
+        # Docs served from the doc table are checked against the store's filter
+        # index; only rejects (or plain dicts) go through the per-field checks
+        # below, which explain why a doc was dropped.
+        retriever = state.get("retriever")
+        filter_index = getattr(getattr(retriever, "store", None), "filter_index", None)
+        table_rows = np.array([d.row for d in docs if hasattr(d, "row")], dtype=np.int64)
+        passing = set(table_rows[filter_index.mask(table_rows, applied_filters)].tolist()) if filter_index is not None else set()
         filtered_docs = []
         for doc in docs:
+            if hasattr(doc, "row") and doc.row in passing:
+                filtered_docs.append(doc)
+                continue
             meta = doc.get("meta", {})
             passes = True
             
@@ -234,7 +421,8 @@ async def node_validate(state: RAGState):
         if not has_value("occasion"):
             issues.append("occasion")
     # If we have results but they're ambiguous, suggest refinement
-    elif len(docs) > 5:
+    # (docs is only the diversified top-k; count the candidates behind it)
+    elif (state.get("candidate_count") or len(docs)) > 5:
         print("   Validation strategy: MANY RESULTS - suggest refinement filters")
         # Only suggest helpful filters that would narrow results
         if not has_value("city"):
@@ -246,17 +434,8 @@ async def node_validate(state: RAGState):
     
     print(f"   Missing info to suggest: {issues if issues else 'None'}")
     
-    # staleness check
-    stale = []
-    now = dt.date.today()
-    for d in docs[:3]:
-        upd = d["meta"].get("updated_at")
-        try:
-            ddate = dt.datetime.strptime(upd, "%Y-%m-%d").date()
-            if (now - ddate).days > 14:
-                stale.append(d["meta"]["id"])
-        except:
-            pass
+    # staleness check: one comparison on the precomputed updated_ts column
+    stale = stale_ids(getattr(state.get("retriever"), "store", None), docs[:_candidate_k()])
     
     print(f"   Stale documents: {stale if stale else 'None'}")
     
@@ -266,6 +445,55 @@ async def node_validate(state: RAGState):
     print()
     return {"validation": validation, "docs": docs}
 
+async def node_availability(state: RAGState):
+    print("=" * 60)
+    print("📍 CHECKPOINT 3b: Availability - START")
+    print("=" * 60)
+    
+    slots = state.get("slots") or {}
+    date = slots.get("date") or (state.get("applied_filters") or {}).get("date")
+    docs = state.get("docs") or []
+    checker = get_checker()
+    if not date or not docs or checker is None:
+        print(f"   Skipped (date: {date}, docs: {len(docs)}, provider: {settings.availability_provider})")
+        print()
+        return {"availability": None}
+    
+    # one batched request per vendor, all vendors concurrently, bounded by the deadline
+    timeout = min(settings.availability_timeout_s,
+                  time_left(state.get("deadline")) * settings.node_budget_shares.get("availability", 1.0))
+    # in single-call mode the composer may pick any candidate, so check them all
+    top = docs if settings.pipeline_mode == SINGLE_CALL else docs[:settings.availability_top_n]
+    t = time.perf_counter()
+    availability = await checker.check([(d["id"], d["meta"].get("vendor_id")) for d in top], str(date), timeout)
+    print(f"   Availability on {date} ({(time.perf_counter() - t) * 1000:.0f} ms): {availability}")
+    
+    # available first, pending next, unavailable last; retrieval order otherwise
+    order = {AVAILABLE: 0, PENDING: 1, UNAVAILABLE: 2}
+    top = sorted(top, key=lambda d: order.get(availability.get(d["id"]), 1))
+    
+    print("✅ CHECKPOINT 3b: Availability - COMPLETE")
+    print()
+    return {"availability": availability, "docs": top + docs[len(top):]}
+
+def stale_ids(store, docs) -> List[int]:
+    """Ids of `docs` (table views) last updated more than `stale_after_days` ago."""
+    table = getattr(store, "table", None)
+    if table is None or not docs:
+        return []
+    rows = np.array([d.row for d in docs if hasattr(d, "row")], dtype=np.int64)
+    return table.ids[rows[table.stale_mask(rows, stale_cutoff(settings.stale_after_days))]].tolist()
+
+def _candidate_facts(docs, availability: Dict[int, str]) -> List[Dict[str, Any]]:
+    return [
+        {"id": d["meta"]["id"], "title": d["meta"]["title"], "city": d["meta"]["city"],
+         "price_min": d["meta"]["price_min"], "price_max": d["meta"]["price_max"],
+         "headcount_min": d["meta"]["headcount_min"], "headcount_max": d["meta"]["headcount_max"],
+         "snippet": d.get("snippet",""), "updated_at": d["meta"]["updated_at"],
+         **({"availability": availability[d["id"]]} if d["id"] in availability else {})}
+        for d in docs
+    ]
+
 async def node_compose(state: RAGState):
     print("=" * 60)
     print("📍 CHECKPOINT 4: Response Composition - START")
@@ -273,8 +501,9 @@ async def node_compose(state: RAGState):
     
     # Cache first
     slots = state.get("slots", {})
-    ck = query_cache_key(state["query"], slots.get("city"), slots.get("occasion"), slots.get("headcount"), slots.get("budget"), None)
-    cached = completion_cache.get(ck)
+    availability = state.get("availability") or {}
+    ck = compose_cache_key(state.get("search_query") or state["query"], slots, availability)
+    cached = None if state.get("refresh") else completion_cache.get(ck)
     if cached:
         print("   ✨ Using cached response")
         print("✅ CHECKPOINT 4: Response Composition - COMPLETE (cached)")
@@ -295,41 +524,172 @@ async def node_compose(state: RAGState):
         print()
         return {"answer": answer}
     
-    facts = {
-        "slots": slots,
-        "candidates": [
-            {"id": d["meta"]["id"], "title": d["meta"]["title"], "city": d["meta"]["city"],
-             "price_min": d["meta"]["price_min"], "price_max": d["meta"]["price_max"],
-             "headcount_min": d["meta"]["headcount_min"], "headcount_max": d["meta"]["headcount_max"],
-             "snippet": d.get("snippet",""), "updated_at": d["meta"]["updated_at"]}
-            for d in docs[:3]
-        ],
-    }
+    facts = {"slots": slots, "candidates": _candidate_facts(docs[:3], availability)}
     
     model = _route_model("compose")
     print(f"   Using model: {model}")
     
-    sys = SYSTEM_BASE
-    user = COMPOSER_PROMPT.format(facts=json.dumps(facts, ensure_ascii=False))
+    stale_ids = (state.get("validation") or {}).get("stale_ids", [])
+    usage: Dict[str, Any] = {}
+    if settings.compact_prompts:
+        # Tabular candidates + short system prompt, trimmed to the model's token budget
+        sys = SYSTEM_COMPACT
+        packed, stats = pack_facts(facts, lambda t: COMPOSER_PROMPT_COMPACT.format(facts=t), model,
+                                   fixed_tokens=count_tokens(sys, model), stale_ids=stale_ids)
+        user = COMPOSER_PROMPT_COMPACT.format(facts=packed)
+        usage.update(stats)
+    else:
+        sys = SYSTEM_BASE
+        user = COMPOSER_PROMPT.format(facts=json.dumps(facts, ensure_ascii=False))
+        usage["prompt_tokens_est"] = count_tokens(sys, model) + count_tokens(user, model)
+    print(f"   Prompt tokens (local estimate): {usage['prompt_tokens_est']}")
+    
+    degraded = None
+    budget = _llm_budget(state, "compose")
+    if not budget:
+        print(f"   ⏱️ {time_left(state.get('deadline')):.2f}s left of the request budget, skipping LLM")
+        answer = _generate_fallback_answer(docs, slots, facts, stale_ids)
+        print("✅ CHECKPOINT 4: Response Composition - COMPLETE (degraded)")
+        print()
+        return {"answer": answer, "token_usage": usage, "degraded": _degraded(state, "compose")}
     
     try:
-        print(f"   Calling LLM for response composition (timeout: {settings.tool_timeout_s}s)...")
-        out = await with_timeout(async_completion(model, user, system=sys), settings.tool_timeout_s)
+        print(f"   Calling LLM for response composition (timeout: {budget:.2f}s)...")
+        out = await with_timeout(async_completion(model, user, system=sys, task="compose", usage=usage), budget)
         answer = out
         completion_cache.set(ck, out)
         print(f"   LLM generated {len(answer)} character response")
         print(f"   Answer preview: {answer[:100]}...")
     except asyncio.TimeoutError:
-        print(f"   ⚠️ LLM composition timed out after {settings.tool_timeout_s}s, using fallback")
-        answer = _generate_fallback_answer(docs, slots, facts)
+        print(f"   ⚠️ LLM composition timed out after {budget:.2f}s, using fallback")
+        answer = _generate_fallback_answer(docs, slots, facts, stale_ids)
+        degraded = _degraded(state, "compose")
+    except ReplayMiss:
+        raise
     except Exception as e:
         print(f"   ⚠️ LLM composition failed with error: {type(e).__name__}: {e}, using fallback")
-        answer = _generate_fallback_answer(docs, slots, facts)
+        answer = _generate_fallback_answer(docs, slots, facts, stale_ids)
     
     print("✅ CHECKPOINT 4: Response Composition - COMPLETE")
     print("=" * 60)
     print()
-    return {"answer": answer}
+    update = {"answer": answer, "token_usage": usage}
+    if degraded:
+        update["degraded"] = degraded
+    return update
+
+def _pick_docs(docs, ids) -> list:
+    """Candidates named in `ids`, in that order, at most `context_top_n`."""
+    by_id = {d["id"]: d for d in docs}
+    picked, seen = [], set()
+    for i in ids or []:
+        try:
+            i = int(i)
+        except (TypeError, ValueError):
+            continue
+        if i in by_id and i not in seen:
+            seen.add(i)
+            picked.append(by_id[i])
+    return picked[:settings.context_top_n]
+
+def _restart_cursor(state: RAGState, docs):
+    """The picked docs are what the user sees first; "More results" continues after them."""
+    cursor = cursors.get(state.get("cursor"))
+    if cursor is not None:
+        cursor.restart(np.array([d["id"] for d in docs], dtype=np.int64))
+
+async def node_select_compose(state: RAGState):
+    """Single-call mode: one LLM call picks the candidates that fit the query and writes the answer."""
+    print("=" * 60)
+    print("📍 CHECKPOINT 4: Selection & Composition (single call) - START")
+    print("=" * 60)
+    
+    slots = state.get("slots", {})
+    availability = state.get("availability") or {}
+    query = state.get("search_query") or state["query"]
+    docs = state.get("docs", [])
+    k = settings.context_top_n
+    ck = compose_cache_key(query, slots, availability, select=True)
+    cached = None if state.get("refresh") else completion_cache.get(ck)
+    if cached:
+        picked = _pick_docs(docs, cached["ids"])
+        _restart_cursor(state, picked)
+        print(f"   ✨ Using cached selection {cached['ids']} and response")
+        print("✅ CHECKPOINT 4: Selection & Composition - COMPLETE (cached)")
+        print()
+        return {"answer": cached["answer"], "docs": picked}
+    
+    print(f"   Selecting up to {k} of {len(docs)} candidates")
+    if not docs:
+        print("   No venues found - generating no-results response")
+        answer = _generate_no_results_answer(slots)
+        completion_cache.set(ck, {"answer": answer, "ids": []})
+        print("✅ CHECKPOINT 4: Selection & Composition - COMPLETE (no results)")
+        print("=" * 60)
+        print()
+        return {"answer": answer}
+    
+    facts = {"slots": slots, "candidates": _candidate_facts(docs, availability)}
+    hints = "; ".join(f"{k}={v}" for k, v in (state.get("slot_hints") or {}).items()) or "-"
+    model = _route_model("compose")
+    print(f"   Using model: {model}")
+    
+    stale_ids = (state.get("validation") or {}).get("stale_ids", [])
+    usage: Dict[str, Any] = {}
+    if settings.compact_prompts:
+        sys = SYSTEM_COMPACT
+        render = lambda t: SELECT_COMPOSE_PROMPT_COMPACT.format(query=query, k=k, hints=hints, facts=t)
+        packed, stats = pack_facts(facts, render, model, fixed_tokens=count_tokens(sys, model), stale_ids=stale_ids)
+        user = render(packed)
+        usage.update(stats)
+    else:
+        sys = SYSTEM_BASE
+        user = SELECT_COMPOSE_PROMPT.format(query=query, k=k, hints=hints, facts=json.dumps(facts, ensure_ascii=False))
+        usage["prompt_tokens_est"] = count_tokens(sys, model) + count_tokens(user, model)
+    print(f"   Prompt tokens (local estimate): {usage['prompt_tokens_est']}")
+    
+    # without the LLM, the best-ranked candidates stand in for its pick
+    fallback = {"slots": slots, "candidates": facts["candidates"][:k]}
+    picked, degraded = docs[:k], None
+    budget = _llm_budget(state, "compose")
+    if not budget:
+        print(f"   ⏱️ {time_left(state.get('deadline')):.2f}s left of the request budget, skipping LLM")
+        answer = _generate_fallback_answer(picked, slots, fallback, stale_ids)
+        _restart_cursor(state, picked)
+        print("✅ CHECKPOINT 4: Selection & Composition - COMPLETE (degraded)")
+        print()
+        return {"answer": answer, "docs": picked, "token_usage": usage, "degraded": _degraded(state, "compose")}
+    
+    try:
+        print(f"   Calling LLM for selection + composition (timeout: {budget:.2f}s)...")
+        out = await with_timeout(async_completion(model, user, system=sys, task="compose", usage=usage), budget)
+        parsed = safe_json(out, fallback={})
+        answer = parsed.get("answer") if isinstance(parsed, dict) else None
+        if not isinstance(answer, str) or not answer.strip():
+            raise ValueError("no answer in the composer's JSON")
+        # ids the model listed, else the ones it cited; none means nothing fit
+        picked = _pick_docs(docs, parsed.get("ids") or re.findall(r"\[#(\d+)\]", answer))
+        completion_cache.set(ck, {"answer": answer, "ids": [d["id"] for d in picked]})
+        print(f"   LLM picked {[d['id'] for d in picked]}, {len(answer)} character response")
+        print(f"   Answer preview: {answer[:100]}...")
+    except asyncio.TimeoutError:
+        print(f"   ⚠️ LLM composition timed out after {budget:.2f}s, using fallback")
+        answer = _generate_fallback_answer(picked, slots, fallback, stale_ids)
+        degraded = _degraded(state, "compose")
+    except ReplayMiss:
+        raise
+    except Exception as e:
+        print(f"   ⚠️ LLM composition failed with error: {type(e).__name__}: {e}, using fallback")
+        answer = _generate_fallback_answer(picked, slots, fallback, stale_ids)
+    _restart_cursor(state, picked)
+    
+    print("✅ CHECKPOINT 4: Selection & Composition - COMPLETE")
+    print("=" * 60)
+    print()
+    update = {"answer": answer, "docs": picked, "token_usage": usage}
+    if degraded:
+        update["degraded"] = degraded
+    return update
 
 def _generate_no_results_answer(slots):
     """Generate helpful response when no venues match the search criteria"""
@@ -372,7 +732,10 @@ def _generate_no_results_answer(slots):
     
     return response
 
-def _generate_fallback_answer(docs, slots, facts):
+AVAILABILITY_NOTES = {AVAILABLE: " (available on your date)", UNAVAILABLE: " (not available on your date)",
+                      PENDING: " (availability pending verification)"}
+
+def _generate_fallback_answer(docs, slots, facts, stale_ids=()):
     """Generate deterministic fallback answer when LLM fails"""
     lines = []
     
@@ -380,13 +743,8 @@ def _generate_fallback_answer(docs, slots, facts):
         # We have results, show them
         for d in facts["candidates"]:
             sid = d["id"]
-            staleness = ""
-            try:
-                upd = dt.datetime.strptime(d["updated_at"], "%Y-%m-%d").date()
-                if (dt.date.today()-upd).days>14:
-                    staleness = " (stale; needs reconfirmation)"
-            except:
-                pass
+            staleness = " (stale; needs reconfirmation)" if sid in stale_ids else ""
+            staleness += AVAILABILITY_NOTES.get(d.get("availability"), "")
             lines.append(f"- {d['title']} in {d['city']} • {d['price_min']}-{d['price_max']} {staleness} [#{sid}]")
         
         # Add helpful context about what filters are active
@@ -408,8 +766,39 @@ def _generate_fallback_answer(docs, slots, facts):
     print(f"   Fallback generated {len(answer)} character response")
     return answer
 
-async def async_completion(model: str, prompt: str, system: str|None=None):
-    """Call LLM with detailed error handling"""
+def _usage_counts(resp):
+    usage = getattr(resp, "usage", None)
+    if usage is None and isinstance(resp, dict):
+        usage = resp.get("usage")
+    if usage is None:
+        return None, None
+    get = usage.get if isinstance(usage, dict) else (lambda k: getattr(usage, k, None))
+    return get("prompt_tokens"), get("completion_tokens")
+
+_acompletion = None
+
+def _load_litellm():
+    from litellm import acompletion
+    return acompletion
+
+def _llm_client():
+    """litellm.acompletion, imported on the first LLM call (litellm alone takes seconds to import).
+
+    Wrapped for recording, or replaced by the cassette, per `settings.llm_mode`.
+    """
+    global _acompletion
+    if _acompletion is None:
+        _acompletion = wrap_client(_load_litellm)
+    return _acompletion
+
+def prewarm_llm_client():
+    """Import litellm on a background thread so the first query does not pay for it."""
+    import threading
+    threading.Thread(target=_llm_client, name="sahra-llm-import", daemon=True).start()
+
+async def async_completion(model: str, prompt: str, system: str|None=None, task: str="llm",
+                           usage: Optional[Dict[str, Any]]=None):
+    """Call LLM with detailed error handling; token counts go to `usage` and the ledger"""
     msgs = []
     if system:
         msgs.append({"role": "system", "content": system})
@@ -422,8 +811,14 @@ async def async_completion(model: str, prompt: str, system: str|None=None):
     print(f"      User prompt length: {len(prompt)}")
     
     try:
-        resp = await acompletion(model=model, messages=msgs, temperature=0.2)
+        resp = await _llm_client()(model=model, messages=msgs, temperature=0.2)
         print(f"      ✅ LLM responded successfully")
+        prompt_tokens, completion_tokens = _usage_counts(resp)
+        if prompt_tokens is not None:
+            token_ledger.record(task, model, prompt_tokens, completion_tokens)
+            if usage is not None:
+                usage.update(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+            print(f"      Tokens: {prompt_tokens} prompt / {completion_tokens} completion")
         
         # Try to extract content
         try:
@@ -453,8 +848,10 @@ async def async_completion(model: str, prompt: str, system: str|None=None):
         print(f"      Traceback: {traceback.format_exc()}")
         raise  # Re-raise to be caught by node error handling
 
-def safe_json(s: str):
-    """Parse JSON from string, handling markdown code blocks"""
+SLOTS_FALLBACK = {"intent":"unknown","city":None,"headcount":None,"budget":None,"occasion":None,"date":None,"constraints":None}
+
+def safe_json(s: str, fallback: Optional[Dict[str, Any]] = None):
+    """Parse JSON from string, handling markdown code blocks; `fallback` (default: empty slots) if it fails"""
     try:
         # Strip markdown code blocks if present
         s = s.strip()
@@ -477,18 +874,31 @@ def safe_json(s: str):
         print(f"   ❌ JSON parsing failed: {e}")
         print(f"   Original string: {s[:500]}")
         # Fallback to default
-        return {"intent":"unknown","city":None,"headcount":None,"budget":None,"occasion":None,"date":None,"constraints":None}
+        return dict(SLOTS_FALLBACK if fallback is None else fallback)
 
 def build_graph(retriever: HybridRetriever):
+    """The search pipeline for `settings.pipeline_mode`.
+
+    two_call: LLM slot extraction -> retrieval -> LLM composition.
+    single_call: deterministic slots -> wider retrieval (`single_call_candidates`)
+    -> one LLM call that picks the candidates and writes the answer.
+    Both return the same state keys (answer, docs, validation, slots, ...).
+    """
+    from langgraph.graph import StateGraph, END
+    if settings.pipeline_mode not in (TWO_CALL, SINGLE_CALL):
+        raise ValueError(f"pipeline_mode must be {TWO_CALL!r} or {SINGLE_CALL!r}, got {settings.pipeline_mode!r}")
+    single = settings.pipeline_mode == SINGLE_CALL
     g = StateGraph(RAGState)
-    g.add_node("intent_slot_filler", node_intent_slots)
+    g.add_node("intent_slot_filler", node_parse_slots if single else node_intent_slots)
     g.add_node("retrieve_hybrid", node_retrieve)
     g.add_node("validator", node_validate)
-    g.add_node("composer", node_compose)
+    g.add_node("availability_check", node_availability)
+    g.add_node("composer", node_select_compose if single else node_compose)
 
     g.set_entry_point("intent_slot_filler")
     g.add_edge("intent_slot_filler", "retrieve_hybrid")
     g.add_edge("retrieve_hybrid", "validator")
-    g.add_edge("validator", "composer")
+    g.add_edge("validator", "availability_check")
+    g.add_edge("availability_check", "composer")
     g.add_edge("composer", END)
     return g.compile()
@@ -0,0 +1,270 @@
+"""Streaming ingestion: webhook events -> coalescing queue -> micro-batches.
+
+    python -m rag.ingest_queue [--port 8765]
+
+Vendors (or the upstream catalogue) POST offer events to `/offers`:
+
+    {"op": "upsert", "offer": {"vendor_id": "...", "title": "...", ...}}
+    {"op": "delete", "offer": {"id": 42}}
+
+A body may also be a list of events. Events are keyed by offer `id` (or
+`vendor_id` + `title` for new offers) and coalesced while pending, so a
+burst of updates to one offer is applied once with its latest version. A
+worker thread drains up to `ingest_batch_size` events at most
+`ingest_max_delay_s` after the oldest arrived and hands them to
+`DualIndexStore.apply_batch`, which writes one SQLite transaction and swaps
+in the updated indexes, so queries keep running on the previous ones
+meanwhile. When `ingest_max_pending` offers are queued the webhook answers
+429 with Retry-After. `GET /ingest/status` reports the lag.
+"""
+import argparse, hmac, json, threading, time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+from .config import settings
+
+OPS = ("upsert", "delete")
+
+class QueueFull(Exception):
+    pass
+
+def _event_key(offer: Dict[str, Any]) -> tuple:
+    if offer.get("id") is not None:
+        return ("id", int(offer["id"]))
+    if offer.get("vendor_id") and offer.get("title"):
+        return ("vt", str(offer["vendor_id"]), str(offer["title"]))
+    raise ValueError("offer needs an id or vendor_id + title")
+
+class IngestQueue:
+    """Pending offer events, coalesced per offer and applied in micro-batches."""
+    def __init__(self, store, batch_size: Optional[int] = None, max_delay_s: Optional[float] = None,
+                 max_pending: Optional[int] = None, compact_ratio: Optional[float] = None):
+        self.store = store
+        self.batch_size = settings.ingest_batch_size if batch_size is None else batch_size
+        self.max_delay_s = settings.ingest_max_delay_s if max_delay_s is None else max_delay_s
+        self.max_pending = settings.ingest_max_pending if max_pending is None else max_pending
+        self.compact_ratio = settings.ingest_compact_ratio if compact_ratio is None else compact_ratio
+        # key -> (op, offer, first enqueued at)
+        self.pending: "OrderedDict[tuple, Tuple[str, Dict[str, Any], float]]" = OrderedDict()
+        self.stats = {"received": 0, "coalesced": 0, "applied": 0, "batches": 0, "failed_batches": 0,
+                      "compactions": 0, "last_batch_ms": 0.0, "last_applied_at": None}
+        self._cond = threading.Condition()
+        self._inflight = 0
+        self._stop = False
+        self._thread: Optional[threading.Thread] = None
+
+    # ---- producer side -------------------------------------------------
+    def submit(self, op: str, offer: Dict[str, Any], block: bool = False, timeout: Optional[float] = None):
+        """Queue one event; raises QueueFull (or waits, with `block`) when at capacity."""
+        if op not in OPS:
+            raise ValueError(f"unknown op {op!r}")
+        key = _event_key(offer)
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while key not in self.pending and len(self.pending) >= self.max_pending:
+                left = None if deadline is None else deadline - time.time()
+                if not block or (left is not None and left <= 0):
+                    raise QueueFull(f"{len(self.pending)} offers pending")
+                self._cond.wait(left)
+            self.stats["received"] += 1
+            prev = self.pending.get(key)
+            if prev is not None:
+                self.stats["coalesced"] += 1
+            # latest event wins, but the offer keeps its queue position and lag clock
+            self.pending[key] = (op, dict(offer), prev[2] if prev else time.time())
+            if len(self.pending) == 1 or len(self.pending) >= self.batch_size:
+                # first event starts the delay clock; a full batch is due now
+                self._cond.notify_all()
+
+    def submit_many(self, events: List[Dict[str, Any]]) -> int:
+        """Webhook payload helper; checks capacity for the whole list up front."""
+        parsed = [(e.get("op", "upsert"), e.get("offer") or {}) for e in events]
+        for op, offer in parsed:
+            if op not in OPS:
+                raise ValueError(f"unknown op {op!r}")
+            _event_key(offer)
+        with self._cond:
+            if len(self.pending) + len(parsed) > self.max_pending:
+                raise QueueFull(f"{len(self.pending)} offers pending")
+            for op, offer in parsed:
+                self.submit(op, offer)
+        return len(parsed)
+
+    # ---- consumer side -------------------------------------------------
+    def _take_batch(self) -> List[Tuple[str, Dict[str, Any]]]:
+        with self._cond:
+            batch = []
+            while self.pending and len(batch) < self.batch_size:
+                _, (op, offer, _) = self.pending.popitem(last=False)
+                batch.append((op, offer))
+            self._inflight = len(batch)
+            self._cond.notify_all()
+            return batch
+
+    def apply_pending(self) -> Dict[str, int]:
+        """Apply one micro-batch now (the worker calls this; so can tests/CLI)."""
+        batch = self._take_batch()
+        if not batch:
+            return {}
+        t = time.perf_counter()
+        try:
+            result = self.store.apply_batch([o for op, o in batch if op == "upsert"],
+                                            [o for op, o in batch if op == "delete"])
+        except Exception:
+            with self._cond:
+                self.stats["failed_batches"] += 1
+                self._inflight = 0
+            raise
+        table = self.store.table
+        if table is not None and table.n and 1 - table.live.sum() / table.n > self.compact_ratio:
+            # too many tombstones: drop them with a full rebuild
+            self.store.build_indexes()
+            self.stats["compactions"] += 1
+        with self._cond:
+            self.stats["applied"] += len(batch)
+            self.stats["batches"] += 1
+            self.stats["last_batch_ms"] = round((time.perf_counter() - t) * 1000, 1)
+            self.stats["last_applied_at"] = time.time()
+            self._inflight = 0
+            self._cond.notify_all()
+        return result
+
+    def _due(self) -> Optional[float]:
+        """Seconds until the next batch is due (0 = now), None when idle. Caller holds the lock."""
+        if not self.pending:
+            return None
+        if len(self.pending) >= self.batch_size:
+            return 0.0
+        oldest = next(iter(self.pending.values()))[2]
+        return max(0.0, oldest + self.max_delay_s - time.time())
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._stop and (wait := self._due()) != 0.0:
+                    self._cond.wait(wait)
+                if self._stop:
+                    return
+            try:
+                result = self.apply_pending()
+                print(f"📥 Ingest batch applied: {result}")
+            except Exception as e:
+                print(f"⚠️  Ingest batch failed: {type(e).__name__}: {e}")
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Apply everything pending (in the caller's thread when no worker runs)."""
+        if self._thread is None:
+            while self.pending:
+                self.apply_pending()
+            return True
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            self._cond.notify_all()
+            while self.pending or self._inflight:
+                left = None if deadline is None else deadline - time.time()
+                if left is not None and left <= 0:
+                    return False
+                self._cond.wait(left if left is not None else 0.1)
+        return True
+
+    def lag(self) -> Dict[str, Any]:
+        with self._cond:
+            oldest = next(iter(self.pending.values()))[2] if self.pending else None
+            return {"pending": len(self.pending), "inflight": self._inflight,
+                    "oldest_pending_s": round(time.time() - oldest, 3) if oldest else 0.0,
+                    "generation": self.store.generation, **self.stats}
+
+    def start(self) -> "IngestQueue":
+        if self._thread is None:
+            self._stop = False
+            self._thread = threading.Thread(target=self._loop, name="sahra-ingest", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, flush: bool = True):
+        if flush:
+            self.flush(timeout=30)
+        with self._cond:
+            self._stop = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+# ---- webhook ------------------------------------------------------------
+def _make_handler(queue: IngestQueue, token: Optional[str]):
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, code: int, body: Dict[str, Any], headers: Optional[Dict[str, str]] = None):
+            data = json.dumps(body).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _authorized(self) -> bool:
+            if not token:
+                return True
+            return hmac.compare_digest(self.headers.get("X-Webhook-Token", ""), token)
+
+        def do_GET(self):
+            if self.path != "/ingest/status":
+                return self._reply(404, {"error": "not found"})
+            self._reply(200, queue.lag())
+
+        def do_POST(self):
+            if self.path != "/offers":
+                return self._reply(404, {"error": "not found"})
+            if not self._authorized():
+                return self._reply(401, {"error": "bad token"})
+            try:
+                payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"null")
+                events = payload if isinstance(payload, list) else [payload]
+                n = queue.submit_many(events)
+            except QueueFull as e:
+                retry = max(1, int(queue.max_delay_s + 0.999))
+                return self._reply(429, {"error": str(e), **queue.lag()}, {"Retry-After": str(retry)})
+            except (ValueError, TypeError, AttributeError) as e:
+                return self._reply(400, {"error": str(e)})
+            self._reply(202, {"accepted": n, "pending": len(queue.pending)})
+
+        def log_message(self, fmt, *args):
+            pass
+
+    return Handler
+
+def serve_webhook(queue: IngestQueue, host: Optional[str] = None, port: Optional[int] = None,
+                  token: Optional[str] = None) -> ThreadingHTTPServer:
+    """Start the webhook server in a daemon thread and return it (call .shutdown() to stop)."""
+    host = settings.ingest_webhook_host if host is None else host
+    port = settings.ingest_webhook_port if port is None else port
+    token = settings.ingest_webhook_token if token is None else token
+    server = ThreadingHTTPServer((host, port), _make_handler(queue, token))
+    threading.Thread(target=server.serve_forever, name="sahra-webhook", daemon=True).start()
+    print(f"🪝 Ingest webhook listening on http://{host}:{server.server_address[1]}/offers")
+    return server
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--host", default=settings.ingest_webhook_host)
+    ap.add_argument("--port", type=int, default=settings.ingest_webhook_port)
+    args = ap.parse_args(argv)
+
+    from .store import DualIndexStore
+    store = DualIndexStore(settings.embed_model)
+    store.build_indexes()
+    queue = IngestQueue(store).start()
+    server = serve_webhook(queue, args.host, args.port)
+    try:
+        while True:
+            time.sleep(60)
+            print(f"📊 Ingest lag: {queue.lag()}")
+    except KeyboardInterrupt:
+        server.shutdown()
+        queue.stop()
+
+if __name__ == "__main__":
+    main()
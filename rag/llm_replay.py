@@ -0,0 +1,158 @@
+"""Record / replay of LLM calls for offline, deterministic runs.
+
+`settings.llm_mode` (or the SAHRA_LLM_MODE environment variable) picks
+the client that `graph.async_completion` uses:
+
+- "live": litellm, as before;
+- "record": litellm. Each call's `(model, messages, params)` and its
+  response are written to the cassette directory;
+- "replay": calls are answered from the cassette only. litellm is not
+  imported and nothing goes over the network. A call that was not
+  recorded raises `ReplayMiss`, which the nodes do not turn into a
+  fallback answer.
+
+Entries are content-addressed: the file name is the sha256 of the
+canonical JSON of the request, stored under `<dir>/<key[:2]>/<key>.json`.
+So the same prompt with the same model and params always maps to the
+same file, and re-recording overwrites it in place. Each entry keeps the
+latency seen while recording; replay sleeps for that latency times
+`llm_replay_latency_scale` (0 = instant, 1 = as recorded).
+
+    python -m rag.llm_replay [--dir data/llm_cassettes]   # summary of a cassette
+"""
+import argparse, asyncio, hashlib, json, os, time
+from collections import Counter
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+from .config import settings
+
+LIVE, RECORD, REPLAY = "live", "record", "replay"
+
+class ReplayMiss(RuntimeError):
+    """A replayed call has no recorded response."""
+
+def llm_mode() -> str:
+    mode = os.environ.get("SAHRA_LLM_MODE", settings.llm_mode)
+    if mode not in (LIVE, RECORD, REPLAY):
+        raise ValueError(f"llm_mode must be one of live/record/replay, got {mode!r}")
+    return mode
+
+def request_key(model: str, messages: List[Dict[str, Any]], params: Dict[str, Any]) -> str:
+    body = json.dumps({"model": model, "messages": messages, "params": params},
+                      sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(body.encode("utf-8")).hexdigest()
+
+def _content(resp) -> str:
+    msg = resp.choices[0].message
+    return msg.content if hasattr(msg, "content") else msg["content"]
+
+def _usage(resp) -> Optional[Dict[str, int]]:
+    usage = getattr(resp, "usage", None)
+    if usage is None:
+        return None
+    get = usage.get if isinstance(usage, dict) else (lambda k: getattr(usage, k, None))
+    return {"prompt_tokens": get("prompt_tokens"), "completion_tokens": get("completion_tokens")}
+
+def _response(entry: Dict[str, Any]):
+    """Just enough of a litellm ModelResponse for `async_completion`."""
+    usage = entry.get("usage")
+    return SimpleNamespace(
+        choices=[SimpleNamespace(message=SimpleNamespace(role="assistant", content=entry["content"]))],
+        usage=SimpleNamespace(**usage) if usage else None,
+        model=entry["model"])
+
+class Cassette:
+    def __init__(self, root: Optional[str] = None):
+        self.root = root or settings.llm_cassette_dir
+        self.stats = Counter()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], f"{key}.json")
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self.path(key), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def put(self, key: str, entry: Dict[str, Any]):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(entry, f, ensure_ascii=False, indent=1, sort_keys=True)
+        os.replace(tmp, path)  # concurrent recorders of the same call never leave a torn file
+
+    def entries(self):
+        if not os.path.isdir(self.root):
+            return
+        for sub in sorted(os.listdir(self.root)):
+            d = os.path.join(self.root, sub)
+            if os.path.isdir(d):
+                for name in sorted(os.listdir(d)):
+                    if name.endswith(".json"):
+                        with open(os.path.join(d, name), encoding="utf-8") as f:
+                            yield json.load(f)
+
+def recording_client(live, cassette: Cassette):
+    """Wrap `live` (litellm.acompletion's signature) so every response is also saved."""
+    async def acompletion(model: str, messages: List[Dict[str, Any]], **params):
+        t = time.perf_counter()
+        resp = await live(model=model, messages=messages, **params)
+        key = request_key(model, messages, params)
+        cassette.put(key, {"model": model, "messages": messages, "params": params,
+                           "content": _content(resp), "usage": _usage(resp),
+                           "latency_s": round(time.perf_counter() - t, 4), "recorded_at": int(time.time())})
+        cassette.stats["recorded"] += 1
+        return resp
+    return acompletion
+
+def replay_client(cassette: Cassette, latency_scale: Optional[float] = None):
+    """A litellm.acompletion stand-in answering only from `cassette`."""
+    scale = settings.llm_replay_latency_scale if latency_scale is None else latency_scale
+
+    async def acompletion(model: str, messages: List[Dict[str, Any]], **params):
+        key = request_key(model, messages, params)
+        entry = cassette.get(key)
+        if entry is None:
+            cassette.stats["missed"] += 1
+            prompt = messages[-1]["content"] if messages else ""
+            raise ReplayMiss(f"no recorded response for {model} call {key[:12]} in {cassette.root} "
+                             f"(prompt starts {prompt[:80]!r}); re-run with llm_mode='record'")
+        cassette.stats["replayed"] += 1
+        if scale > 0 and entry.get("latency_s"):
+            await asyncio.sleep(entry["latency_s"] * scale)
+        return _response(entry)
+    return acompletion
+
+def wrap_client(load_live):
+    """The client for the configured mode; `load_live()` imports litellm and is not called on replay."""
+    mode = llm_mode()
+    if mode == REPLAY:
+        print(f"📼 Replaying LLM calls from {settings.llm_cassette_dir}")
+        return replay_client(Cassette())
+    live = load_live()
+    if mode == RECORD:
+        print(f"📼 Recording LLM calls to {settings.llm_cassette_dir}")
+        return recording_client(live, Cassette())
+    return live
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    ap.add_argument("--dir", default=settings.llm_cassette_dir)
+    args = ap.parse_args(argv)
+    n, models, latency = 0, Counter(), 0.0
+    for e in Cassette(args.dir).entries():
+        n += 1
+        models[e["model"]] += 1
+        latency += e.get("latency_s") or 0.0
+    print(f"{n} recorded calls in {args.dir}")
+    for model, count in models.most_common():
+        print(f"  {model:<24} {count}")
+    if n:
+        print(f"  mean recorded latency {latency / n:.2f}s")
+
+if __name__ == "__main__":
+    main()
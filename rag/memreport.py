@@ -0,0 +1,77 @@
+"""Memory footprint of the offer catalog: legacy dict layout vs. the compact DocTable.
+
+    python -m rag.memreport [--scale 1000000]
+"""
+import sys
+from typing import Dict, Any
+import numpy as np
+
+def deep_sizeof(obj, seen=None) -> int:
+    """Recursive sys.getsizeof for the containers used by both layouts."""
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    if isinstance(obj, np.ndarray):
+        return sys.getsizeof(obj) if obj.base is None else obj.nbytes
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(k, seen) + deep_sizeof(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_sizeof(x, seen) for x in obj)
+    elif hasattr(obj, "__slots__"):
+        size += sum(deep_sizeof(getattr(obj, s), seen) for s in obj.__slots__ if hasattr(obj, s))
+    elif hasattr(obj, "__dict__"):
+        size += deep_sizeof(vars(obj), seen)
+    return size
+
+def legacy_layout_bytes(store) -> int:
+    """Per-offer dicts with nested meta plus the stable/hot text lists kept for BM25."""
+    stable_docs, hot_docs = store.load_corpus()
+    stable_texts = [d["text"] for d in stable_docs]
+    hot_texts = [d["text"] for d in hot_docs]
+    return deep_sizeof([stable_docs, hot_docs, stable_texts, hot_texts])
+
+def compact_layout_bytes(table) -> int:
+    return deep_sizeof(table)
+
+def memory_report(store, scale_to: int = 1_000_000) -> Dict[str, Any]:
+    if store.table is None:
+        store.build_indexes()
+    n = max(store.table.n, 1)
+    legacy = legacy_layout_bytes(store)
+    compact = compact_layout_bytes(store.table)
+    return {
+        "offers": store.table.n,
+        "legacy_bytes": legacy,
+        "compact_bytes": compact,
+        "legacy_bytes_per_offer": legacy / n,
+        "compact_bytes_per_offer": compact / n,
+        "ratio": legacy / max(compact, 1),
+        "scaled_offers": scale_to,
+        "legacy_scaled_mb": legacy / n * scale_to / 2**20,
+        "compact_scaled_mb": compact / n * scale_to / 2**20,
+    }
+
+def format_report(r: Dict[str, Any]) -> str:
+    return "\n".join([
+        f"Offers measured:   {r['offers']}",
+        f"Legacy layout:     {r['legacy_bytes']:>12,} B  ({r['legacy_bytes_per_offer']:,.0f} B/offer)",
+        f"Compact layout:    {r['compact_bytes']:>12,} B  ({r['compact_bytes_per_offer']:,.0f} B/offer)",
+        f"Reduction:         {r['ratio']:.1f}x",
+        f"At {r['scaled_offers']:,} offers: legacy ≈ {r['legacy_scaled_mb']:,.0f} MB, compact ≈ {r['compact_scaled_mb']:,.0f} MB",
+    ])
+
+if __name__ == "__main__":
+    import argparse
+    from .config import settings
+    from .store import DualIndexStore
+
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--scale", type=int, default=1_000_000, help="catalog size to extrapolate to")
+    args = ap.parse_args()
+
+    store = DualIndexStore(settings.embed_model)
+    store.build_indexes()
+    print(format_report(memory_report(store, scale_to=args.scale)))
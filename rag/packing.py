@@ -0,0 +1,133 @@
+"""Token-budgeted context packing for the composer prompt.
+
+Candidates are sent as one pipe-separated table (a header row, then one line
+per offer) instead of a JSON object per offer, so keys are not repeated.
+Tokens are counted locally with tiktoken when its encoding can be loaded,
+otherwise with a ~4 characters/token estimate. If the prompt exceeds the
+model's budget, snippets are trimmed first and trailing candidates dropped
+last. Actual prompt/completion token counts reported by the API are
+accumulated in `token_ledger`.
+"""
+import math, threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from .config import settings
+
+_encoders: Dict[str, Any] = {}
+_encoders_lock = threading.Lock()
+
+def _encoder(model: str):
+    """tiktoken encoding for `model`, or None (not installed / files not downloadable)."""
+    with _encoders_lock:
+        if model not in _encoders:
+            try:
+                import tiktoken
+                try:
+                    enc = tiktoken.encoding_for_model(model)
+                except KeyError:
+                    enc = tiktoken.get_encoding("cl100k_base")
+            except Exception:
+                enc = None
+            _encoders[model] = enc
+        return _encoders[model]
+
+def count_tokens(text: str, model: Optional[str] = None) -> int:
+    if not text:
+        return 0
+    enc = _encoder(model or settings.mid_model)
+    if enc is not None:
+        return len(enc.encode(text))
+    return math.ceil(len(text) / 4)
+
+def token_budget(model: str) -> int:
+    return settings.compose_token_budgets.get(model, settings.compose_token_budget)
+
+def _num(x) -> str:
+    if x is None:
+        return ""
+    x = float(x)
+    return str(int(x)) if x.is_integer() else f"{x:g}"
+
+def _cell(s) -> str:
+    return " ".join(str(s or "").replace("|", "/").split())
+
+def _note(c: Dict[str, Any]) -> str:
+    """Snippet minus the title it repeats (snippets start with '<title>: ')."""
+    title, snippet = c.get("title") or "", c.get("snippet") or ""
+    if snippet.startswith(title + ":"):
+        snippet = snippet[len(title) + 1:].strip()
+    return "" if snippet in title else snippet
+
+CANDIDATE_COLUMNS = "id|title|city|pax|price_aed|updated|stale|note"
+# with availability checked for the requested date (the note stays last: it is what gets trimmed)
+CANDIDATE_COLUMNS_AVAIL = "id|title|city|pax|price_aed|updated|stale|avail|note"
+
+def candidate_rows(candidates: List[Dict[str, Any]], stale_ids=()) -> List[List[str]]:
+    stale_ids = set(stale_ids)
+    with_avail = any("availability" in c for c in candidates)
+    return [[str(c["id"]), _cell(c.get("title")), _cell(c.get("city")),
+             f"{_num(c.get('headcount_min'))}-{_num(c.get('headcount_max'))}",
+             f"{_num(c.get('price_min'))}-{_num(c.get('price_max'))}",
+             _cell(c.get("updated_at")), "y" if c["id"] in stale_ids else "",
+             *([_cell(c.get("availability"))] if with_avail else []), _cell(_note(c))]
+            for c in candidates]
+
+def render_facts(slots: Dict[str, Any], rows: List[List[str]], columns: str = CANDIDATE_COLUMNS) -> str:
+    set_slots = "; ".join(f"{k}={v}" for k, v in slots.items() if v not in (None, "", 0) and k != "intent")
+    lines = [f"request: {set_slots or '-'}", columns]
+    lines += ["|".join(r) for r in rows]
+    return "\n".join(lines)
+
+def pack_facts(facts: Dict[str, Any], render, model: str, fixed_tokens: int = 0,
+               stale_ids=()) -> Tuple[str, Dict[str, Any]]:
+    """Compact facts text whose rendered prompt fits the model's token budget.
+
+    `render(facts_text)` must return the full user prompt; `fixed_tokens` is
+    what the rest of the request (the system prompt) already costs.
+    """
+    budget = token_budget(model)
+    rows = candidate_rows(facts["candidates"], stale_ids)
+    slots = facts.get("slots") or {}
+    columns = CANDIDATE_COLUMNS_AVAIL if any("availability" in c for c in facts["candidates"]) else CANDIDATE_COLUMNS
+
+    def cost(rs):
+        return fixed_tokens + count_tokens(render(render_facts(slots, rs, columns)), model)
+
+    tokens = cost(rows)
+    trimmed = dropped = 0
+    # 1) shorten notes word by word from the longest one
+    while tokens > budget and any(r[-1] for r in rows):
+        longest = max(rows, key=lambda r: len(r[-1]))
+        words = longest[-1].split()
+        longest[-1] = " ".join(words[:max(len(words) * 2 // 3, 0)])
+        if longest[-1]:
+            longest[-1] += "…"
+        trimmed += 1
+        tokens = cost(rows)
+    # 2) drop trailing candidates, keeping the best one
+    while tokens > budget and len(rows) > 1:
+        rows.pop()
+        dropped += 1
+        tokens = cost(rows)
+    stats = {"prompt_tokens_est": tokens, "budget": budget, "candidates": len(rows),
+             "snippet_trims": trimmed, "dropped": dropped}
+    return render_facts(slots, rows, columns), stats
+
+class TokenLedger:
+    """Running prompt / completion token totals per (task, model)."""
+    def __init__(self):
+        self.totals: Dict[Tuple[str, str], Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, task: str, model: str, prompt_tokens: int, completion_tokens: int):
+        with self._lock:
+            t = self.totals.setdefault((task, model), {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0})
+            t["calls"] += 1
+            t["prompt_tokens"] += int(prompt_tokens or 0)
+            t["completion_tokens"] += int(completion_tokens or 0)
+
+    def snapshot(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {f"{task}:{model}": dict(t) for (task, model), t in self.totals.items()}
+
+token_ledger = TokenLedger()
@@ -0,0 +1,121 @@
+"""Cursor pagination over a search's ranked candidates.
+
+`node_retrieve` builds only the first page (`context_top_n` vendor-diverse
+docs). It then opens a cursor holding the ranked candidate arrays (rows and
+final scores, the best `page_cursor_depth` of them). "More results" asks
+the cursor for the next page: the next vendor-diverse pick among the
+candidates not shown yet, preferring vendors that have not appeared. That
+is a few array operations on the stored ranking, with no re-scoring and
+no LLM call. Only the docs of that page are built, and pages already
+served are remembered, so asking for the same page again returns the
+same offers.
+
+A cursor keeps the offer ids and scores plus the store's index generation,
+not the doc table, so it never holds an old table alive. A page looks the
+ids up in the store's current table. A cursor whose generation is no
+longer current (an ingest batch, tier move or rebuild since) has expired,
+as has one older than `page_cursor_ttl_s`.
+"""
+import secrets, threading
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from .config import settings
+from .fusion import diversified_top_k, top_k
+from .utils import TTLCache
+
+class Cursor:
+    def __init__(self, ids: np.ndarray, scores: np.ndarray, generation: int, page_size: int,
+                 first_page: Optional[np.ndarray] = None):
+        """`ids`: offer ids of the ranked candidates; `first_page`: ids already served as page 1."""
+        first_page = np.zeros(0, dtype=np.int64) if first_page is None else np.asarray(first_page, dtype=np.int64)
+        if len(ids) > settings.page_cursor_depth:
+            keep = top_k(scores, settings.page_cursor_depth)
+            keep = np.union1d(keep, np.flatnonzero(np.isin(ids, first_page)))
+            ids, scores = ids[keep], scores[keep]
+        self.ids, self.scores = np.asarray(ids, dtype=np.int64), scores
+        self.generation = generation
+        self.page_size = page_size
+        self.pages: List[np.ndarray] = []  # indices into ids, per served page
+        self._shown = np.zeros(len(ids), dtype=bool)
+        self._lock = threading.Lock()
+        if len(first_page):
+            self.restart(first_page)
+
+    def restart(self, first_page: np.ndarray):
+        """Make `first_page` (offer ids) page 1 and forget the pages served after it."""
+        with self._lock:
+            pos = {int(i): n for n, i in enumerate(self.ids.tolist())}
+            self.pages = []
+            self._shown[:] = False
+            self._serve(np.array([pos[i] for i in np.asarray(first_page).tolist() if i in pos], dtype=np.int64))
+
+    def _serve(self, picked: np.ndarray):
+        self.pages.append(picked)
+        self._shown[picked] = True
+
+    def _pick(self, table, rows: np.ndarray, pool: np.ndarray, k: int) -> np.ndarray:
+        order = diversified_top_k(rows[pool], self.scores[pool], table.vendor_code, k,
+                                  mmr_lambda=settings.mmr_lambda, table=table)
+        return pool[order]
+
+    def _next(self, table, rows: np.ndarray) -> np.ndarray:
+        remaining = np.flatnonzero(~self._shown)
+        if not len(remaining):
+            return remaining
+        vendors = table.vendor_code
+        seen = np.isin(vendors[rows[remaining]], vendors[rows[self._shown]])
+        picked = self._pick(table, rows, remaining[~seen], self.page_size) if (~seen).any() else remaining[:0]
+        if len(picked) < self.page_size:
+            # new vendors ran out: fill up with the next offers of vendors already shown
+            rest = np.setdiff1d(remaining, picked)
+            if len(rest):
+                picked = np.concatenate([picked, self._pick(table, rows, rest, self.page_size - len(picked))])
+        return picked
+
+    @property
+    def has_more(self) -> bool:
+        return not self._shown.all()
+
+    def page(self, store, number: int) -> Optional[Tuple[list, bool]]:
+        """(docs of page `number`, counting from 0; whether more pages follow), or None once the
+        store's indexes changed since the cursor was opened."""
+        generation, table = store.generation, store.table
+        if generation != self.generation:
+            return None
+        rows = table.rows_for_ids(self.ids)
+        if len(rows) != len(self.ids):
+            return None  # an offer went away between reading the generation and the table
+        with self._lock:
+            while len(self.pages) <= number and self.has_more:
+                self._serve(self._next(table, rows))
+            picked = self.pages[number] if number < len(self.pages) else self.ids[:0]
+            has_more = number + 1 < len(self.pages) or self.has_more
+        return table.views(rows[picked]), has_more
+
+class CursorStore:
+    def __init__(self, ttl_s: Optional[float] = None, max_items: Optional[int] = None):
+        self.cursors = TTLCache(ttl_seconds=settings.page_cursor_ttl_s if ttl_s is None else ttl_s,
+                                max_items=settings.page_cursor_max if max_items is None else max_items)
+
+    def open(self, store, rows: np.ndarray, scores: np.ndarray, first_page: Optional[np.ndarray] = None,
+             page_size: Optional[int] = None) -> str:
+        """Cursor over `rows` of the store's current table; `first_page` holds offer ids."""
+        generation, table = store.generation, store.table
+        cursor = Cursor(table.ids[rows], scores, generation, page_size or settings.context_top_n, first_page)
+        cursor_id = secrets.token_urlsafe(9)
+        self.cursors.set(cursor_id, cursor)
+        return cursor_id
+
+    def get(self, cursor_id: Optional[str]) -> Optional[Cursor]:
+        return self.cursors.get(cursor_id) if cursor_id else None
+
+    def page(self, store, cursor_id: Optional[str], number: int) -> Optional[Tuple[list, bool]]:
+        """(docs, has_more) for page `number` of a cursor, or None if it expired."""
+        cursor = self.get(cursor_id)
+        if cursor is None:
+            return None
+        return cursor.page(store, number)
+
+cursors = CursorStore()
@@ -0,0 +1,94 @@
+"""Startup profile: import time per module and first-query latency per stage.
+
+    python -m rag.profiling [--db :memory:] [--csv data/vendors.csv] [--query "..."] [--llm]
+
+Imports each `rag` module in dependency order and reports the time it added
+(the dependencies it shares with earlier modules are already loaded). It then
+lists which heavy third-party packages got pulled in, and times the first
+(cold) and second (warm) call of every retrieval stage. With `--llm` the
+full graph runs once, including the litellm import and the API calls.
+Nothing is written to an existing database: the CSV is only ingested into
+`:memory:` or an empty one.
+"""
+import argparse, asyncio, importlib, os, sys, time
+from typing import List, Tuple
+
+RAG_MODULES = [
+    "rag.config", "rag.utils", "rag.db", "rag.doctable", "rag.analyzer", "rag.bm25",
+    "rag.fusion", "rag.shards", "rag.ranges", "rag.typeahead", "rag.store", "rag.ingest",
+    "rag.retriever", "rag.rerank", "rag.cache", "rag.prompts", "rag.packing", "rag.availability",
+    "rag.slot_parse", "rag.conversation", "rag.llm_replay", "rag.pagination", "rag.graph", "rag.warm",
+    "rag.tiering", "rag.ingest_queue", "rag.workers",
+]
+HEAVY = ["torch", "sentence_transformers", "faiss", "litellm", "langgraph", "pandas", "tiktoken"]
+
+def profile_imports(modules: List[str] = RAG_MODULES) -> List[Tuple[str, float]]:
+    out = []
+    for name in modules:
+        t = time.perf_counter()
+        importlib.import_module(name)
+        out.append((name, time.perf_counter() - t))
+    return out
+
+def _timed(label: str, fn, rows: List[Tuple[str, float]]):
+    t = time.perf_counter()
+    result = fn()
+    rows.append((label, time.perf_counter() - t))
+    return result
+
+def profile_first_query(csv: str, query: str, llm: bool = False) -> List[Tuple[str, float]]:
+    from rag.config import settings
+    from rag.store import DualIndexStore
+    from rag.retriever import HybridRetriever
+
+    rows: List[Tuple[str, float]] = []
+    store = _timed("store: open db + schema", lambda: DualIndexStore(settings.embed_model), rows)
+    n = store.db.reader().execute("SELECT COUNT(*) FROM offers").fetchone()[0]
+    if n == 0:
+        from rag.ingest import ingest_csv
+        _timed("ingest: csv + build_indexes", lambda: ingest_csv(csv, store), rows)
+    else:
+        _timed("store: build_indexes", store.build_indexes, rows)
+    retriever = _timed("retriever: init", lambda: HybridRetriever(store), rows)
+    filters = {}
+    for run in ("first", "second"):
+        ranked = _timed(f"retriever.rank ({run})", lambda: retriever.rank(query, filters), rows)
+        _timed(f"retriever.materialize ({run})", lambda: retriever.materialize(query, *ranked), rows)
+
+    from rag.graph import build_graph
+    graph = _timed("graph: build (imports langgraph)", lambda: build_graph(retriever), rows)
+    if llm:
+        state = {"query": query, "retriever": retriever, "applied_filters": {}}
+        _timed("graph: first full query (imports litellm)", lambda: asyncio.run(graph.ainvoke(state)), rows)
+    return rows
+
+def _report(title: str, rows: List[Tuple[str, float]]):
+    print(f"\n{title}")
+    width = max(len(name) for name, _ in rows)
+    for name, secs in rows:
+        print(f"  {name:<{width}}  {secs * 1000:9.1f} ms")
+    print(f"  {'total':<{width}}  {sum(s for _, s in rows) * 1000:9.1f} ms")
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--db", default=":memory:", help="SQLite path (default: in-memory)")
+    ap.add_argument("--csv", default="data/vendors.csv")
+    ap.add_argument("--query", default="sunset yacht for 25 people in Dubai")
+    ap.add_argument("--llm", action="store_true", help="also run the full graph once (needs an API key)")
+    args = ap.parse_args(argv)
+    # DB_PATH is read when rag.store is imported
+    os.environ["SAHRA_DB"] = args.db
+
+    t0 = time.perf_counter()
+    imports = profile_imports()
+    _report("Import time per module", imports)
+    loaded = [m for m in HEAVY if m in sys.modules]
+    print(f"\nHeavy packages loaded at import: {', '.join(loaded) if loaded else 'none'}")
+
+    stages = profile_first_query(args.csv, args.query, llm=args.llm)
+    _report("First-query latency per stage", stages)
+    print(f"\nReady to serve after {(time.perf_counter() - t0) * 1000:.0f} ms "
+          f"(heavy packages now loaded: {', '.join(m for m in HEAVY if m in sys.modules) or 'none'})")
+
+if __name__ == "__main__":
+    main()
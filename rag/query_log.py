@@ -0,0 +1,61 @@
+"""Popularity of served queries.
+
+`QueryLog` records every served query (normalized text, sidebar filters,
+extracted slots) with a count and a time-decayed popularity score. It
+feeds the warmer (`rag.warm`) and typeahead's popular suggestions, and
+imports nothing from the pipeline so the store can use it.
+"""
+import math, threading, time
+from typing import Any, Dict, List, Optional
+
+from .config import settings
+from .utils import normalize_query
+
+def filters_key(filters: Optional[Dict[str, Any]]) -> tuple:
+    return tuple(sorted((k, v) for k, v in (filters or {}).items() if v))
+
+class QueryLog:
+    """Popularity of served queries, keyed by normalized text + active filters."""
+    def __init__(self, half_life_s: Optional[float] = None, max_entries: int = 10000):
+        self.half_life_s = settings.warm_half_life_s if half_life_s is None else half_life_s
+        self.max_entries = max_entries
+        self.entries: Dict[tuple, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def _decayed(self, entry: Dict[str, Any], now: float) -> float:
+        return entry["score"] * math.exp(-math.log(2) * (now - entry["last_seen"]) / self.half_life_s)
+
+    def record(self, query: str, filters: Optional[Dict[str, Any]] = None,
+               slots: Optional[Dict[str, Any]] = None, now: Optional[float] = None):
+        norm = normalize_query(query)
+        if not norm:
+            return
+        now = time.time() if now is None else now
+        key = (norm, filters_key(filters))
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                if len(self.entries) >= self.max_entries:
+                    # drop the least popular entry
+                    coldest = min(self.entries, key=lambda k: self._decayed(self.entries[k], now))
+                    del self.entries[coldest]
+                entry = self.entries[key] = {"query": norm, "filters": dict(filters or {}), "slots": None,
+                                             "count": 0, "score": 0.0, "first_seen": now, "last_seen": now}
+            entry["score"] = self._decayed(entry, now) + 1.0
+            entry["count"] += 1
+            entry["last_seen"] = now
+            if slots:
+                entry["slots"] = dict(slots)
+
+    def top(self, n: int, min_count: int = 1, now: Optional[float] = None) -> List[Dict[str, Any]]:
+        """The n most popular entries by decayed score."""
+        now = time.time() if now is None else now
+        with self._lock:
+            ranked = [(self._decayed(e, now), e) for e in self.entries.values() if e["count"] >= min_count]
+        ranked.sort(key=lambda x: -x[0])
+        return [dict(e, popularity=p) for p, e in ranked[:n]]
+
+    def __len__(self):
+        return len(self.entries)
+
+query_log = QueryLog()
@@ -0,0 +1,155 @@
+import copy
+from typing import Dict, Any, Optional, Tuple
+import numpy as np
+
+def _invert_csr(offsets: np.ndarray, values: np.ndarray, n_keys: int) -> Tuple[np.ndarray, np.ndarray]:
+    """row -> keys CSR  =>  key -> rows CSR (rows ascending within a key)."""
+    owners = np.repeat(np.arange(len(offsets) - 1, dtype=np.int64), np.diff(offsets))
+    order = np.lexsort((owners, values))
+    key_offsets = np.zeros(n_keys + 1, dtype=np.int64)
+    np.add.at(key_offsets, values.astype(np.int64) + 1, 1)
+    return np.cumsum(key_offsets), owners[order]
+
+class RangeIndex:
+    """Stabbing queries over per-row closed intervals [lo, hi].
+
+    Rows are kept sorted by lo and by hi. For a point x two binary searches
+    give "lo <= x" as a prefix of one order and "hi >= x" as a suffix of the
+    other; only the shorter of the two is scanned. That is O(log n + the
+    shorter side), which can approach O(n) (e.g. many disjoint intervals
+    around x), not O(log n + matches); fine for catalog-sized tables, where
+    it is a vectorized slice and compare.
+    """
+    ARRAYS = ("lo", "hi", "by_lo", "lo_sorted", "by_hi", "hi_sorted")
+
+    def __init__(self, lo: np.ndarray, hi: np.ndarray):
+        self.lo, self.hi = lo, hi
+        self.by_lo = np.argsort(lo, kind="stable")
+        self.lo_sorted = lo[self.by_lo]
+        self.by_hi = np.argsort(hi, kind="stable")
+        self.hi_sorted = hi[self.by_hi]
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray]) -> "RangeIndex":
+        self = cls.__new__(cls)
+        for name in cls.ARRAYS:
+            setattr(self, name, arrays[name])
+        return self
+
+    def containing(self, x) -> np.ndarray:
+        """Rows with lo <= x <= hi, ascending."""
+        n = len(self.lo)
+        a = int(np.searchsorted(self.lo_sorted, x, side="right"))   # by_lo[:a]  -> lo <= x
+        b = int(np.searchsorted(self.hi_sorted, x, side="left"))    # by_hi[b:]  -> hi >= x
+        if a <= n - b:
+            cand = self.by_lo[:a]
+            cand = cand[self.hi[cand] >= x]
+        else:
+            cand = self.by_hi[b:]
+            cand = cand[self.lo[cand] <= x]
+        return np.sort(cand)
+
+class FilterIndex:
+    """Sorted row sets for the metadata filters, built next to the BM25 shards.
+
+    City and occasion use inverted row lists (one slice per key, so
+    O(matches)); headcount and budget use `RangeIndex` (see its cost note).
+    Set filters are intersected smallest first. Retrieval candidates are
+    tested against the result with binary searches (`mask`), so no per-call
+    array over the whole table is allocated; filter-only queries enumerate
+    the rows directly.
+
+    Rows appended by an ingest batch go to a small delta (`extend`) that is
+    checked with `DocTable.filter_mask` per query; the sorted structures are
+    only rebuilt once the delta outgrows its limit. Tombstoned rows stay in
+    the index; retrieval masks them with the `live` column.
+    """
+    ARRAYS = ("city_offsets", "city_rows", "occ_offsets", "occ_rows")
+
+    def __init__(self, table):
+        self.n = table.n
+        self.cities = table.cities
+        self.occasions = table.occasions
+        self.headcount = RangeIndex(table.headcount_min, table.headcount_max)
+        self.price = RangeIndex(table.price_min, table.price_max)
+        city_ones = np.arange(table.n + 1, dtype=np.int64)
+        self.city_offsets, self.city_rows = _invert_csr(city_ones, table.city_code, len(table.cities))
+        self.occ_offsets, self.occ_rows = _invert_csr(table.occ_offsets, table.occ_values, len(table.occasions))
+        self.table = table
+        self.delta = np.zeros(0, dtype=np.int64)  # rows appended since the build, ascending
+
+    def extend(self, table, added: np.ndarray, max_delta: int) -> "FilterIndex":
+        """Index over `table` (a `DocTable.extend` of the indexed one) covering the `added` rows.
+
+        `self` is left untouched for searches that still hold it.
+        """
+        delta = np.concatenate([self.delta, np.asarray(added, dtype=np.int64)])
+        if len(delta) > max_delta:
+            return FilterIndex(table)
+        out = copy.copy(self)
+        out.table, out.n, out.cities, out.occasions, out.delta = table, table.n, table.cities, table.occasions, delta
+        return out
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        out = {name: getattr(self, name) for name in self.ARRAYS}
+        out["delta"] = self.delta
+        for prefix, rng in (("headcount", self.headcount), ("price", self.price)):
+            for name in RangeIndex.ARRAYS:
+                out[f"{prefix}.{name}"] = getattr(rng, name)
+        return out
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray], table) -> "FilterIndex":
+        self = cls.__new__(cls)
+        self.table, self.n, self.cities, self.occasions = table, table.n, table.cities, table.occasions
+        for name in cls.ARRAYS:
+            setattr(self, name, arrays[name])
+        self.delta = arrays["delta"]
+        self.headcount = RangeIndex.from_arrays({k: arrays[f"headcount.{k}"] for k in RangeIndex.ARRAYS})
+        self.price = RangeIndex.from_arrays({k: arrays[f"price.{k}"] for k in RangeIndex.ARRAYS})
+        return self
+
+    def _keyed_rows(self, offsets: np.ndarray, rows: np.ndarray, keys: np.ndarray) -> np.ndarray:
+        # keys interned after the build (a new city in the delta) have no list yet
+        parts = [rows[offsets[k]:offsets[k + 1]] for k in keys if k < len(offsets) - 1]
+        if len(parts) == 1:
+            return parts[0]
+        return np.unique(np.concatenate(parts)) if parts else np.zeros(0, dtype=np.int64)
+
+    def rows(self, filters: Optional[Dict[str, Any]]) -> Optional[np.ndarray]:
+        """Sorted rows passing every set filter (None if no filter is set)."""
+        filters = filters or {}
+        selections = []
+        if filters.get("city"):
+            selections.append(self._keyed_rows(self.city_offsets, self.city_rows, self.cities.lookup_ci(filters["city"])))
+        if filters.get("occasion"):
+            selections.append(self._keyed_rows(self.occ_offsets, self.occ_rows, self.occasions.lookup_ci(filters["occasion"])))
+        if filters.get("headcount"):
+            selections.append(self.headcount.containing(filters["headcount"]))
+        if filters.get("budget"):
+            selections.append(self.price.containing(filters["budget"]))
+        if not selections:
+            return None
+        # intersect smallest-first so every step is bounded by the best filter
+        selections.sort(key=len)
+        out = selections[0]
+        for sel in selections[1:]:
+            out = np.intersect1d(out, sel, assume_unique=True)
+        if len(self.delta):
+            # delta rows come after every indexed row, so the result stays sorted
+            out = np.concatenate([out, self.delta[self.table.filter_mask(self.delta, filters)]])
+        return out
+
+    def mask(self, rows: np.ndarray, filters: Optional[Dict[str, Any]]) -> np.ndarray:
+        """Which of `rows` pass every set filter (all of them if no filter is set)."""
+        return in_sorted(self.rows(filters), rows)
+
+def in_sorted(allowed: Optional[np.ndarray], rows: np.ndarray) -> np.ndarray:
+    """Membership of `rows` in the ascending array `allowed` (None = everything), O(m log k)."""
+    rows = np.asarray(rows, dtype=np.int64)
+    if allowed is None:
+        return np.ones(len(rows), dtype=bool)
+    if not len(allowed):
+        return np.zeros(len(rows), dtype=bool)
+    pos = np.minimum(np.searchsorted(allowed, rows), len(allowed) - 1)
+    return allowed[pos] == rows
@@ -0,0 +1,201 @@
+"""Cross-encoder reranking as a batched, cached service.
+
+`Reranker` owns the CrossEncoder on one worker thread. Each request
+submits its (query, doc text) pairs and waits for them with a deadline.
+The worker collects pairs from all concurrent requests for up to
+`rerank_max_wait_ms` (or until `rerank_batch_size` are queued) and scores
+them in one `predict` call, so the event loop never runs the model.
+Scores are cached under (normalized query, doc id, text version). A doc
+is rescored only after its text changes, even across index rebuilds.
+
+The model loads on the worker thread, so turning reranking on never
+blocks startup. A request that misses its deadline, or arrives while the
+model is still loading or failed to load, gets None and keeps the fused
+order; one whose batch fails keeps it too. A batch that outlives its
+request still completes and fills the cache.
+
+Docs are scored on their title, description and tags. The model truncates
+each pair to `rerank_max_tokens`. The text is cut to that many words
+beforehand, since a word is at least one token.
+"""
+import asyncio, queue, threading, time, zlib
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .config import settings
+from .utils import TTLCache, normalize_query, resolve_future
+
+def _load_cross_encoder(name: str):
+    """CrossEncoder (sentence_transformers + torch) is imported only when reranking is on."""
+    try:
+        from sentence_transformers import CrossEncoder
+    except ImportError:
+        print("⚠️  Reranking disabled - CrossEncoder not available")
+        return None
+    return CrossEncoder(name, max_length=settings.rerank_max_tokens)
+
+def rerank_text(table, row: int) -> str:
+    text = f"{table.title[row]}. {table.description[row]} Tags: {', '.join(table.tag_names(row))}"
+    words = text.split()
+    return " ".join(words[:settings.rerank_max_tokens]) if len(words) > settings.rerank_max_tokens else text
+
+def text_version(text: str) -> int:
+    return zlib.crc32(text.encode("utf-8"))
+
+class Reranker:
+    def __init__(self, model_name: Optional[str] = None, loader=_load_cross_encoder):
+        self.model_name = model_name or settings.rerank_model
+        self.loader = loader
+        self.model = None
+        self.ready = threading.Event()   # set once loading finished (model may still be None)
+        self.cache = TTLCache(ttl_seconds=settings.rerank_cache_ttl_s, max_items=settings.rerank_cache_size)
+        self.stats = {"pairs": 0, "cached": 0, "batches": 0, "timeouts": 0, "errors": 0, "last_batch_ms": 0.0}
+        self._stats_lock = threading.Lock()  # updated by the worker and by every request's thread
+        self._queue: "queue.Queue[Tuple[str, str, str, Future]]" = queue.Queue()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    # ---- worker --------------------------------------------------------
+    def _load(self):
+        try:
+            self.model = self.loader(self.model_name)
+        except Exception as e:
+            print(f"⚠️  Reranker failed to load: {type(e).__name__}: {e}")
+            self.model = None
+        self.ready.set()
+
+    def _take_batch(self) -> List[Tuple[str, str, str, Future]]:
+        try:
+            batch = [self._queue.get(timeout=0.5)]
+        except queue.Empty:
+            return []
+        until = time.monotonic() + settings.rerank_max_wait_ms / 1000
+        while len(batch) < settings.rerank_batch_size:
+            left = until - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=max(left, 0)) if left > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self):
+        self._load()
+        while not self._stop.is_set():
+            batch = self._take_batch()
+            if not batch:
+                continue
+            # the same pair can be queued by concurrent requests; score it once
+            unique: Dict[str, Tuple[str, str]] = {}
+            for key, q, text, _ in batch:
+                unique.setdefault(key, (q, text))
+            t = time.perf_counter()
+            try:
+                if self.model is None:
+                    raise RuntimeError("reranker model not available")
+                scores = dict(zip(unique, np.asarray(self.model.predict(list(unique.values()))).tolist()))
+            except Exception as e:
+                for *_, fut in batch:
+                    resolve_future(fut, exc=e)
+                continue
+            for key, s in scores.items():
+                self.cache.set(key, s)
+            for key, _, _, fut in batch:
+                resolve_future(fut, scores[key])
+            with self._stats_lock:
+                self.stats["batches"] += 1
+                self.stats["last_batch_ms"] = round((time.perf_counter() - t) * 1000, 1)
+
+    def start(self) -> "Reranker":
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name="sahra-rerank", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    # ---- requests ------------------------------------------------------
+    async def score(self, query: str, docs: List[Tuple[int, str]], timeout_s: float) -> Optional[np.ndarray]:
+        """Cross-encoder score per (doc id, text), or None if not available within `timeout_s`.
+
+        Raises what the model raised if the batch failed.
+        """
+        if not self.ready.is_set() or self.model is None:
+            return None
+        norm = normalize_query(query)
+        out = np.empty(len(docs), dtype=np.float64)
+        waiting: List[Tuple[int, Future]] = []
+        for i, (doc_id, text) in enumerate(docs):
+            key = f"{norm}|{doc_id}|{text_version(text)}"
+            hit = self.cache.get(key)
+            if hit is not None:
+                out[i] = hit
+                continue
+            fut: Future = Future()
+            self._queue.put((key, norm, text, fut))
+            waiting.append((i, fut))
+        with self._stats_lock:
+            self.stats["pairs"] += len(docs)
+            self.stats["cached"] += len(docs) - len(waiting)
+        if waiting:
+            try:
+                results = await asyncio.wait_for(
+                    asyncio.gather(*(asyncio.wrap_future(f) for _, f in waiting)), timeout_s)
+            except asyncio.TimeoutError:
+                with self._stats_lock:
+                    self.stats["timeouts"] += 1
+                return None
+            except Exception:
+                with self._stats_lock:
+                    self.stats["errors"] += 1
+                raise
+            for (i, _), s in zip(waiting, results):
+                out[i] = s
+        return out
+
+async def rerank_candidates(reranker: Optional["Reranker"], query: str, table, rows: np.ndarray,
+                            scores: np.ndarray, timeout_s: float) -> Tuple[np.ndarray, Optional[str]]:
+    """Fused scores with the top `rerank_depth` candidates reordered by the cross-encoder.
+
+    Reranked rows are lifted above every other candidate (fused RRF scores are
+    < 1), keeping their cross-encoder order. Returns (scores, None) or, when
+    reranking was skipped, the input scores and why ("off", "loading",
+    "unavailable", "deadline" or "error").
+    """
+    if reranker is None or not len(rows) or not query.strip():
+        return scores, "off"
+    depth = min(settings.rerank_depth, len(rows))
+    top = np.argpartition(-scores, depth - 1)[:depth] if depth < len(rows) else np.arange(len(rows))
+    docs = [(int(table.ids[rows[i]]), rerank_text(table, rows[i])) for i in top]
+    try:
+        ce = await reranker.score(query, docs, timeout_s)
+    except Exception as e:
+        print(f"   ⚠️ Rerank failed: {type(e).__name__}: {e}")
+        return scores, "error"
+    if ce is None:
+        if not reranker.ready.is_set():
+            return scores, "loading"
+        return scores, "unavailable" if reranker.model is None else "deadline"
+    order = np.argsort(-ce, kind="stable")
+    out = scores.astype(np.float64, copy=True)
+    out[top[order]] = 1.0 + (depth - np.arange(depth)) / depth
+    return out, None
+
+_reranker: Optional[Reranker] = None
+_reranker_lock = threading.Lock()
+
+def get_reranker() -> Optional[Reranker]:
+    """Process-wide reranker, started (model loading in the background) on first use."""
+    global _reranker
+    if not settings.use_reranker:
+        return None
+    with _reranker_lock:
+        if _reranker is None:
+            _reranker = Reranker().start()
+    return _reranker
@@ -1,151 +1,134 @@
-from typing import Dict, Any, List, Tuple
+from typing import Dict, Any, List, Optional, Tuple
 import numpy as np
 from .config import settings
-from .utils import rrf
+from .fusion import Leg, EMPTY_LEG, diversified_top_k, rank_leg, rrf_fuse
+from .ranges import in_sorted
+from .shards import route
 
-# Try to import CrossEncoder, fallback if not available
-try:
-    from sentence_transformers import CrossEncoder
-    CROSS_ENCODER_AVAILABLE = True
-except ImportError:
-    CROSS_ENCODER_AVAILABLE = False
-    print("⚠️  CrossEncoder not available, reranking will be disabled")
-
-def _bm25_scores(bm25, texts: List[str], query: str) -> List[float]:
-    if bm25 is None or not texts:
-        return []
-    return bm25.get_scores(query.split())
+def _bm25_scores(bm25, query_ids: np.ndarray) -> np.ndarray:
+    if bm25 is None or not bm25.n_docs:
+        return np.zeros(0)
+    return bm25.get_scores(query_ids)
 
 class HybridRetriever:
     def __init__(self, store):
         self.store = store
-        if CROSS_ENCODER_AVAILABLE and settings.use_reranker:
-            self.reranker = CrossEncoder(settings.rerank_model)
-        else:
-            self.reranker = None
-            if settings.use_reranker:
-                print("⚠️  Reranking disabled - CrossEncoder not available")
 
-    def _dense_search(self, query: str, top_k: int, hot=False) -> List[Tuple[int, float]]:
+    def _dense_search(self, query: str, top_k: int, hot=False) -> Leg:
         # Skip dense search if FAISS is disabled
-        if hot and self.store.faiss_hot is None:
-            return []
-        if not hot and self.store.faiss_stable is None:
-            return []
-            
+        index = self.store.faiss_hot if hot else self.store.faiss_stable
+        if index is None:
+            return EMPTY_LEG
+
         model = self.store.model
         qv = model.encode([query], convert_to_numpy=True, normalize_embeddings=True)[0]
-        if hot and self.store.faiss_hot is not None:
-            D, I = self.store.faiss_hot.search(np.array([qv]).astype('float32'), top_k)
-            return [(self.store.hot_ids[i], float(d)) for d, i in zip(D[0], I[0]) if i != -1]
-        if not hot and self.store.faiss_stable is not None:
-            D, I = self.store.faiss_stable.search(np.array([qv]).astype('float32'), top_k)
-            return [(self.store.stable_ids[i], float(d)) for d, i in zip(D[0], I[0]) if i != -1]
-        return []
+        D, I = index.search(np.array([qv]).astype('float32'), top_k)
+        # FAISS already returns neighbours best-first
+        ok = I[0] != -1
+        rows = self.store.hot_rows if hot else self.store.stable_rows
+        return rows[I[0][ok]], D[0][ok].astype(np.float64)
 
-    def _bm25_search(self, query: str, top_k: int, hot=False) -> List[Tuple[int, float]]:
-        if hot and self.store.bm25_hot is not None:
-            scores = _bm25_scores(self.store.bm25_hot, self.store.hot_texts, query)
-            ranked = np.argsort(scores)[::-1][:top_k]
-            return [(self.store.hot_ids[i], float(scores[i])) for i in ranked]
-        if not hot and self.store.bm25_stable is not None:
-            scores = _bm25_scores(self.store.bm25_stable, self.store.stable_texts, query)
-            ranked = np.argsort(scores)[::-1][:top_k]
-            return [(self.store.stable_ids[i], float(scores[i])) for i in ranked]
-        return []
+    def _bm25_search(self, query: str, top_k: int, hot=False, shards=None) -> Leg:
+        """Scatter to the routed shards, gather each shard's top-k, merge."""
+        if shards is None:
+            shards = list(self.store.shards.values())
+        query_ids = self.store.analyzer.analyze_query(query)
+        rows_parts, score_parts = [], []
+        for shard in shards:
+            bm25 = shard.bm25_hot if hot else shard.bm25_stable
+            if bm25 is None:
+                continue
+            scores = _bm25_scores(bm25, query_ids)
+            dead = None if hot else shard.stable_dead
+            if dead is not None:
+                # promoted to hot since the stable build; scored by the hot leg
+                scores = np.where(dead, -np.inf, scores)
+            rows, scores = rank_leg(scores, shard.hot_rows if hot else shard.stable_rows, top_k)
+            if dead is not None:
+                live = np.isfinite(scores)
+                rows, scores = rows[live], scores[live]
+            rows_parts.append(rows)
+            score_parts.append(scores)
+        if not rows_parts:
+            return EMPTY_LEG
+        rows, scores = np.concatenate(rows_parts), np.concatenate(score_parts)
+        if len(rows_parts) > 1:
+            # occasion shards can overlap; keep one entry per row
+            rows, first = np.unique(rows, return_index=True)
+            scores = scores[first]
+        return rank_leg(scores, rows, top_k)
 
     def search(self, query: str, filters: Dict[str, Any]) -> List[Dict[str, Any]]:
-        # First-pass dense + BM25 on both stable/hot, then RRF merge
-        dn_stable = self._dense_search(query, settings.ann_top_k, hot=False)
-        dn_hot    = self._dense_search(query, settings.ann_top_k, hot=True)
-        bm_stable = self._bm25_search(query, settings.bm25_top_k, hot=False)
-        bm_hot    = self._bm25_search(query, settings.bm25_top_k, hot=True)
-
-        # Convert to ranking dicts for RRF
-        def rank_dict(pairs):
-            # Convert scores to ranks (descending); if already similarity, higher is better
-            sorted_pairs = sorted(pairs, key=lambda x: x[1], reverse=True)
-            return {doc_id: score for doc_id, score in sorted_pairs}
+        rows, scores = self.rank(query, filters)
+        return self.materialize(query, rows, scores)
 
-        merged_scores = rrf([rank_dict(dn_stable), rank_dict(dn_hot), rank_dict(bm_stable), rank_dict(bm_hot)], k=settings.rrf_k)
-        
-        # Apply metadata filters
-        if filters:
-            filtered = {}
-            for doc_id, score in merged_scores.items():
-                try:
-                    docs = self.store.get_docs_by_ids([doc_id])
-                    if docs and _passes_filters(docs[0]["meta"], filters):
-                        filtered[doc_id] = score
-                except Exception:
-                    continue
-            merged_scores = filtered
+    def rank(self, query: str, filters: Dict[str, Any]) -> Leg:
+        """Fused and filtered candidates as (rows, scores), unsorted.
 
-        top_n = sorted(merged_scores.items(), key=lambda x: x[1], reverse=True)[:settings.keep_top_n]
-        docs = self.store.get_docs_by_ids([doc_id for doc_id, _ in top_n])
+        This is the CPU-heavy half of `search`; it only reads index arrays, so
+        `workers.RetrievalPool` can run it in other processes.
+        """
+        table = self.store.table
+        filter_index = getattr(self.store, "filter_index", None)
+        has_filters = bool(filters) and any(filters.values())
+        # sorted rows passing the filters (None = no filter index / no filters)
+        allowed = filter_index.rows(filters) if (filter_index is not None and has_filters) else None
 
-        # Deduplicate by vendor_id to ensure diversity
-        seen_vendors = set()
-        deduped_docs = []
-        for doc in docs:
-            vendor_id = doc["meta"].get("vendor_id")
-            if vendor_id not in seen_vendors:
-                seen_vendors.add(vendor_id)
-                deduped_docs.append(doc)
-        docs = deduped_docs
-        print(f"   After deduplication: {len(docs)} unique vendors from {len(top_n)} results")
+        # Filter-only request (e.g. sidebar filters with an empty or all-stopword
+        # query): BM25 would score every doc 0, so enumerate the filter rows instead.
+        dense_enabled = self.store.faiss_stable is not None or self.store.faiss_hot is not None
+        if not dense_enabled and len(self.store.analyzer.analyze_query(query)) == 0:
+            rows = allowed if allowed is not None else np.arange(table.n)
+            if allowed is None and has_filters:
+                rows = rows[table.filter_mask(rows, filters)]
+            rows = rows[table.live[rows]]
+            # hot (recently updated) offers first, then catalog order, on the RRF scale
+            rows = rows[np.argsort(~table.is_hot[rows], kind="stable")]
+            return rows, 1.0 / (settings.rrf_k + np.arange(1, len(rows) + 1, dtype=np.float64))
 
-        # Ambiguity check
-        ambiguous = False
-        if len(top_n) >= 3:
-            s1 = top_n[0][1]; s3 = top_n[2][1]
-            ambiguous = (s1 - s3) < settings.ambiguity_delta
-        
-        # Optional rerank on the top-3 if ambiguous
-        if settings.use_reranker and ambiguous and self.reranker is not None:
-            try:
-                pairs = [(doc, self._salient_text(doc)) for doc in docs[:3]]
-                inputs = [(query, txt) for _, txt in pairs]
-                scores = self.reranker.predict(inputs)
-                order = np.argsort(scores)[::-1]
-                docs[:3] = [docs[i] for i in order]
-            except Exception:
-                pass  # Continue without reranking if it fails
+        # First-pass dense + BM25 on both stable/hot, then RRF merge.
+        # Every leg is (rows, scores) in ranked order, so fusion is a scatter-add.
+        # BM25 only touches the shards matching the city / occasion slots.
+        shards = route(self.store.shards, filters)
+        legs = [
+            self._dense_search(query, settings.ann_top_k, hot=False),
+            self._dense_search(query, settings.ann_top_k, hot=True),
+            self._bm25_search(query, settings.bm25_top_k, hot=False, shards=shards),
+            self._bm25_search(query, settings.bm25_top_k, hot=True, shards=shards),
+        ]
+        w = settings.fusion_weights
+        weights = [w.get("dense_stable", 1.0), w.get("dense_hot", 1.0), w.get("bm25_stable", 1.0), w.get("bm25_hot", 1.0)]
+        rows, scores = rrf_fuse(legs, k=settings.rrf_k, weights=weights)
+        # BM25 legs skip tombstoned rows already; dense indexes still hold them
+        live = table.live[rows]
+        rows, scores = rows[live], scores[live]
 
-        # Limit context to top-3 with salient snippets
-        for d in docs[:settings.context_top_n]:
-            try:
-                d["snippet"] = self._salient_text(d)
-            except Exception:
-                d["snippet"] = d["meta"].get("title", "")
+        # Apply metadata filters: intersect with the filter rows
+        if has_filters and len(rows):
+            keep = in_sorted(allowed, rows) if allowed is not None else table.filter_mask(rows, filters)
+            rows, scores = rows[keep], scores[keep]
+        return rows, scores
 
-        return docs[:settings.keep_top_n]
+    def materialize(self, query: str, rows: np.ndarray, scores: np.ndarray,
+                    k: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Pick exactly `k` (default `context_top_n`) vendor-diverse docs from `rank`'s output."""
+        table = self.store.table
+        k = settings.context_top_n if k is None else k
+        # Vendor collapse happens on the score arrays, so only the docs that
+        # will be shown are ever materialized
+        order = diversified_top_k(rows, scores, table.vendor_code, k,
+                                  mmr_lambda=settings.mmr_lambda, table=table)
+        docs = table.views(rows[order].tolist())
+        print(f"   Diversified top-{k}: {len(docs)} unique vendors from {len(rows)} candidates")
 
-    def _salient_text(self, doc):
-        try:
-            # title + first sentence of description (cheap salience)
-            title = doc["meta"]["title"]
-            body = doc["text"]
-            
-            # Get first sentence properly
-            sentences = body.split(".")
-            first = sentences[0].strip() if sentences else body
-            
-            return f"{title}: {first}"
-        except Exception as e:
-            return doc["meta"].get("title", "Error generating salient text")
+        # Cross-encoder reranking happens before this, on the scores (see rag.rerank).
+        # Snippets are precomputed in the doc table (see `DocView["snippet"]`)
+        return docs
 
-def _passes_filters(meta: Dict[str, Any], filters: Dict[str, Any]) -> bool:
-    city = filters.get("city")
-    if city and meta.get("city","").lower() != city.lower():
-        return False
-    headcount = filters.get("headcount")
-    if headcount and not (meta.get("headcount_min",0) <= headcount <= meta.get("headcount_max",10**9)):
-        return False
-    budget = filters.get("budget")
-    if budget and not (meta.get("price_min",0) <= budget <= meta.get("price_max",10**12)):
-        return False
-    occasion = filters.get("occasion")
-    if occasion and occasion.lower() not in [o.lower() for o in meta.get("occasion",[])]:
-        return False
-    return True
+def filter_candidates(store, rows: np.ndarray, scores: np.ndarray, filters: Dict[str, Any]) -> Leg:
+    """Narrow an already ranked candidate set to `filters` (no re-scoring)."""
+    if not (filters and any(filters.values())) or not len(rows):
+        return rows, scores
+    filter_index = getattr(store, "filter_index", None)
+    keep = filter_index.mask(rows, filters) if filter_index is not None else store.table.filter_mask(rows, filters)
+    return rows[keep], scores[keep]
@@ -0,0 +1,110 @@
+from typing import Dict, Any, List, Optional, Tuple
+import numpy as np
+
+from .bm25 import BM25Index, CorpusStats
+
+# (city, occasion); occasion is None unless sharding by occasion too
+ShardKey = Tuple[str, Optional[str]]
+
+class Shard:
+    """BM25 indexes (stable + hot tier) over the offers of one city / segment."""
+    def __init__(self, key: ShardKey, stable_rows: np.ndarray, hot_rows: np.ndarray,
+                 tokens: List[np.ndarray], vocab_size: int,
+                 stable_stats: CorpusStats, hot_stats: CorpusStats):
+        self.key = key
+        self.stable_rows = stable_rows
+        self.hot_rows = hot_rows
+        # Tier-wide stats keep shard scores on the same scale, so merging the
+        # per-shard top-k gives exactly the unsharded top-k.
+        self.bm25_stable = BM25Index([tokens[r] for r in stable_rows], vocab_size, stats=stable_stats) if len(stable_rows) else None
+        self.bm25_hot = BM25Index([tokens[r] for r in hot_rows], vocab_size, stats=hot_stats) if len(hot_rows) else None
+        # Stable docs promoted to hot since the stable index was built; they
+        # stay in its postings but are masked out of the stable leg
+        self.stable_dead: Optional[np.ndarray] = None
+
+    @classmethod
+    def from_indexes(cls, key: ShardKey, stable_rows: np.ndarray, hot_rows: np.ndarray,
+                     bm25_stable: Optional[BM25Index], bm25_hot: Optional[BM25Index],
+                     stable_dead: Optional[np.ndarray] = None) -> "Shard":
+        self = cls.__new__(cls)
+        self.key = key
+        self.stable_rows, self.hot_rows = stable_rows, hot_rows
+        self.bm25_stable, self.bm25_hot = bm25_stable, bm25_hot
+        self.stable_dead = stable_dead
+        return self
+
+    def retier(self, is_hot: np.ndarray, live: np.ndarray, tokens, vocab_size: int,
+               hot_stats: CorpusStats, stable_stats: Optional[CorpusStats] = None,
+               added: Optional[np.ndarray] = None) -> "Shard":
+        """Copy of this shard with the hot tier re-indexed from the `is_hot` / `live` columns.
+
+        `added` rows (appended to the table by streaming ingestion) join the
+        shard. With `stable_stats` the stable tier is rebuilt as well;
+        otherwise the stable index is shared with this shard and rows that
+        were promoted or tombstoned since it was built are masked.
+        A new object is returned so concurrent searches keep a consistent view.
+        """
+        rows = np.union1d(self.stable_rows, self.hot_rows)
+        if added is not None and len(added):
+            rows = np.union1d(rows, added)
+        rows = rows[live[rows]]
+        hot_rows = rows[is_hot[rows]]
+        bm25_hot = BM25Index([tokens[r] for r in hot_rows], vocab_size, stats=hot_stats) if len(hot_rows) else None
+        if stable_stats is not None:
+            stable_rows = rows[~is_hot[rows]]
+            bm25_stable = BM25Index([tokens[r] for r in stable_rows], vocab_size, stats=stable_stats) if len(stable_rows) else None
+        else:
+            stable_rows, bm25_stable = self.stable_rows, self.bm25_stable
+        dead = is_hot[stable_rows] | ~live[stable_rows]
+        return Shard.from_indexes(self.key, stable_rows, hot_rows, bm25_stable, bm25_hot,
+                                  stable_dead=dead if dead.any() else None)
+
+    def __len__(self):
+        return len(np.union1d(self.stable_rows, self.hot_rows))
+
+    def __repr__(self):
+        return f"Shard({self.key!r}, stable={len(self.stable_rows)}, hot={len(self.hot_rows)})"
+
+def group_rows(table, rows, by_occasion: bool = False) -> Dict[ShardKey, List[int]]:
+    """Shard key -> table rows belonging to it."""
+    groups: Dict[ShardKey, List[int]] = {}
+    for r in rows:
+        r = int(r)
+        city = (table.city(r) or "").lower()
+        if by_occasion:
+            # multi-occasion offers are indexed in every matching shard
+            for occ in table.occasion_names(r) or [""]:
+                groups.setdefault((city, occ.lower()), []).append(r)
+        else:
+            groups.setdefault((city, None), []).append(r)
+    return groups
+
+def empty_shard(key: ShardKey) -> Shard:
+    """Shard with no rows yet, e.g. for a city first seen by streaming ingestion."""
+    none = np.zeros(0, dtype=np.int64)
+    return Shard.from_indexes(key, none, none, None, None)
+
+def build_shards(table, tokens: List[np.ndarray], vocab_size: int,
+                 stable_stats: CorpusStats, hot_stats: CorpusStats,
+                 by_occasion: bool = False) -> Dict[ShardKey, Shard]:
+    groups = group_rows(table, range(table.n), by_occasion)
+    shards = {}
+    for key, rows in groups.items():
+        rows = np.array(rows, dtype=np.int64)
+        hot = table.is_hot[rows]
+        shards[key] = Shard(key, rows[~hot], rows[hot], tokens, vocab_size, stable_stats, hot_stats)
+    return shards
+
+def route(shards: Dict[ShardKey, Shard], filters: Optional[Dict[str, Any]]) -> List[Shard]:
+    """Shards that can hold matches for the city / occasion slots (all shards if unset)."""
+    filters = filters or {}
+    city = (filters.get("city") or "").lower()
+    occasion = (filters.get("occasion") or "").lower()
+    out = []
+    for (s_city, s_occ), shard in shards.items():
+        if city and s_city != city:
+            continue
+        if occasion and s_occ is not None and s_occ != occasion:
+            continue
+        out.append(shard)
+    return out
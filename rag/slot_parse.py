@@ -0,0 +1,121 @@
+"""Deterministic slot parsing: the city / occasion / headcount / budget / date
+phrases that can be read off a query without an LLM.
+
+`parse_slots` returns the slots it found plus the words left over once
+those phrases and refinement fillers ("make it", "instead", "only", ...)
+are removed. An empty remainder means the text was only about slots, for
+example "make it 40 people" or "under 20k in Abu Dhabi", so the search
+intent did not change. With `strict=True` only unambiguous phrases count:
+a headcount needs a people word ("25 guests", not "for 25"), and
+occasions, read off keyword lists, are skipped.
+"""
+import re
+from typing import Any, Dict, List, Tuple
+
+from .analyzer import STOPWORDS, normalize_text
+
+CITIES = ("Dubai", "Abu Dhabi")
+OCCASIONS = ("corporate", "party", "conference", "award", "intimate", "family", "wedding")
+
+OCCASION_WORDS = {
+    "corporate": ("corporate", "company", "team building", "team-building", "offsite", "off-site"),
+    "party": ("party", "birthday", "celebration", "bachelor", "bachelorette"),
+    "conference": ("conference", "summit", "seminar", "workshop", "meeting"),
+    "award": ("award", "awards", "gala", "ceremony"),
+    "intimate": ("intimate", "romantic", "proposal", "anniversary"),
+    "family": ("family", "kids", "children"),
+    "wedding": ("wedding", "engagement", "bridal"),
+}
+
+# words that only steer a refinement ("make it 40 people instead")
+REFINEMENT_WORDS = frozenset("""
+make change set switch instead actually only just now please rather than more less fewer
+people persons person guests guest attendees ppl pax headcount capacity
+budget aed dirhams under below max maximum upto over around within
+city occasion date day event ok okay also same but what how about
+""".split())
+
+_CITY = re.compile(r"\b(abu\s*dhabi|dubai)\b")
+# a standalone number: not part of a date, time or decimal ("2025-10-01", "18:00", "2.5")
+_NUM = r"(?<![\d\-/:\.])(\d{1,4})(?![\d\-/:]|\.\d)"
+# units after "for N" that make it a duration, time or amount rather than a group size
+# (a bare year, "for 2025", is skipped too)
+# ("for 12 aed 5000" is still 12 people: the amount follows the currency)
+_NOT_PEOPLE = r"(?!\s*(?:k\b|aed(?!\s*\d)|dirhams|,\d|hours?\b|hrs?\b|h\b|minutes?\b|mins?\b|days?\b|nights?\b|weeks?\b|am\b|pm\b))"
+_PEOPLE = r"(?:people|persons|person|guests|guest|pax|attendees|ppl|heads)"
+_HEADCOUNT_PEOPLE = re.compile(rf"\b{_NUM}\s*{_PEOPLE}\b")
+_HEADCOUNT = re.compile(rf"\b{_NUM}\s*{_PEOPLE}\b"
+                        rf"|\b(?:for|make it|group of|party of)\s+(?!(?:19|20)\d\d\b){_NUM}\b{_NOT_PEOPLE}")
+# an amount after a keyword wins over one before it: in "for 12 aed 5000" the
+# budget is 5000, so "12 aed" only counts when no keyword amount is present
+_BUDGET = re.compile(r"\b(?:aed|budget(?: of| is)?|under|below|max(?:imum)?|up to|upto|within)\s*(\d[\d,\.]*)\s*(k)?\b")
+_BUDGET_SUFFIX = re.compile(r"\b(\d[\d,\.]*)\s*(k)?\s*(?:aed|dirhams|budget)\b")
+_DATE = re.compile(r"\b(\d{4}-\d{2}-\d{2})\b|\b(\d{1,2})/(\d{1,2})/(\d{4})\b")
+_WORD = re.compile(r"[^\W_]+", re.UNICODE)
+
+def _amount(num: str, k: str) -> int:
+    value = float(num.replace(",", ""))
+    return int(value * 1000 if k else value)
+
+def parse_slots(text: str, strict: bool = False) -> Tuple[Dict[str, Any], List[str]]:
+    """(slots found in `text`, remaining content words).
+
+    >>> parse_slots("venue for 12 AED 5000")
+    ({'budget': 5000, 'headcount': 12}, ['venue'])
+    >>> parse_slots("venue for 12 AED 5000", strict=True)
+    ({'budget': 5000}, ['venue'])
+    >>> parse_slots("for 30 aed 20k in Dubai")
+    ({'budget': 20000, 'headcount': 30, 'city': 'Dubai'}, [])
+    >>> parse_slots("5000 aed for 12 people")
+    ({'budget': 5000, 'headcount': 12}, [])
+    """
+    t = normalize_text(text)
+    slots: Dict[str, Any] = {}
+    spans: List[Tuple[int, int]] = []
+
+    m = _DATE.search(t)
+    if m:
+        slots["date"] = m.group(1) or f"{m.group(4)}-{int(m.group(3)):02d}-{int(m.group(2)):02d}"
+        spans.append(m.span())
+    m = _BUDGET.search(t) or _BUDGET_SUFFIX.search(t)
+    if m:
+        slots["budget"] = _amount(m.group(1), m.group(2))
+        spans.append(m.span())
+    for m in (_HEADCOUNT_PEOPLE if strict else _HEADCOUNT).finditer(t):
+        if any(a <= m.start() < b for a, b in spans):
+            continue
+        slots["headcount"] = int(m.group(1) or m.group(2))
+        spans.append(m.span())
+        break
+    m = _CITY.search(t)
+    if m:
+        slots["city"] = "Dubai" if m.group(1) == "dubai" else "Abu Dhabi"
+        spans.append(m.span())
+    for occasion, words in () if strict else OCCASION_WORDS.items():
+        found = [m.span() for m in re.finditer(r"\b(" + "|".join(re.escape(w) for w in words) + r")\b", t)]
+        if found:
+            slots["occasion"] = occasion
+            spans += found
+            break
+
+    rest = t
+    for a, b in sorted(spans, reverse=True):
+        rest = rest[:a] + " " + rest[b:]
+    words = [w for w in _WORD.findall(rest)
+             if w not in STOPWORDS and w not in REFINEMENT_WORDS and not w.isdigit()]
+    return slots, words
+
+def apply_filter_overrides(slots: Dict[str, Any], applied_filters: Dict[str, Any]) -> Dict[str, Any]:
+    """Sidebar filters take precedence over slots read from the text."""
+    if applied_filters:
+        if applied_filters.get("city"):
+            slots["city"] = applied_filters["city"]
+        if applied_filters.get("occasion"):
+            slots["occasion"] = applied_filters["occasion"]
+        if applied_filters.get("headcount", 0) > 0:
+            slots["headcount"] = applied_filters["headcount"]
+        if applied_filters.get("budget", 0) > 0:
+            slots["budget"] = applied_filters["budget"]
+        if applied_filters.get("date"):
+            slots["date"] = applied_filters["date"]
+    return slots
@@ -1,17 +1,29 @@
-import os, json, sqlite3, time
-from typing import List, Dict, Any, Tuple
+import os, json, time, threading
+from typing import List, Dict, Any, Tuple, Optional, TYPE_CHECKING
 import numpy as np
-import pandas as pd
-import faiss
-from rank_bm25 import BM25Okapi
-
-# Try to import sentence_transformers, fallback to alternative if not available
-try:
-    from sentence_transformers import SentenceTransformer
-    SENTENCE_TRANSFORMERS_AVAILABLE = True
-except ImportError:
-    SENTENCE_TRANSFORMERS_AVAILABLE = False
-    print("⚠️  sentence-transformers not available, will use alternative embedding method")
+from .analyzer import Analyzer
+from .bm25 import corpus_stats
+from .shards import Shard, ShardKey, build_shards, empty_shard, group_rows
+from .ranges import FilterIndex
+from .typeahead import Typeahead
+from .config import settings
+from .doctable import DocTable
+from .db import (SQLitePool, OFFER_FIELDS, SQL_INSERT_OFFER, SQL_LOAD_CORPUS, SQL_LOAD_BY_IDS, SQL_SET_TIER,
+                 SQL_UPSERT_OFFER, SQL_DELETE_OFFER, SQL_FIND_OFFER, SQL_COUNT_OFFERS)
+from .utils import epoch_seconds
+from .query_log import query_log
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+def _load_embedder(name: str):
+    """SentenceTransformer (and torch) are only imported when dense search is enabled."""
+    try:
+        from sentence_transformers import SentenceTransformer
+    except ImportError:
+        print("⚠️  sentence-transformers not available, dense search disabled")
+        return None
+    return SentenceTransformer(name)
 
 DB_PATH = os.environ.get("SAHRA_DB", "sahra.db")
 
@@ -32,97 +44,236 @@ def row_to_doc(r):
 
 class DualIndexStore:
     def __init__(self, embed_model: str):
-        # SAFE MODE: Skip embedding model to prevent segfaults
-        # TODO: Re-enable embeddings when segfault issues are resolved
-        self.model = None  # Skip model loading to prevent segfaults
+        # SAFE MODE: embeddings stay off unless `settings.use_dense` is set
+        # (segfault issues); the model is then loaded on the first build
+        self.embed_model = embed_model or settings.embed_model
+        self.model = None
         
-        self.conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-        self.conn.execute("PRAGMA foreign_keys = ON")
-        self._init_db()
+        self.db = SQLitePool(DB_PATH)
+        self.db.init_schema()
 
         self.faiss_stable = None
         self.faiss_hot = None
-        self.bm25_stable = None
-        self.bm25_hot = None
-        self.stable_texts = []
-        self.hot_texts = []
-        self.stable_ids = []
-        self.hot_ids = []
-
-    def _init_db(self):
-        cur = self.conn.cursor()
-        cur.execute(
-            '''CREATE TABLE IF NOT EXISTS offers (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                vendor_id TEXT,
-                title TEXT,
-                city TEXT,
-                headcount_min INTEGER,
-                headcount_max INTEGER,
-                price_min REAL,
-                price_max REAL,
-                duration_hours REAL,
-                occasion TEXT,
-                tags TEXT,
-                updated_at TEXT,
-                description TEXT,
-                is_hot INTEGER DEFAULT 0
-            )'''
-        )
-        self.conn.commit()
+        self.shards: Dict[ShardKey, Shard] = {}
+        self.filter_index: Optional[FilterIndex] = None
+        self.table: Optional[DocTable] = None
+        self.stable_rows = np.zeros(0, dtype=np.int64)  # index-local doc i -> table row
+        self.hot_rows = np.zeros(0, dtype=np.int64)
+        self.analyzer: Optional[Analyzer] = None
+        self.typeahead: Optional[Typeahead] = None
+        # Bumped whenever the in-memory indexes change (build, tier move), so
+        # copies such as the retrieval pool's shared block know to refresh
+        self.generation = 0
+        self._index_lock = threading.RLock()
 
     def clear(self):
-        self.conn.execute("DELETE FROM offers")
-        self.conn.commit()
-
-    def add_offers_from_df(self, df: pd.DataFrame, mark_hot=False):
-        cols = ["vendor_id","title","city","headcount_min","headcount_max","price_min","price_max",
-                "duration_hours","occasion","tags","updated_at","description"]
-        for _, row in df.iterrows():
-            values = [row.get(c) for c in cols]
-            self.conn.execute(
-                "INSERT INTO offers (vendor_id,title,city,headcount_min,headcount_max,price_min,price_max,duration_hours,occasion,tags,updated_at,description,is_hot) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)",
-                [*values, 1 if mark_hot else 0]
-            )
-        self.conn.commit()
+        with self.db.write() as conn:
+            conn.execute("DELETE FROM offers")
+
+    def count(self) -> int:
+        return self.db.reader().execute(SQL_COUNT_OFFERS).fetchone()[0]
+
+    def add_offers_from_df(self, df: "pd.DataFrame", mark_hot=False):
+        hot = 1 if mark_hot else 0
+        rows = [[_sql_value(row.get(c)) for c in OFFER_FIELDS] + [hot, epoch_seconds(row.get("updated_at"))]
+                for _, row in df.iterrows()]
+        # One transaction for the whole batch instead of a commit per row
+        with self.db.write() as conn:
+            conn.executemany(SQL_INSERT_OFFER, rows)
 
     def load_corpus(self) -> Tuple[List[Dict[str,Any]], List[Dict[str,Any]]]:
-        cur = self.conn.cursor()
-        cur.execute("SELECT id,vendor_id,title,city,headcount_min,headcount_max,price_min,price_max,duration_hours,occasion,tags,updated_at,description FROM offers WHERE is_hot=0")
-        stable_rows = cur.fetchall()
-        cur.execute("SELECT id,vendor_id,title,city,headcount_min,headcount_max,price_min,price_max,duration_hours,occasion,tags,updated_at,description FROM offers WHERE is_hot=1")
-        hot_rows = cur.fetchall()
-
-        stable_docs = [row_to_doc(r) for r in stable_rows]
-        hot_docs = [row_to_doc(r) for r in hot_rows]
+        # Single pass over the table; rows arrive ordered by tier
+        stable_docs, hot_docs = [], []
+        for r in self.db.reader().execute(SQL_LOAD_CORPUS):
+            (hot_docs if r[-1] else stable_docs).append(row_to_doc(r[:-2]))
         return stable_docs, hot_docs
 
     def build_indexes(self):
-        stable_docs, hot_docs = self.load_corpus()
-        
-        # SAFE MODE: Skip FAISS, use BM25 only
-        # TODO: Re-enable FAISS when segfault issues are resolved
-        
-        if stable_docs:
-            self.stable_texts = [d["text"] for d in stable_docs]
-            self.stable_ids = [d["id"] for d in stable_docs]
-            self.faiss_stable = None  # Skip FAISS to prevent segfaults
-            
-        if hot_docs:
-            self.hot_texts = [d["text"] for d in hot_docs]
-            self.hot_ids = [d["id"] for d in hot_docs]
-            self.faiss_hot = None
-
-        # BM25 indexes - always build these
-        from rank_bm25 import BM25Okapi
-        if self.stable_texts:
-            self.bm25_stable = BM25Okapi([t.split() for t in self.stable_texts])
-        if self.hot_texts:
-            self.bm25_hot = BM25Okapi([t.split() for t in self.hot_texts])
-
-    def get_docs_by_ids(self, ids: List[int]) -> List[Dict[str,Any]]:
-        q = "SELECT id,vendor_id,title,city,headcount_min,headcount_max,price_min,price_max,duration_hours,occasion,tags,updated_at,description FROM offers WHERE id IN ({})".format(",".join(["?"]*len(ids)))
-        cur = self.conn.cursor()
-        cur.execute(q, ids)
-        rows = cur.fetchall()
-        return [row_to_doc(r) for r in rows]
+        with self._index_lock:
+            # Parse every row once into the columnar doc table; search results are
+            # served from it, so SQLite is only touched again on the next build.
+            table = DocTable(self.db.reader().execute(SQL_LOAD_CORPUS).fetchall())
+            stable_rows = np.flatnonzero(~table.is_hot)
+            hot_rows = np.flatnonzero(table.is_hot)
+
+            # SAFE MODE: BM25 only unless `settings.use_dense` (faiss / torch are
+            # not even imported otherwise)
+            faiss_stable = faiss_hot = None
+            if settings.use_dense:
+                faiss_stable, faiss_hot = self._build_dense(table, stable_rows, hot_rows)
+
+            # BM25 indexes - always build these. One analyzer (and vocabulary) is
+            # fitted over the whole corpus and reused for queries by the retriever;
+            # texts are generated from the table columns and dropped once tokenized.
+            analyzer = Analyzer()
+            tokens = analyzer.fit(table.iter_text(range(table.n)))
+            vocab_size = len(analyzer.vocab)
+
+            # Partition into per-city (optionally per-occasion) shards so filtered
+            # queries only score the slice of the catalog they can match.
+            shards = build_shards(
+                table, tokens, vocab_size,
+                stable_stats=corpus_stats([tokens[r] for r in stable_rows], vocab_size),
+                hot_stats=corpus_stats([tokens[r] for r in hot_rows], vocab_size),
+                by_occasion=settings.shard_by_occasion,
+            )
+            # Range / inverted indexes over the filter columns (city, occasion,
+            # headcount, budget) -> candidate row sets without per-doc checks
+            filter_index = FilterIndex(table)
+            # Prefix arrays over venue names / tags / occasions / cities for typeahead
+            typeahead = Typeahead(table, query_log)
+
+            # Swap everything in together, after the (slow) build
+            self.table, self.analyzer, self.shards, self.filter_index = table, analyzer, shards, filter_index
+            self.typeahead = typeahead
+            self.stable_rows, self.hot_rows = stable_rows, hot_rows
+            self.faiss_stable, self.faiss_hot = faiss_stable, faiss_hot
+            self.generation += 1
+
+    def _build_dense(self, table: DocTable, stable_rows: np.ndarray, hot_rows: np.ndarray):
+        try:
+            import faiss
+        except ImportError:
+            print("⚠️  faiss not available, dense search disabled")
+            return None, None
+        if self.model is None:
+            self.model = _load_embedder(self.embed_model)
+        if self.model is None:
+            return None, None
+
+        def index(rows):
+            if not len(rows):
+                return None
+            vecs = self.model.encode(list(table.iter_text(rows)), convert_to_numpy=True, normalize_embeddings=True)
+            idx = faiss.IndexFlatIP(vecs.shape[1])
+            idx.add(np.ascontiguousarray(vecs, dtype=np.float32))
+            return idx
+        return index(stable_rows), index(hot_rows)
+
+    def _encode_rows(self, table: DocTable, rows) -> Dict[int, np.ndarray]:
+        """Term ids of table rows (every row's terms are in the vocabulary by now)."""
+        return {int(r): self.analyzer.encode(table.text_of(int(r))) for r in rows}
+
+    def _reindex(self, table: DocTable, rebuild_stable: bool = False,
+                 added: Optional[np.ndarray] = None, tokens: Optional[Dict[int, np.ndarray]] = None):
+        """New shards for `table`: hot tier re-indexed, stable tier only if asked.
+
+        `added` rows are assigned to their (possibly new) shards; `tokens` may
+        carry term ids already computed for some rows. Returns (hot rows, shards).
+        """
+        vocab_size = len(self.analyzer.vocab)
+        hot_rows = np.flatnonzero(table.is_hot & table.live)
+        stable_rows = np.flatnonzero(~table.is_hot & table.live) if rebuild_stable else np.zeros(0, dtype=np.int64)
+        tokens = dict(tokens or {})
+        tokens.update(self._encode_rows(table, (r for r in np.concatenate([hot_rows, stable_rows]) if int(r) not in tokens)))
+        hot_stats = corpus_stats([tokens[r] for r in hot_rows], vocab_size)
+        stable_stats = corpus_stats([tokens[r] for r in stable_rows], vocab_size) if rebuild_stable else None
+
+        shards = dict(self.shards)
+        groups = group_rows(table, added, settings.shard_by_occasion) if added is not None else {}
+        for key in groups:
+            if key not in shards:
+                shards[key] = empty_shard(key)
+        shards = {key: shard.retier(table.is_hot, table.live, tokens, vocab_size, hot_stats, stable_stats,
+                                    added=np.array(groups.get(key, []), dtype=np.int64))
+                  for key, shard in shards.items()}
+        return hot_rows, shards
+
+    def set_tier(self, rows: np.ndarray, hot: bool):
+        """Move table rows into the hot or stable tier, in SQLite and in the indexes.
+
+        Only the hot tier is re-indexed, unless demoted rows are missing from
+        the stable index (they were hot at build time); then the stable tier
+        is rebuilt too, so callers should demote in batches.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        if not len(rows) or self.table is None:
+            return
+        with self._index_lock:
+            with self.db.write() as conn:
+                conn.execute(SQL_SET_TIER, (int(hot), json.dumps(self.table.ids[rows].tolist())))
+            # copy-on-write like apply_batch: searches in flight keep the old flags
+            table = self.table.with_tier(rows, hot)
+            rebuild_stable = False
+            if not hot:
+                indexed = np.concatenate([s.stable_rows for s in self.shards.values()] or [np.zeros(0, dtype=np.int64)])
+                rebuild_stable = not np.isin(rows, indexed).all()
+            # Swap in the new table with a new dict of new shards; searches in flight keep the old ones
+            hot_rows, shards = self._reindex(table, rebuild_stable)
+            self.table, self.shards = table, shards
+            self.generation += 1
+        print(f"🔁 Tiering: moved {len(rows)} offers to {'hot' if hot else 'stable'}"
+              f"{' (stable tier rebuilt)' if rebuild_stable else ''}; hot tier now {len(hot_rows)} offers")
+
+    def apply_batch(self, upserts: List[Dict[str, Any]], deletes: List[Dict[str, Any]]) -> Dict[str, int]:
+        """Apply one micro-batch of offer upserts / deletes to SQLite and the in-memory indexes.
+
+        Offers are dicts with the CSV columns; they are matched on `id` if
+        given, else on (vendor_id, title). SQLite gets a single transaction.
+        In memory the table is extended copy-on-write: new versions are
+        appended (hot if updated within `hot_window_days`), replaced and
+        deleted rows are tombstoned, and only the hot BM25 tier is rebuilt. The
+        filter index takes the appended rows as a delta and typeahead
+        re-indexes lazily. New terms extend the vocabulary.
+        """
+        now = time.time()
+        with self._index_lock:
+            changed, deleted = [], []
+            with self.db.write() as conn:
+                for offer in deletes:
+                    oid = self._resolve_id(conn, offer)
+                    if oid is not None:
+                        conn.execute(SQL_DELETE_OFFER, (oid,))
+                        deleted.append(oid)
+                for offer in upserts:
+                    values = _offer_values(offer, now)
+                    oid = self._resolve_id(conn, offer)
+                    cur = conn.execute(SQL_UPSERT_OFFER, [oid, *values])
+                    changed.append(oid if oid is not None else cur.lastrowid)
+            if self.table is None:
+                self.build_indexes()
+                return {"upserted": len(changed), "deleted": len(deleted)}
+
+            table = self.table
+            new_rows = self.db.reader().execute(SQL_LOAD_BY_IDS, (json.dumps(changed),)).fetchall()
+            dead = table.rows_for_ids(changed + deleted)
+            new_table = table.extend(new_rows, dead=dead)
+            added = np.arange(table.n, new_table.n, dtype=np.int64)
+            tokens = dict(zip(added.tolist(), self.analyzer.extend(new_table.iter_text(added))))
+            hot_rows, shards = self._reindex(new_table, added=added, tokens=tokens)
+            # appended rows go to the filter index's delta; typeahead re-indexes on its own schedule
+            filter_index = self.filter_index.extend(new_table, added, settings.ingest_filter_delta_max)
+            self.typeahead.update_table(new_table)
+            self.table, self.shards, self.filter_index = new_table, shards, filter_index
+            self.generation += 1
+        return {"upserted": len(changed), "deleted": len(deleted), "hot": len(hot_rows),
+                "tombstoned": int(new_table.n - new_table.live.sum())}
+
+    @staticmethod
+    def _resolve_id(conn, offer: Dict[str, Any]) -> Optional[int]:
+        if offer.get("id") is not None:
+            return int(offer["id"])
+        row = conn.execute(SQL_FIND_OFFER, (offer.get("vendor_id"), offer.get("title"))).fetchone()
+        return row[0] if row else None
+
+def _offer_values(offer: Dict[str, Any], now: float) -> list:
+    """Webhook offer dict -> SQL_UPSERT_OFFER values (after the id)."""
+    offer = dict(offer)
+    for k in ("occasion", "tags"):
+        if isinstance(offer.get(k), (list, tuple)):
+            offer[k] = ",".join(offer[k])
+    if not offer.get("updated_at"):
+        offer["updated_at"] = time.strftime("%Y-%m-%d", time.gmtime(now))
+    updated_ts = epoch_seconds(offer["updated_at"])
+    hot = int(updated_ts is None or updated_ts >= now - settings.hot_window_days * 86400)
+    return [_sql_value(offer.get(c)) for c in OFFER_FIELDS] + [hot, updated_ts]
+
+def _sql_value(v):
+    """pandas NaN / numpy scalars -> plain Python values sqlite3 can bind"""
+    if v is None:
+        return None
+    if isinstance(v, float) and v != v:
+        return None
+    if hasattr(v, "item"):
+        return v.item()
+    return v
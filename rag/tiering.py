@@ -0,0 +1,87 @@
+"""Freshness-based hot/stable tiering.
+
+Offers updated within `hot_window_days` belong in the small hot index, the
+rest in the stable one. `TieringScheduler` periodically compares the
+`updated_ts` column against that window and moves rows with
+`DualIndexStore.set_tier`:
+
+- promotions are applied every cycle; they only re-index the hot tier, and
+  the stable copy of a promoted row is masked until the next stable build;
+- demotions are held back until `tiering_demote_batch` rows are pending or
+  the oldest has waited `tiering_demote_max_wait_s`, because a demotion may
+  need the (large) stable tier rebuilt.
+"""
+import threading, time
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from .config import settings
+
+class TieringScheduler:
+    def __init__(self, store, hot_window_days: Optional[int] = None, interval_s: Optional[float] = None,
+                 demote_batch: Optional[int] = None, demote_max_wait_s: Optional[float] = None):
+        self.store = store
+        self.hot_window_days = settings.hot_window_days if hot_window_days is None else hot_window_days
+        self.interval_s = settings.tiering_interval_s if interval_s is None else interval_s
+        self.demote_batch = settings.tiering_demote_batch if demote_batch is None else demote_batch
+        self.demote_max_wait_s = settings.tiering_demote_max_wait_s if demote_max_wait_s is None else demote_max_wait_s
+        self._demote_pending_since: Optional[float] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def plan(self, now: Optional[float] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """(rows to promote, rows to demote) for the current table."""
+        table = self.store.table
+        if table is None:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty
+        cutoff = (time.time() if now is None else now) - self.hot_window_days * 86400
+        # unknown update times (-1) count as old
+        recent = table.updated_ts >= cutoff
+        live = table.live
+        return np.flatnonzero(recent & ~table.is_hot & live), np.flatnonzero(~recent & table.is_hot & live)
+
+    def run_once(self, now: Optional[float] = None, force: bool = False) -> Dict[str, int]:
+        """One tiering cycle; `force` applies pending demotions regardless of batch size."""
+        now = time.time() if now is None else now
+        promote, demote = self.plan(now)
+        if len(promote):
+            self.store.set_tier(promote, hot=True)
+
+        demoted = 0
+        if len(demote):
+            if self._demote_pending_since is None:
+                self._demote_pending_since = now
+            waited = now - self._demote_pending_since
+            if force or len(demote) >= self.demote_batch or waited >= self.demote_max_wait_s:
+                self.store.set_tier(demote, hot=False)
+                self._demote_pending_since = None
+                demoted = len(demote)
+        else:
+            self._demote_pending_since = None
+        return {"promoted": len(promote), "demoted": demoted, "demote_pending": len(demote) - demoted}
+
+    # ---- background loop -----------------------------------------------
+    def _loop(self):
+        while not self._stop.wait(self.interval_s):
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"⚠️  Tiering cycle failed: {type(e).__name__}: {e}")
+
+    def start(self) -> "TieringScheduler":
+        if self._thread is not None:
+            return self
+        # settle the tiers once up front (e.g. right after an ingest)
+        print(f"🔁 Tiering: {self.run_once(force=True)}")
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="sahra-tiering", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
@@ -0,0 +1,155 @@
+"""Typeahead suggestions from sorted prefix arrays.
+
+Every suggestion (venue name, tag, occasion, city, or a popular logged
+query) is indexed under its normalized text and under each later word
+start, so "yac" and "sun" both reach "sunset yacht". The keys are one
+sorted list. A prefix lookup is two `bisect` calls, and the best few
+entries in that range are picked with numpy. One- and two-character
+prefixes, whose ranges are the widest, have their top lists
+precomputed. Catalog entries are ranked by live offer count and logged
+queries by popularity. `DualIndexStore` builds the catalog part with its
+indexes and hands each ingest batch's table to `update_table`. The
+catalog is then re-indexed at most every `typeahead_refresh_s`, on the
+next lookup, rather than once per batch. The query part is refreshed
+from the query log on the same schedule. Lookups never touch SQLite or
+an LLM.
+"""
+import threading, time
+from bisect import bisect_left
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .analyzer import normalize_text
+from .config import settings
+
+_END = "\U0010ffff"
+SLOT_KINDS = ("city", "occasion")
+
+def _norm(text: str) -> str:
+    return " ".join(normalize_text(text).split())
+
+def venue_name(title: str) -> str:
+    """'Sunset Yacht • 3h • up to 30 pax' -> 'Sunset Yacht'"""
+    return title.split("•")[0].strip()
+
+class PrefixIndex:
+    """Sorted (key, entry) arrays over weighted suggestions."""
+    def __init__(self, entries: List[Tuple[str, str, float]], short_prefix_len: int = 2, short_top: int = 16):
+        # entries: (display text, kind, weight); duplicates keep the highest weight
+        best: Dict[str, Tuple[str, str, float]] = {}
+        for text, kind, weight in entries:
+            norm = _norm(text)
+            if norm and (norm not in best or weight > best[norm][2]):
+                best[norm] = (text, kind, weight)
+        self.texts = [e[0] for e in best.values()]
+        self.kinds = [e[1] for e in best.values()]
+        self.weights = np.array([e[2] for e in best.values()], dtype=np.float64)
+
+        pairs = []
+        for i, norm in enumerate(best):
+            pairs.append((norm, i))
+            pairs += [(norm[j + 1:], i) for j, ch in enumerate(norm) if ch == " "]
+        pairs.sort()
+        self.keys = [k for k, _ in pairs]
+        self.key_entry = np.array([i for _, i in pairs], dtype=np.int32)
+
+        self.short_top = short_top
+        self.short: Dict[str, np.ndarray] = {}
+        for plen in range(1, short_prefix_len + 1):
+            for p in sorted({k[:plen] for k in self.keys if len(k) >= plen}):
+                self.short[p] = self._range_top(p, short_top)
+
+    def _range_top(self, prefix: str, k: int) -> np.ndarray:
+        lo = bisect_left(self.keys, prefix)
+        hi = bisect_left(self.keys, prefix + _END, lo)
+        ids = np.unique(self.key_entry[lo:hi])
+        if len(ids) > k:
+            ids = ids[np.argpartition(-self.weights[ids], k - 1)[:k]]
+        return ids[np.argsort(-self.weights[ids], kind="stable")]
+
+    def lookup(self, prefix: str, k: int) -> List[Tuple[str, str, float]]:
+        top = self.short.get(prefix) if k <= self.short_top else None
+        if top is None:
+            top = self._range_top(prefix, k)
+        return [(self.texts[i], self.kinds[i], float(self.weights[i])) for i in top[:k]]
+
+    def __len__(self):
+        return len(self.texts)
+
+def catalog_entries(table) -> List[Tuple[str, str, float]]:
+    """(text, kind, live offer count) for venue names, tags, occasions and cities."""
+    rows = np.flatnonzero(table.live)
+    entries = [(name, "venue", float(n)) for name, n in Counter(venue_name(table.title[r]) for r in rows).items()]
+    for kind, names, codes in (("tag", table.tags.strings, table.tag_values[_csr_rows(table.tag_offsets, rows)]),
+                               ("occasion", table.occasions.strings, table.occ_values[_csr_rows(table.occ_offsets, rows)]),
+                               ("city", table.cities.strings, table.city_code[rows])):
+        counts = np.bincount(codes, minlength=len(names))
+        entries += [(names[c], kind, float(counts[c])) for c in np.flatnonzero(counts) if names[c]]
+    return entries
+
+def _csr_rows(offsets: np.ndarray, rows: np.ndarray) -> np.ndarray:
+    """Positions in the CSR values array belonging to `rows`."""
+    starts, ends = offsets[rows], offsets[rows + 1]
+    if not len(rows):
+        return np.zeros(0, dtype=np.int64)
+    lengths = ends - starts
+    return np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+
+class Typeahead:
+    def __init__(self, table, log=None):
+        self.table = table
+        self.catalog = PrefixIndex(catalog_entries(table))
+        self._catalog_table, self._catalog_built = table, time.time()
+        self.log = log
+        self.queries: Optional[PrefixIndex] = None
+        self._queries_built = 0.0
+        self._lock = threading.Lock()
+
+    def update_table(self, table):
+        """The catalog changed (ingest batch); it is re-indexed lazily, see `_catalog_index`."""
+        self.table = table
+
+    def _catalog_index(self) -> PrefixIndex:
+        if self._catalog_table is not self.table and time.time() - self._catalog_built >= settings.typeahead_refresh_s:
+            with self._lock:
+                table = self.table
+                if self._catalog_table is not table:
+                    self.catalog = PrefixIndex(catalog_entries(table))
+                    self._catalog_table, self._catalog_built = table, time.time()
+        return self.catalog
+
+    def _query_index(self) -> Optional[PrefixIndex]:
+        if self.log is None:
+            return None
+        if time.time() - self._queries_built >= settings.typeahead_refresh_s:
+            with self._lock:
+                if time.time() - self._queries_built >= settings.typeahead_refresh_s:
+                    top = self.log.top(settings.typeahead_popular_n, settings.warm_min_count)
+                    self.queries = PrefixIndex([(e["query"], "query", e["popularity"]) for e in top])
+                    self._queries_built = time.time()
+        return self.queries
+
+    def suggest(self, prefix: str, k: Optional[int] = None) -> List[Dict[str, str]]:
+        """Up to k suggestions for what has been typed so far: popular queries first, then the catalog."""
+        k = settings.typeahead_k if k is None else k
+        p = _norm(prefix)
+        if not p:
+            return []
+        queries = self._query_index()
+        out = queries.lookup(p, k) if queries is not None else []
+        catalog = self._catalog_index()
+        out += catalog.lookup(p, k)
+        if len(out) < k and " " in p:
+            # complete a trailing city / occasion in context ("yacht party in du" ->
+            # "... in dubai"), which the deterministic slot parser then picks up
+            head, last = p.rsplit(" ", 1)
+            out += [(f"{head} {text.lower()}", kind, w) for text, kind, w in catalog.lookup(last, 4 * k)
+                    if kind in SLOT_KINDS]
+        seen, result = set(), []
+        for text, kind, _ in out:
+            if _norm(text) not in seen:
+                seen.add(_norm(text))
+                result.append({"text": text, "kind": kind})
+        return result[:k]
@@ -1,20 +1,12 @@
-import re, json, os, hashlib, time, asyncio
-from typing import Dict, Any, List
+import re, json, os, hashlib, time, asyncio, calendar, threading, datetime as dt
+from typing import Any, Optional
+from concurrent.futures import Future, InvalidStateError
 
 def normalize_query(q: str) -> str:
     q = q.strip().lower()
     q = re.sub(r"\s+", " ", q)
     return q
 
-def rrf(scores_lists: List[Dict[int, float]], k: int = 60) -> Dict[int, float]:
-    merged = {}
-    for scores in scores_lists:
-        # scores: doc_id -> rank (or score); convert to reciprocal of rank
-        ranked = sorted(scores.items(), key=lambda x: x[1], reverse=True)
-        for rank, (doc_id, _) in enumerate(ranked, start=1):
-            merged[doc_id] = merged.get(doc_id, 0.0) + 1.0 / (k + rank)
-    return merged
-
 def lf_bucket(x: float, step: int = 1000) -> str:
     try:
         i = int(x) // step
@@ -22,6 +14,27 @@ def lf_bucket(x: float, step: int = 1000) -> str:
     except:
         return "na"
 
+def epoch_seconds(value) -> Optional[int]:
+    """'YYYY-MM-DD' (or full ISO timestamp) -> epoch seconds; naive times are UTC."""
+    if value is None or value != value:  # None / NaN
+        return None
+    try:
+        t = dt.datetime.fromisoformat(str(value).strip())
+    except ValueError:
+        return None
+    if t.tzinfo is not None:
+        return int(t.timestamp())
+    return calendar.timegm(t.timetuple())
+
+def stale_cutoff(days: int, today: Optional[dt.date] = None) -> int:
+    """Epoch seconds before which an offer counts as stale.
+
+    Same rule as the old per-doc check, `(today - updated).days > days`,
+    i.e. updated strictly before midnight `days` days ago.
+    """
+    today = today or dt.date.today()
+    return calendar.timegm((today - dt.timedelta(days=days)).timetuple())
+
 def hash_key(s: str) -> str:
     return hashlib.sha256(s.encode()).hexdigest()
 
@@ -30,22 +43,55 @@ class TTLCache:
         self.ttl = ttl_seconds
         self.max_items = max_items
         self.store = {}
+        # the warmer thread writes concurrently with request threads
+        self._lock = threading.Lock()
 
     def get(self, key: str):
         now = time.time()
-        item = self.store.get(key)
-        if not item: return None
-        val, ts = item
-        if now - ts > self.ttl:
-            del self.store[key]
+        with self._lock:
+            item = self.store.get(key)
+            if not item: return None
+            val, ts = item
+            if now - ts > self.ttl:
+                del self.store[key]
+                return None
+            return val
+
+    def remaining(self, key: str) -> Optional[float]:
+        """Seconds until `key` expires (None if absent or already expired)."""
+        with self._lock:
+            item = self.store.get(key)
+        if not item:
             return None
-        return val
+        left = self.ttl - (time.time() - item[1])
+        return left if left >= 0 else None
 
     def set(self, key: str, val):
-        if len(self.store) >= self.max_items:
-            # pop arbitrary (demo)
-            self.store.pop(next(iter(self.store)))
-        self.store[key] = (val, time.time())
+        with self._lock:
+            if key not in self.store and len(self.store) >= self.max_items:
+                # pop arbitrary (demo)
+                self.store.pop(next(iter(self.store)))
+            self.store[key] = (val, time.time())
+
+def resolve_future(fut: Future, result=None, exc: Optional[BaseException] = None):
+    """Complete a request future unless its waiter already gave up (a timeout cancels it)."""
+    try:
+        if exc is not None:
+            fut.set_exception(exc)
+        else:
+            fut.set_result(result)
+    except InvalidStateError:
+        pass
 
 async def with_timeout(coro, timeout_s: float):
     return await asyncio.wait_for(coro, timeout=timeout_s)
+
+def deadline_after(seconds: float) -> float:
+    """Absolute deadline on the monotonic clock."""
+    return time.monotonic() + seconds
+
+def time_left(deadline: Optional[float]) -> float:
+    """Seconds until `deadline` (inf when there is none, never negative)."""
+    if deadline is None:
+        return float("inf")
+    return max(0.0, deadline - time.monotonic())
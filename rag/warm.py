@@ -0,0 +1,103 @@
+"""Warm paths: keep the answers to popular and seasonal queries cached.
+
+`Warmer` periodically re-runs the top-N queries of the query log
+(`rag.query_log`) plus `settings.warm_seasonal_queries` through the
+pipeline with `refresh=True`.
+That rewrites the slot, retrieval and completion caches before they
+expire, so those queries are answered without an LLM call.
+"""
+import asyncio, threading, time
+from typing import Any, Dict, List, Optional
+
+from .config import settings
+from .cache import qr_cache, completion_cache, slot_cache_key, compose_cache_key
+from .graph import SINGLE_CALL
+from .query_log import QueryLog, filters_key, query_log
+from .slot_parse import apply_filter_overrides
+from .utils import normalize_query
+
+class Warmer:
+    """Background thread re-running popular queries before their cache entries expire."""
+    def __init__(self, graph, retriever, log: Optional[QueryLog] = None):
+        self.graph = graph
+        self.retriever = retriever
+        self.log = log or query_log
+        # availability each warm run composed with; answers for a date are keyed on it
+        self._availability: Dict[tuple, Optional[Dict[int, str]]] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def targets(self) -> List[Dict[str, Any]]:
+        """Seasonal queries first, then the top-N logged ones (deduplicated)."""
+        out, seen = [], set()
+        seasonal = [{"query": normalize_query(q), "filters": {}} for q in settings.warm_seasonal_queries]
+        for t in seasonal + self.log.top(settings.warm_top_n, settings.warm_min_count):
+            key = (t["query"], filters_key(t["filters"]))
+            if key not in seen:
+                seen.add(key)
+                out.append(t)
+        return out
+
+    def is_warm(self, query: str, filters: Dict[str, Any]) -> bool:
+        """Slots and answer both cached for longer than the refresh margin."""
+        margin = settings.warm_refresh_margin_s
+        sk = slot_cache_key(query, filters)
+        left = qr_cache.remaining(sk)
+        if left is None or left < margin:
+            return False
+        availability = self._availability.get((query, filters_key(filters)))
+        slots = apply_filter_overrides(dict(qr_cache.get(sk) or {}), filters)
+        ck = compose_cache_key(query, slots, availability, select=settings.pipeline_mode == SINGLE_CALL)
+        left = completion_cache.remaining(ck)
+        return left is not None and left >= margin
+
+    async def warm(self, query: str, filters: Dict[str, Any]):
+        result = await self.graph.ainvoke({
+            "query": query, "retriever": self.retriever, "slots": None, "docs": None,
+            "validation": None, "answer": None, "applied_filters": dict(filters), "refresh": True,
+        })
+        self._availability[(query, filters_key(filters))] = result.get("availability")
+
+    async def run_once(self) -> int:
+        """Refresh every target that is cold or about to expire; returns how many ran."""
+        ran = 0
+        targets = self.targets()
+        keys = {(t["query"], filters_key(t["filters"])) for t in targets}
+        self._availability = {k: v for k, v in self._availability.items() if k in keys}
+        for t in targets:
+            if self._stop.is_set():
+                break
+            if self.is_warm(t["query"], t["filters"]):
+                continue
+            try:
+                await self.warm(t["query"], t["filters"])
+                ran += 1
+            except Exception as e:
+                print(f"⚠️  Warming '{t['query']}' failed: {type(e).__name__}: {e}")
+        return ran
+
+    def _loop(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            while True:
+                ran = loop.run_until_complete(self.run_once())
+                if ran:
+                    print(f"🔥 Warmer refreshed {ran} queries")
+                if self._stop.wait(settings.warm_interval_s):
+                    break
+        finally:
+            loop.close()
+
+    def start(self) -> "Warmer":
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name="sahra-warmer", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
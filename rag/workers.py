@@ -0,0 +1,363 @@
+"""Multi-process retrieval over index arrays in shared memory.
+
+`HybridRetriever.rank` (BM25 scoring, fusion, filtering) holds the GIL, so a
+single process cannot use more than one core for retrieval. `RetrievalPool`
+packs the posting lists and filter columns into one
+`multiprocessing.shared_memory` block that N worker processes map without
+copying, sends them `(query, filters)` over a queue and materializes the
+returned `(rows, scores)` in the parent. It exposes the same `search`
+contract as `HybridRetriever`, plus `asearch` for the async graph.
+"""
+import asyncio, itertools, os, threading, time
+import multiprocessing as mp
+from concurrent.futures import Future
+from multiprocessing import shared_memory
+from types import SimpleNamespace
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+
+from .config import settings
+from .analyzer import Analyzer
+from .bm25 import BM25Index
+from .doctable import DocTable
+from .fusion import Leg
+from .ranges import FilterIndex
+from .retriever import HybridRetriever
+from .shards import Shard
+from .utils import resolve_future, time_left
+
+_ALIGN = 64
+
+# (dtype, shape, byte offset) of every array in the shared block
+Manifest = Dict[str, Tuple[str, Tuple[int, ...], int]]
+
+def _pack(arrays: Dict[str, np.ndarray]) -> Tuple[shared_memory.SharedMemory, Manifest]:
+    manifest: Manifest = {}
+    offset = 0
+    for name, arr in arrays.items():
+        manifest[name] = (arr.dtype.str, arr.shape, offset)
+        offset += -(-arr.nbytes // _ALIGN) * _ALIGN
+    shm = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+    for name, arr in arrays.items():
+        dtype, shape, off = manifest[name]
+        np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=off)[...] = arr
+    return shm, manifest
+
+def _attach(shm: shared_memory.SharedMemory, manifest: Manifest) -> Dict[str, np.ndarray]:
+    out = {}
+    for name, (dtype, shape, off) in manifest.items():
+        arr = np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=off)
+        arr.setflags(write=False)
+        out[name] = arr
+    return out
+
+def export_index(store) -> Tuple[shared_memory.SharedMemory, Manifest, Dict[str, Any]]:
+    """Copy the store's retrieval arrays into a new shared-memory block.
+
+    Returns the block, its manifest and the small picklable metadata
+    (analyzer, interners, shard layout, settings) a worker needs on top.
+    """
+    table = store.table
+    arrays: Dict[str, np.ndarray] = {f"table.{c}": getattr(table, c) for c in DocTable.FILTER_COLUMNS}
+    arrays["store.stable_rows"] = store.stable_rows
+    arrays["store.hot_rows"] = store.hot_rows
+    for name, arr in store.filter_index.arrays().items():
+        arrays[f"filter.{name}"] = arr
+    shards_meta = []
+    for i, (key, shard) in enumerate(store.shards.items()):
+        arrays[f"shard{i}.stable_rows"] = shard.stable_rows
+        arrays[f"shard{i}.hot_rows"] = shard.hot_rows
+        if shard.stable_dead is not None:
+            arrays[f"shard{i}.stable_dead"] = shard.stable_dead
+        tiers = {}
+        for tier in ("stable", "hot"):
+            bm25 = getattr(shard, f"bm25_{tier}")
+            if bm25 is None:
+                continue
+            for name, arr in bm25.arrays().items():
+                arrays[f"shard{i}.{tier}.{name}"] = arr
+            tiers[tier] = dict(n_docs=bm25.n_docs, avgdl=bm25.avgdl, k1=bm25.k1, b=bm25.b, epsilon=bm25.epsilon)
+        shards_meta.append((key, tiers))
+    shm, manifest = _pack(arrays)
+    meta = {
+        "analyzer": store.analyzer.to_dict(),
+        "cities": list(table.cities.strings),
+        "occasions": list(table.occasions.strings),
+        "shards": shards_meta,
+        "settings": settings.model_dump(),
+    }
+    return shm, manifest, meta
+
+def attach_store(arrays: Dict[str, np.ndarray], meta: Dict[str, Any]) -> SimpleNamespace:
+    """Store-shaped object over shared arrays, enough for `HybridRetriever.rank`."""
+    table = DocTable.from_filter_columns(
+        {c: arrays[f"table.{c}"] for c in DocTable.FILTER_COLUMNS}, meta["cities"], meta["occasions"])
+    shards = {}
+    for i, (key, tiers) in enumerate(meta["shards"]):
+        idx = {}
+        for tier, params in tiers.items():
+            idx[tier] = BM25Index.from_arrays(
+                {name: arrays[f"shard{i}.{tier}.{name}"] for name in BM25Index.ARRAYS}, **params)
+        shards[key] = Shard.from_indexes(key, arrays[f"shard{i}.stable_rows"], arrays[f"shard{i}.hot_rows"],
+                                         idx.get("stable"), idx.get("hot"), arrays.get(f"shard{i}.stable_dead"))
+    filter_index = FilterIndex.from_arrays(
+        {k[len("filter."):]: v for k, v in arrays.items() if k.startswith("filter.")}, table)
+    return SimpleNamespace(
+        table=table, shards=shards, filter_index=filter_index, analyzer=Analyzer.from_dict(meta["analyzer"]),
+        stable_rows=arrays["store.stable_rows"], hot_rows=arrays["store.hot_rows"],
+        faiss_stable=None, faiss_hot=None, model=None,
+    )
+
+def _worker_main(shm_name: str, manifest: Manifest, meta: Dict[str, Any], requests, responses):
+    for k, v in meta["settings"].items():
+        setattr(settings, k, v)
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        retriever = HybridRetriever(attach_store(_attach(shm, manifest), meta))
+        while True:
+            msg = requests.get()
+            if msg is None:
+                break
+            req_id, query, filters = msg
+            try:
+                rows, scores = retriever.rank(query, filters)
+                responses.put((req_id, rows, scores, None))
+            except Exception as e:
+                responses.put((req_id, None, None, f"{type(e).__name__}: {e}"))
+    finally:
+        # drop the array views before unmapping
+        retriever = None
+        try:
+            shm.close()
+        except BufferError:
+            pass
+
+class _WorkerSet:
+    """Worker processes and the shared block for one store generation.
+
+    A retired set takes no new requests; it is closed (and its shared
+    memory unlinked) once the requests already sent to it have resolved.
+    """
+    def __init__(self, store, n_workers: int):
+        # a consistent snapshot: ingest / tier moves swap the indexes under this lock
+        with getattr(store, "_index_lock", threading.RLock()):
+            self.generation = store.generation
+            self.shm, manifest, meta = export_index(store)
+        ctx = mp.get_context("spawn")
+        self.requests = ctx.Queue()
+        self.responses = ctx.Queue()
+        self.pending: Dict[int, Future] = {}
+        self.retired = False
+        self._lock = threading.Lock()
+        self._closing = False
+        self.procs = [
+            ctx.Process(target=_worker_main, name=f"sahra-retrieval-{i}", daemon=True,
+                        args=(self.shm.name, manifest, meta, self.requests, self.responses))
+            for i in range(n_workers)
+        ]
+        for p in self.procs:
+            p.start()
+        self.dispatcher = threading.Thread(target=self._dispatch, name="sahra-retrieval-dispatch", daemon=True)
+        self.dispatcher.start()
+
+    def submit(self, req_id: int, query: str, filters: Dict[str, Any], fut: Future):
+        with self._lock:
+            self.pending[req_id] = fut
+        self.requests.put((req_id, query, filters))
+
+    def retire(self):
+        with self._lock:
+            self.retired = True
+            idle = not self.pending
+        if idle:
+            self._close_later()
+
+    def _close_later(self):
+        with self._lock:
+            if self._closing:
+                return
+            self._closing = True
+        threading.Thread(target=self.close, name="sahra-retrieval-retire", daemon=True).start()
+
+    def _dispatch(self):
+        while True:
+            msg = self.responses.get()
+            if msg is None:
+                return
+            req_id, rows, scores, err = msg
+            with self._lock:
+                fut = self.pending.pop(req_id, None)
+                drained = self.retired and not self.pending
+            if fut is not None:
+                # the waiter may have timed out and cancelled it
+                if err is not None:
+                    resolve_future(fut, exc=RuntimeError(f"retrieval worker failed: {err}"))
+                else:
+                    resolve_future(fut, (rows, scores))
+            if drained:
+                self._close_later()
+
+    def close(self):
+        for _ in self.procs:
+            self.requests.put(None)
+        for p in self.procs:
+            p.join(timeout=5)
+            if p.is_alive():
+                p.terminate()
+        self.responses.put(None)
+        if threading.current_thread() is not self.dispatcher:
+            self.dispatcher.join(timeout=5)
+        with self._lock:
+            for fut in self.pending.values():
+                resolve_future(fut, exc=RuntimeError("retrieval pool closed"))
+            self.pending.clear()
+        self.shm.close()
+        self.shm.unlink()
+
+class RetrievalPool:
+    """N retrieval processes over one shared copy of the index.
+
+    Drop-in for `HybridRetriever` in `build_graph` / `node_retrieve`: ranking
+    runs in the workers, top-n selection and doc views stay in this process.
+    Dense (FAISS) legs cannot be shipped to workers, so when they are enabled
+    ranking falls back to the in-process retriever.
+
+    When the store's generation changes (ingest batch, tier move) the next
+    request starts a background rebuild: the index is re-exported and a new
+    worker set spawned off the serving path, while requests keep going to
+    the current set. Every ingest batch bumps the generation, so rebuilds
+    start at most once per `retrieval_refresh_min_s`; until then offers
+    ingested since the export are not ranked by the workers, and deleted
+    ones are dropped from their answers. The swap is done under a lock, so concurrent requests
+    never see a half-closed set, and the old set finishes the requests it
+    already has before it exits.
+    """
+    def __init__(self, store, n_workers: Optional[int] = None):
+        self.store = store
+        self.local = HybridRetriever(store)
+        self.n_workers = n_workers or settings.retrieval_workers or os.cpu_count() or 1
+        self._ids = itertools.count()
+        self._swap_lock = threading.Lock()
+        self._current: Optional[_WorkerSet] = None
+        self._building: Optional[threading.Thread] = None
+        self._swapped_at = time.monotonic()
+        self.start()
+
+    # ---- lifecycle -----------------------------------------------------
+    def start(self):
+        if self.store.table is None:
+            self.store.build_indexes()
+        with self._swap_lock:
+            if self._current is None:
+                self._current = _WorkerSet(self.store, self.n_workers)
+                print(f"✅ Retrieval pool started: {self.n_workers} workers, "
+                      f"{self._current.shm.size / 2**20:.1f} MB shared index")
+
+    def close(self):
+        with self._swap_lock:
+            current, self._current = self._current, None
+        if current is not None:
+            current.close()
+
+    def refresh(self):
+        """Re-export after the store's indexes change (build or tier move); blocks until swapped."""
+        self._swap(_WorkerSet(self.store, self.n_workers))
+
+    def _swap(self, workers: _WorkerSet):
+        with self._swap_lock:
+            old = self._current
+            if old is not None:
+                self._current = workers
+                self._swapped_at = time.monotonic()
+        if old is None:
+            # closed while the new set was being built
+            workers.close()
+        else:
+            old.retire()
+
+    def _rebuild(self):
+        try:
+            self._swap(_WorkerSet(self.store, self.n_workers))
+        except Exception as e:
+            print(f"⚠️ Retrieval pool refresh failed, still serving generation "
+                  f"{self._current.generation if self._current else '?'}: {e}")
+        finally:
+            with self._swap_lock:
+                self._building = None
+
+    def _maybe_rebuild(self, workers: _WorkerSet):
+        """Start a background rebuild if `workers` is behind the store (caller holds `_swap_lock`)."""
+        if workers.generation == self.store.generation or self._building is not None:
+            return
+        if time.monotonic() - self._swapped_at < settings.retrieval_refresh_min_s:
+            return
+        self._building = threading.Thread(target=self._rebuild, name="sahra-retrieval-refresh", daemon=True)
+        self._building.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # ---- HybridRetriever contract --------------------------------------
+    def rank_async(self, query: str, filters: Dict[str, Any]) -> Future:
+        fut: Future = Future()
+        if self.store.faiss_stable is not None or self.store.faiss_hot is not None:
+            fut.set_result(self.local.rank(query, filters))
+            return fut
+        req_id = next(self._ids)
+        with self._swap_lock:
+            workers = self._current
+            if workers is None:
+                raise RuntimeError("retrieval pool closed")
+            self._maybe_rebuild(workers)
+            stale = workers.generation != self.store.generation
+            # registered before the lock is released, so a retire() that follows
+            # always sees this request and waits for it
+            workers.submit(req_id, query, dict(filters or {}), self._live_only(fut) if stale else fut)
+        return fut
+
+    def _live_only(self, fut: Future) -> Future:
+        """A future for an older worker set: rows deleted or replaced since its export are dropped.
+
+        Tables only grow, so the older set's rows are still valid rows of the current table.
+        """
+        inner: Future = Future()
+        def done(f: Future):
+            if f.exception() is not None:
+                resolve_future(fut, exc=f.exception())
+                return
+            rows, scores = f.result()
+            keep = self.store.table.live[rows]
+            resolve_future(fut, (rows[keep], scores[keep]))
+        inner.add_done_callback(done)
+        return inner
+
+    def rank(self, query: str, filters: Dict[str, Any]) -> Leg:
+        return self.rank_async(query, filters).result(timeout=settings.tool_timeout_s)
+
+    def materialize(self, query: str, rows: np.ndarray, scores: np.ndarray,
+                    k: Optional[int] = None) -> List[Dict[str, Any]]:
+        return self.local.materialize(query, rows, scores, k)
+
+    def search(self, query: str, filters: Dict[str, Any]) -> List[Dict[str, Any]]:
+        rows, scores = self.rank(query, filters)
+        return self.materialize(query, rows, scores)
+
+    async def arank(self, query: str, filters: Dict[str, Any], deadline: Optional[float] = None) -> Leg:
+        """`rank` without blocking the loop, waiting at most `tool_timeout_s` or until `deadline`.
+
+        Past that the workers' answer is dropped and the query is ranked in-process.
+        """
+        timeout = min(settings.tool_timeout_s, time_left(deadline))
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(self.rank_async(query, filters)), timeout)
+        except asyncio.TimeoutError:
+            print(f"   ⚠️ Retrieval workers did not answer within {timeout:.2f}s, ranking in-process")
+            return self.local.rank(query, filters)
+
+    async def asearch(self, query: str, filters: Dict[str, Any]) -> List[Dict[str, Any]]:
+        rows, scores = await self.arank(query, filters)
+        return self.materialize(query, rows, scores)